@@ -0,0 +1,46 @@
+""" Startup time of the package and the heavy dependencies each import loads
+
+Every statement is run in a fresh interpreter and the best time of several runs is reported, minus the
+startup of an interpreter that imports nothing.
+
+Usage::
+
+    python benchmarks/import_time.py [runs]
+"""
+import sys
+import time
+import subprocess
+
+STATEMENTS = [
+    'import sdownloader',
+    'from sdownloader.common import sentinel_scene_interpreter',
+    'from sdownloader import Sentinel2',
+    'from sdownloader import Landsat8',
+    'from sdownloader.landsat8 import api',
+]
+
+HEAVY_MODULES = ['requests', 'urllib3', 'usgs', 'homura', 'pycurl', 'aiohttp']
+
+
+def run(statement):
+    """ Returns the seconds it takes to run a statement in a new interpreter and the heavy modules it loaded """
+    code = '{0}\nimport sys\nprint(",".join(m for m in {1!r} if m in sys.modules))'.format(statement, HEAVY_MODULES)
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return time.time() - start, output.decode().strip()
+
+
+def best(statement, runs):
+    return min(run(statement)[0] for i in range(runs))
+
+
+def main(runs):
+    baseline = best('pass', runs)
+    print('{0:<60}{1:>10}  {2}'.format('', 'ms', 'heavy modules'))
+    for statement in STATEMENTS:
+        seconds = best(statement, runs) - baseline
+        print('{0:<60}{1:>10.1f}  {2}'.format(statement, seconds * 1000, run(statement)[1] or '-'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
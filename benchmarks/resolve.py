@@ -0,0 +1,67 @@
+""" Throughput of the bulk scene resolution against the per-scene functions
+
+Usage::
+
+    python benchmarks/resolve.py [number of scenes]
+
+The package is imported from the checkout the script is in, it doesn't need to be installed.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sdownloader import common, resolve
+
+LANDSAT_BANDS = [4, 3, 2, 'QA', 'MTL']
+SENTINEL_BANDS = [4, 3, 2]
+
+
+def landsat_scenes(count):
+    return ['LC8%03d%03d2015%03dLGN00' % (i % 233 + 1, i % 248 + 1, i % 365 + 1) for i in range(count)]
+
+
+def sentinel_scenes(count):
+    name = 'S2A_OPER_MSI_L1C_TL_SGS__2016%02d%02dT150955_A003951_T%02dRCS_N02.01'
+    return [name % (i % 12 + 1, i % 28 + 1, i % 60 + 1) for i in range(count)]
+
+
+def per_scene_landsat(scenes):
+    results = []
+    for scene in scenes:
+        sat = common.landsat_scene_interpreter(scene)
+        results.append(([common.amazon_s3_url_landsat8(sat, band) for band in LANDSAT_BANDS],
+                        common.google_storage_url_landsat8(sat)))
+    return results
+
+
+def per_scene_sentinel(scenes):
+    results = []
+    for scene in scenes:
+        path = common.sentinel_scene_interpreter(scene)
+        results.append([common.amazon_s3_url_sentinel2(path, band) for band in SENTINEL_BANDS])
+    return results
+
+
+def measure(func, scenes):
+    start = time.time()
+    func(scenes)
+    return len(scenes) / (time.time() - start)
+
+
+def main(count):
+    cases = [
+        ('landsat8', landsat_scenes(count), per_scene_landsat, lambda s: resolve.landsat8(s, LANDSAT_BANDS)),
+        ('sentinel2', sentinel_scenes(count), per_scene_sentinel, lambda s: resolve.sentinel2(s, SENTINEL_BANDS)),
+    ]
+
+    print('{0:<12}{1:>16}{2:>16}{3:>10}'.format('', 'per scene/s', 'bulk/s', 'speedup'))
+    for name, scenes, single, bulk in cases:
+        single_rate = measure(single, scenes)
+        bulk_rate = measure(bulk, scenes)
+        print('{0:<12}{1:>16,.0f}{2:>16,.0f}{3:>9.1f}x'.format(name, single_rate, bulk_rate, bulk_rate / single_rate))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -1,2 +1,25 @@
-from .landsat8 import Landsat8
-from .sentinel2 import Sentinel2
+""" Landsat 8 and Sentinel 2 downloaders
+
+The downloaders are imported on first access, so that ``import sdownloader`` and the helper modules
+(e.g. ``sdownloader.common``) don't load the HTTP stack and the USGS client until a download needs them.
+"""
+import importlib
+
+__all__ = ['Landsat8', 'Sentinel2']
+
+_modules = {
+    'Landsat8': 'landsat8',
+    'Sentinel2': 'sentinel2',
+}
+
+
+def __getattr__(name):
+    if name in _modules:
+        value = getattr(importlib.import_module('.' + _modules[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_modules))
@@ -0,0 +1,330 @@
+""" asyncio download engine
+
+Multiplexes band and tarball transfers of many scenes over a single event loop and a single aiohttp
+session. aiohttp is an optional dependency and is only imported when this engine is used.
+
+Requests follow the transport policy of their host like the requests engine: they take a token from
+the rate limit of the host, are retried with backoff when they are throttled or fail, and transfers
+wait for a slot of the AIMD concurrency limit. Files are written in the default executor so that the
+event loop never blocks on the disk.
+"""
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from . import policy, events
+from .download import Scenes, collect_scenes, raise_failures
+from .common import (landsat_scene_interpreter, google_storage_url_landsat8, check_create_folder, probe_cache,
+                     RemoteFile)
+from .policy import check_status
+from .integrity import Checksum
+from .session import retry_after
+from .errors import RemoteFileDoesntExist, DownloadError
+
+logger = logging.getLogger('sdownloader')
+
+# downloader options the engine doesn't implement, with the value that leaves them off
+UNSUPPORTED_OPTIONS = [
+    ('resume', False),
+    ('verify', False),
+    ('cache', None),
+    ('stream_extract', False),
+    ('segment_size', None),
+    ('race', False),
+    ('hedge', None),
+    ('revalidate', 'always'),
+]
+
+
+def check_options(downloader):
+    """ Raises ValueError if options the asyncio engine doesn't implement are set on the downloader """
+    unsupported = [name for name, off in UNSUPPORTED_OPTIONS if getattr(downloader, name, off) != off]
+    if unsupported:
+        raise ValueError("engine='asyncio' doesn't support {0}, use engine='requests'".format(', '.join(unsupported)))
+
+
+class AsyncFetcher(object):
+    """ Downloads files over a pooled aiohttp session.
+
+    :param limit:
+        The maximum number of simultaneous connections. Default value is 100.
+    :type limit:
+        Integer
+    :param limit_per_host:
+        The maximum number of simultaneous connections to the same host. Default value is 8.
+    :type limit_per_host:
+        Integer
+    """
+
+    chunk_size = 1024 * 1024
+    # seconds between two attempts to take a transfer slot of a host
+    poll_interval = 0.05
+
+    def __init__(self, limit=100, limit_per_host=8):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+        self.session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, method, url):
+        """ Sends a request with the transport policy of its host and returns the response, which
+        must be released. Throttled (429) and failed (5xx, connection errors) requests are retried
+        with backoff, see session.PooledAdapter.
+        """
+        host = policy.for_url(url)
+        attempt = 0
+        while True:
+            wait = host.reserve()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = host.reserve()
+
+            delay = None
+            start = time.time()
+            try:
+                response = await self.session.request(method, url)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                host.record(error=e)
+                events.emit('request', method=method, url=url, host=host.host, status=None,
+                            elapsed=time.time() - start, error=str(e))
+                if attempt >= host.retries:
+                    raise
+                logger.warning('{0} failed: {1}'.format(url, e))
+                reason = type(e).__name__
+            else:
+                host.record(response.status)
+                events.emit('request', method=method, url=url, host=host.host, status=response.status,
+                            elapsed=time.time() - start, error=None)
+                if not policy.is_transient(response.status) or attempt >= host.retries:
+                    return response
+                logger.warning('{0} returned {1}'.format(url, response.status))
+                delay = retry_after(response)
+                reason = str(response.status)
+                response.release()
+
+            delay = min(max(policy.backoff(attempt), delay or 0), policy.max_backoff())
+            events.emit('retry', url=url, host=host.host, attempt=attempt + 1, reason=reason, delay=delay)
+            await asyncio.sleep(delay)
+            host.retried()
+            attempt += 1
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """ Holds one of the concurrent transfer slots of the host of a url """
+        limiter = policy.for_url(url).limiter
+        while not limiter.try_acquire():
+            await asyncio.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    async def get_remote_file(self, url):
+        """ Sends a HEAD request for a url, or returns the result of an earlier one from the probe cache,
+        see common.get_remote_file.
+        """
+        remote = probe_cache.get(url)
+
+        if remote is None:
+            async with await self.request('HEAD', url) as response:
+                if policy.is_transient(response.status):
+                    # still throttled or failing after the retries, not a missing file
+                    check_status(url, response.status)
+                checksum = Checksum.from_headers(response.headers)
+                remote = RemoteFile(url, response.status, checksum.size, checksum.etag, checksum.expected_md5)
+            probe_cache.put(remote)
+
+        return remote
+
+    async def remote_file_exists(self, url):
+        """ Checks whether the remote file exists. Raises RemoteFileDoesntExist if it doesn't. """
+        remote = await self.get_remote_file(url)
+        check_status(url, remote.status)
+        return True
+
+    async def get_remote_file_size(self, url):
+        """ Gets the filesize of a remote file, or None if the host doesn't report it. """
+        remote = await self.get_remote_file(url)
+        check_status(url, remote.status)
+        return remote.size
+
+    async def fetch(self, url, path):
+        """ Downloads a given url to a given path and returns the path to the file. The result of an earlier
+        existence check of the url is used instead of a new HEAD request, otherwise the size of a file that
+        already exists is compared with the headers of the GET response like the requests engine does.
+        """
+        # remove query parameters from the filename
+        filename = url.split('/')[-1].split('?')[0]
+        target = os.path.join(path, filename)
+        loop = asyncio.get_running_loop()
+
+        remote = probe_cache.get(url)
+        probe_cache.pop(url)
+        if remote is not None:
+            check_status(url, remote.status)
+
+        existing_size = os.path.getsize(target) if os.path.exists(target) else None
+        if remote is not None and remote.size is not None and existing_size == remote.size:
+            logger.info('{0} already exists on your system'.format(filename))
+            return target
+
+        async with self.slot(url):
+            async with await self.request('GET', url) as response:
+                check_status(url, response.status)
+                size = response.headers.get('content-length')
+                if remote is None and existing_size is not None and size is not None and int(size) == existing_size:
+                    logger.info('{0} already exists on your system'.format(filename))
+                    return target
+
+                f = await loop.run_in_executor(None, open, target, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        await loop.run_in_executor(None, f.write, chunk)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+
+        logger.info('stored at {0}'.format(path))
+        return target
+
+
+async def gather(coros):
+    """ Runs coroutines concurrently and returns (result, exception) tuples in their order """
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    return [(None, r) if isinstance(r, Exception) else (r, None) for r in results]
+
+
+async def s3(downloader, fetcher, scenes, bands):
+    """ asyncio version of S3DownloadMixin.s3. A scene with a file that is missing or can't be checked
+    is not downloaded, the other scenes are, and the failures are raised at the end.
+    """
+    logger.info('Source: AWS S3')
+    jobs = downloader._s3_jobs(scenes, bands)
+
+    all_urls = [url for scene, folder, urls in jobs for url in urls]
+    results = await gather(fetcher.remote_file_exists(url) for url in all_urls)
+    failures = dict((url, e) for url, (r, e) in zip(all_urls, results) if e is not None)
+    for url, e in sorted(failures.items()):
+        logger.error('{0} failed: {1}'.format(url, e))
+
+    jobs = [job for job in jobs if not any(url in failures for url in job[2])]
+
+    loop = asyncio.get_running_loop()
+    for scene, folder, urls in jobs:
+        await loop.run_in_executor(None, check_create_folder, folder)
+
+    results = await gather(fetcher.fetch(url, folder) for scene, folder, urls in jobs for url in urls)
+    try:
+        scene_objs = collect_scenes(jobs, results, 'AWS S3')
+    except DownloadError as e:
+        scene_objs = e.scenes
+        failures.update(e.failures)
+
+    raise_failures(failures, scene_objs, 'AWS S3')
+    return scene_objs
+
+
+async def google(downloader, fetcher, scenes, bands=None):
+    """ asyncio version of Landsat8.google. The tarballs are stored whole, the bands are recorded on the scenes. """
+    scene_objs = Scenes()
+    logger.info('Source: Google Storge')
+
+    for scene in scenes:
+        url = google_storage_url_landsat8(landsat_scene_interpreter(scene))
+        await fetcher.remote_file_exists(url)
+        scene_objs.add_with_files(scene, await fetcher.fetch(url, downloader.download_dir), bands)
+
+    return scene_objs
+
+
+async def usgs(downloader, fetcher, scenes, bands=None):
+    """ asyncio version of Landsat8.usgs. The batched EarthExplorer API calls run in the default executor. """
+    loop = asyncio.get_running_loop()
+
+    urls = await loop.run_in_executor(None, downloader._usgs_download_urls, scenes)
+    missing = [scene for scene in scenes if scene not in urls]
+    if missing:
+        raise RemoteFileDoesntExist('{0} not available on AWS S3, Google or USGS Earth Explorer'.format(
+            ' - '.join(missing)))
+
+    logger.info('Source: USGS EarthExplorer')
+    jobs = [(scene, downloader.download_dir, [urls[scene]]) for scene in scenes]
+    results = await gather(fetcher.fetch(urls[scene], downloader.download_dir) for scene in scenes)
+    scene_objs = collect_scenes(jobs, results, 'USGS Earth Explorer')
+    for scene in scene_objs:
+        scene.bands = bands
+    return scene_objs
+
+
+async def landsat8_scene(downloader, fetcher, scene, bands, requested=None):
+    """ Downloads a Landsat-8 scene from AWS S3 or Google Storage, in that order """
+    # if bands are not provided, directly go to Google
+    if isinstance(bands, list):
+        try:
+            return await s3(downloader, fetcher, [scene], bands)
+        except RemoteFileDoesntExist:
+            pass
+
+    return await google(downloader, fetcher, [scene], requested)
+
+
+async def landsat8_download(downloader, scenes, bands=None):
+    """ asyncio version of Landsat8.download. The scenes that are neither on S3 nor on Google Storage are
+    downloaded from USGS together. The scenes that failed are raised together in a DownloadError once
+    all the others are downloaded.
+    """
+    requested = downloader._band_converter(bands)
+    bands = downloader._s3_bands(requested)
+
+    async with AsyncFetcher(limit_per_host=downloader.per_host_limit) as fetcher:
+        results = await gather(landsat8_scene(downloader, fetcher, scene, bands, requested) for scene in scenes)
+
+        scene_objs = Scenes()
+        usgs_scenes = []
+        failures = {}
+        for scene, (result, e) in zip(scenes, results):
+            if isinstance(e, RemoteFileDoesntExist):
+                usgs_scenes.append(scene)
+            elif e is not None:
+                logger.error('{0} failed: {1}'.format(scene, e))
+                failures[scene] = e
+            else:
+                scene_objs.merge(result)
+
+        if usgs_scenes:
+            try:
+                scene_objs.merge(await usgs(downloader, fetcher, usgs_scenes, requested))
+            except DownloadError as e:
+                scene_objs.merge(e.scenes or Scenes())
+                failures.update((scene, e) for scene in usgs_scenes if scene not in scene_objs)
+            except Exception as e:
+                failures.update((scene, e) for scene in usgs_scenes)
+
+    scene_objs = Scenes([scene_objs[scene] for scene in scenes if scene in scene_objs])
+    if failures:
+        raise DownloadError('Failed to download {0} scenes'.format(len(failures)), failures, scene_objs)
+
+    return scene_objs
+
+
+async def sentinel2_download(downloader, scenes, bands):
+    """ asyncio version of Sentinel2.download """
+    bands = downloader._band_converter(bands)
+
+    async with AsyncFetcher(limit_per_host=downloader.per_host_limit) as fetcher:
+        return await s3(downloader, fetcher, scenes, bands)
+
+
+def run(coro):
+    """ Runs a coroutine to completion on a new event loop """
+    return asyncio.run(coro)
@@ -0,0 +1,173 @@
+""" Shared local file cache
+
+Downloaded files are kept in a cache directory under a key derived from their url, ETag and size,
+and are hard-linked (or reflinked, or copied as a last resort) into the ``download_dir`` of each job
+that requests them. The index is a SQLite database, so a cache directory can be shared by several
+downloaders and processes. The least recently used files are evicted when the cache grows beyond
+``max_bytes``.
+"""
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from . import events
+from .common import check_create_folder
+
+logger = logging.getLogger('sdownloader')
+
+FICLONE = 0x40049409
+
+
+def link(src, dst):
+    """ Hard-links src to dst, falling back to a reflink and then to a copy """
+    if os.path.exists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return
+    except (ImportError, IOError, OSError):
+        pass
+
+    shutil.copyfile(src, dst)
+
+
+class FileCache(object):
+    """ Size-bounded, LRU-evicted cache of downloaded files.
+    :param cache_dir:
+        The directory of the cache
+    :type cache_dir:
+        String
+    :param max_bytes:
+        The maximum size of the cached files. Default value is None (unbounded).
+    :type max_bytes:
+        Integer
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = check_create_folder(cache_dir)
+        self.max_bytes = max_bytes
+        self.index = os.path.join(self.cache_dir, 'index.sqlite')
+        self.hits = 0
+        self.misses = 0
+        self.evicted_bytes = 0
+        self.lock = threading.Lock()
+
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, url TEXT, etag TEXT, '
+                       'size INTEGER, last_access REAL)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.index, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def key(url, etag, size):
+        return hashlib.sha1('{0}\n{1}\n{2}'.format(url, etag or '', size).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, url, etag, size, target):
+        """ Links the cached copy of a file into target.
+        :returns:
+            **True** on a cache hit and **False** on a miss
+        """
+        key = self.key(url, etag, size)
+        path = self.path(key)
+
+        with self._connect() as db:
+            found = db.execute('SELECT size FROM files WHERE key = ?', (key,)).fetchone()
+            if found and os.path.exists(path) and os.path.getsize(path) == size:
+                db.execute('UPDATE files SET last_access = ? WHERE key = ?', (time.time(), key))
+            else:
+                found = None
+
+        if found:
+            try:
+                link(path, target)
+            except (IOError, OSError):
+                # evicted by another process in the meantime
+                found = None
+
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        events.emit('cache', url=url, cache='shared', hit=bool(found))
+
+        if found:
+            logger.info('{0} found in the cache'.format(os.path.basename(target)))
+            return True
+
+        return False
+
+    def put(self, url, etag, size, source):
+        """ Adds a downloaded file to the cache and evicts the least recently used files if needed """
+        key = self.key(url, etag, size)
+        path = self.path(key)
+
+        check_create_folder(os.path.dirname(path))
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        link(source, tmp)
+        os.replace(tmp, path)
+
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', (key, url, etag, size, time.time()))
+
+        self.evict()
+
+    def evict(self):
+        """ Removes the least recently used files until the cache fits in max_bytes """
+        if self.max_bytes is None:
+            return
+
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+            evicted = 0
+
+            for key, size in db.execute('SELECT key, size FROM files ORDER BY last_access').fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute('DELETE FROM files WHERE key = ?', (key,))
+                if os.path.exists(self.path(key)):
+                    os.remove(self.path(key))
+                total -= size
+                evicted += size
+
+        with self.lock:
+            self.evicted_bytes += evicted
+
+    def stats(self):
+        """ Returns the cache hits, misses, evicted bytes and current size """
+        with self._connect() as db:
+            files, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files').fetchone()
+
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted_bytes': self.evicted_bytes,
+                'files': files,
+                'bytes': size,
+            }
@@ -0,0 +1,194 @@
+""" sdownload command line interface
+
+Reads scene IDs from a file or stdin, one per line, and downloads them with at most ``--workers``
+scenes in flight. The input is streamed, so the manifest can have any number of lines. A JSON line is
+written to the result manifest for every scene as soon as it is done or has failed.
+
+Each scene downloads its files on ``--band-workers`` threads of its own, so up to ``--workers`` times
+``--band-workers`` files are requested at once, of which at most ``--per-host-limit`` transfer from
+the same host at the same time.
+
+The downloaders are only imported once the arguments are parsed, so that ``--help`` and argument
+errors don't pay for them.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+
+logger = logging.getLogger('sdownloader')
+
+SATELLITES = ['landsat8', 'sentinel2']
+
+
+def parse_bands(value):
+    """ Parses a comma separated list of band numbers or names, e.g. ``4,3,2`` or ``red,nir,quality`` """
+    bands = []
+    for band in value.split(','):
+        band = band.strip()
+        if band:
+            bands.append(int(band) if band.isdigit() else band)
+    return bands
+
+
+def read_scenes(lines, skip=None):
+    """ Yields the scene IDs of a manifest, one per line. Blank lines, ``#`` comments and the scenes in
+    skip are left out.
+    :param lines:
+        A file object or any iterable of lines
+    :type lines:
+        Iterable
+    :param skip:
+        Scene IDs not to yield. Default value is None.
+    :type skip:
+        Set
+    :returns:
+        (Generator) of scene IDs
+    """
+    for line in lines:
+        scene = line.split('#')[0].strip()
+        if scene and not (skip and scene in skip):
+            yield scene
+
+
+def completed_scenes(path):
+    """ Returns the scene IDs recorded as ok in the result manifest of an earlier run """
+    done = set()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of an interrupted run
+                    continue
+                if record.get('status') == 'ok':
+                    done.add(record['scene'])
+    except (IOError, OSError):
+        pass
+    return done
+
+
+class ResultWriter(object):
+    """ Writes a JSON line per scene to the result manifest and counts the results.
+    :param output:
+        A file object
+    :type output:
+        File
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.counts = {'ok': 0, 'failed': 0}
+
+    def write(self, scene, status, **fields):
+        fields.update({'scene': scene, 'status': status})
+        self.output.write(json.dumps(fields, sort_keys=True) + '\n')
+        self.output.flush()
+        self.counts[status] += 1
+
+    def ok(self, scene):
+        self.write(scene.name, 'ok', files=scene.files)
+
+    def failed(self, scene, error):
+        self.write(scene, 'failed', error=str(error) or error.__class__.__name__,
+                   error_type=error.__class__.__name__)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='sdownload', description='Download Landsat 8 and Sentinel 2 scenes.')
+    parser.add_argument('satellite', choices=SATELLITES, help='The satellite of the scenes')
+    parser.add_argument('manifest', nargs='?', default='-',
+                        help='A file with one scene ID per line. Default is stdin.')
+    parser.add_argument('-d', '--download-dir', default='.', help='The folder to download into. Default is .')
+    parser.add_argument('-o', '--output', default='-',
+                        help='The result manifest, a JSON line per scene. Default is stdout.')
+    parser.add_argument('-b', '--bands', type=parse_bands,
+                        help='Comma separated band numbers or names, e.g. 4,3,2. Required for sentinel2.')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='The number of scenes downloaded at the same time. Default is 4.')
+    parser.add_argument('--band-workers', type=int, default=4,
+                        help='The number of files of each scene downloaded at the same time. Up to --workers '
+                             'times --band-workers threads are used. Default is 4.')
+    parser.add_argument('--per-host-limit', type=int,
+                        help='The maximum number of concurrent transfers and kept-alive connections per host. '
+                             'Default is 32.')
+    parser.add_argument('--cache-dir', help='A shared cache directory, see sdownloader.cache.FileCache')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue interrupted downloads, skip the scenes that are complete on disk and, '
+                             'if --output is a file, the scenes it records as ok')
+    parser.add_argument('--usgs-user', default=os.environ.get('SDOWNLOAD_USGS_USER'),
+                        help='USGS EarthExplorer user name, for Landsat 8 scenes not on AWS or Google. '
+                             'Default is $SDOWNLOAD_USGS_USER.')
+    parser.add_argument('--usgs-pass', default=os.environ.get('SDOWNLOAD_USGS_PASS'),
+                        help='USGS EarthExplorer password. Prefer $SDOWNLOAD_USGS_PASS, the command line of a '
+                             'process is visible to other users.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log the progress of the downloads')
+    return parser
+
+
+def make_downloader(args):
+    """ Returns the Landsat8 or Sentinel2 downloader of the parsed arguments """
+    options = {
+        'max_workers': args.band_workers,
+        'cache': args.cache_dir,
+        'resume': args.resume,
+        'revalidate': 'never' if args.resume else 'always',
+    }
+
+    if args.per_host_limit:
+        from . import policy, session
+        policy.configure(max_concurrency=args.per_host_limit)
+        session.configure(pool_maxsize=args.per_host_limit)
+        options['per_host_limit'] = args.per_host_limit
+
+    if args.satellite == 'landsat8':
+        from .landsat8 import Landsat8
+        return Landsat8(args.download_dir, usgs_user=args.usgs_user, usgs_pass=args.usgs_pass, **options)
+
+    from .sentinel2 import Sentinel2
+    return Sentinel2(args.download_dir, **options)
+
+
+def main(argv=None):
+    """ Runs the sdownload command.
+    :returns:
+        (Integer) the exit status: 0 if every scene was downloaded, 1 if some failed
+    """
+    parser = build_parser()
+    args = parser.parse_intermixed_args(argv)
+    if args.satellite == 'sentinel2' and not args.bands:
+        parser.error('--bands is required for sentinel2')
+    for name in ('workers', 'band_workers', 'per_host_limit'):
+        if getattr(args, name) is not None and getattr(args, name) < 1:
+            parser.error('--{0} must be at least 1'.format(name.replace('_', '-')))
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    skip = None
+    if args.resume and args.output != '-':
+        skip = completed_scenes(args.output)
+
+    downloader = make_downloader(args)
+
+    manifest = sys.stdin if args.manifest == '-' else open(args.manifest)
+    output = sys.stdout if args.output == '-' else open(args.output, 'a' if args.resume else 'w')
+    writer = ResultWriter(output)
+    try:
+        for scene in downloader.iter_download(read_scenes(manifest, skip), args.bands, max_in_flight=args.workers,
+                                              on_error=writer.failed):
+            writer.ok(scene)
+    finally:
+        if manifest is not sys.stdin:
+            manifest.close()
+        if output is not sys.stdout:
+            output.close()
+
+    logger.info('{0} scenes downloaded, {1} failed'.format(writer.counts['ok'], writer.counts['failed']))
+    return 1 if writer.counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
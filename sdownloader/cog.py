@@ -0,0 +1,450 @@
+""" Windowed reads of cloud optimized GeoTIFFs
+
+The header and the IFDs of a tiled GeoTIFF are read with HTTP Range requests, and only the tiles that
+cover a pixel window (or a bounding box in the coordinates of the image) are fetched, from the full
+resolution image or one of its internal overviews. The compressed tiles are copied as they are into a
+small local GeoTIFF, so nothing has to be decoded. The window is extended to the tile boundaries.
+"""
+import os
+import math
+import struct
+import logging
+
+from .session import get_session
+from .common import run_concurrently
+from .policy import check_status
+from .errors import NotCloudOptimized, RangeNotSupported
+
+logger = logging.getLogger('sdownloader')
+
+# TIFF tags
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+SAMPLES_PER_PIXEL = 277
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+
+# tags copied from the source image into the window
+COPIED_TAGS = [258, 259, 262, 277, 284, 317, 339, 347, 34735, 34736, 34737, 42112, 42113]
+GEO_TAGS = [MODEL_PIXEL_SCALE, MODEL_TIEPOINT, 34735, 34736, 34737]
+
+# struct format and size of the TIFF field types
+TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('I', 8), 6: ('b', 1), 7: ('s', 1), 8: ('h', 2),
+    9: ('i', 4), 10: ('i', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8),
+}
+ASCII = 2
+SHORT = 3
+LONG = 4
+DOUBLE = 12
+
+
+class Tag(object):
+    """ The type and values of a TIFF tag. ASCII and UNDEFINED values are kept as bytes. """
+
+    __slots__ = ('type', 'values')
+
+    def __init__(self, type, values):
+        self.type = type
+        self.values = values
+
+    def encode(self, order):
+        if isinstance(self.values, bytes):
+            return self.values
+        fmt = TYPES[self.type][0]
+        return struct.pack('{0}{1}{2}'.format(order, len(self.values), fmt), *self.values)
+
+    @property
+    def count(self):
+        if isinstance(self.values, bytes):
+            return len(self.values)
+        return len(self.values) // (2 if self.type in [5, 10] else 1)
+
+
+class IFD(object):
+    """ An image file directory: one image (the full resolution image, an overview or a mask) """
+
+    def __init__(self, tags):
+        self.tags = tags
+
+    def get(self, tag, default=None):
+        return self.tags[tag].values if tag in self.tags else default
+
+    @property
+    def width(self):
+        return self.get(IMAGE_WIDTH)[0]
+
+    @property
+    def height(self):
+        return self.get(IMAGE_LENGTH)[0]
+
+    @property
+    def tiled(self):
+        return TILE_OFFSETS in self.tags
+
+    @property
+    def tile_size(self):
+        return self.get(TILE_WIDTH)[0], self.get(TILE_LENGTH)[0]
+
+    @property
+    def tiles_across(self):
+        return -(-self.width // self.tile_size[0])
+
+    @property
+    def tiles_down(self):
+        return -(-self.height // self.tile_size[1])
+
+    @property
+    def planes(self):
+        if self.get(PLANAR_CONFIGURATION, (1,))[0] == 2:
+            return self.get(SAMPLES_PER_PIXEL, (1,))[0]
+        return 1
+
+    @property
+    def is_mask(self):
+        return bool(self.get(NEW_SUBFILE_TYPE, (0,))[0] & 4)
+
+
+def read_ifds(read):
+    """ Parses the IFDs of a TIFF (classic or BigTIFF).
+    :param read:
+        A function returning ``length`` bytes of the file from ``offset``
+    :type read:
+        Callable
+    :returns:
+        (String) the byte order (``<`` or ``>``) and (List) of IFD
+    """
+    header = read(0, 16)
+    if header[:2] == b'II':
+        order = '<'
+    elif header[:2] == b'MM':
+        order = '>'
+    else:
+        raise NotCloudOptimized('Not a TIFF file')
+
+    magic = struct.unpack(order + 'H', header[2:4])[0]
+    if magic == 42:
+        offset_fmt, count_fmt, entry_fmt, inline = 'I', 'H', 'HHI4s', 4
+        offset = struct.unpack(order + 'I', header[4:8])[0]
+    elif magic == 43:
+        offset_fmt, count_fmt, entry_fmt, inline = 'Q', 'Q', 'HHQ8s', 8
+        offset = struct.unpack(order + 'Q', header[8:16])[0]
+    else:
+        raise NotCloudOptimized('Not a TIFF file')
+
+    count_size = struct.calcsize(order + count_fmt)
+    entry_size = struct.calcsize(order + entry_fmt)
+    offset_size = struct.calcsize(order + offset_fmt)
+
+    ifds = []
+    while offset:
+        entries = struct.unpack(order + count_fmt, read(offset, count_size))[0]
+        data = read(offset + count_size, entries * entry_size + offset_size)
+
+        tags = {}
+        for i in range(entries):
+            tag, type, count, value = struct.unpack(order + entry_fmt, data[i * entry_size:(i + 1) * entry_size])
+            if type not in TYPES:
+                continue
+
+            fmt, size = TYPES[type]
+            size *= count
+            raw = value[:size] if size <= inline else read(struct.unpack(order + offset_fmt, value)[0], size)
+
+            if fmt == 's':
+                tags[tag] = Tag(type, raw)
+            else:
+                values = count * (2 if type in [5, 10] else 1)
+                tags[tag] = Tag(type, struct.unpack('{0}{1}{2}'.format(order, values, fmt), raw))
+
+        ifds.append(IFD(tags))
+        offset = struct.unpack(order + offset_fmt, data[entries * entry_size:])[0]
+
+    return order, ifds
+
+
+def _image_block(order, tags, tiles, position, last):
+    """ Returns the bytes of an IFD written at ``position``, followed by its values and its tiles """
+    tags = dict(tags)
+    tags[TILE_OFFSETS] = Tag(LONG, (0,) * len(tiles))
+    tags[TILE_BYTE_COUNTS] = Tag(LONG, tuple(len(t) if t else 0 for t in tiles))
+
+    # the values that don't fit in the entries follow the IFD, and the tiles follow the values
+    end = position + 2 + 12 * len(tags) + 4
+    layout = []
+    for tag in sorted(tags):
+        size = len(tags[tag].encode(order))
+        layout.append((tag, end if size > 4 else None))
+        if size > 4:
+            end += size + size % 2
+
+    offsets = []
+    for tile in tiles:
+        offsets.append(end if tile else 0)
+        end += len(tile) if tile else 0
+    end += end % 2
+
+    if end > 0xffffffff:
+        raise ValueError('The window is too large for a classic TIFF')
+    tags[TILE_OFFSETS] = Tag(LONG, tuple(offsets))
+
+    block = [struct.pack(order + 'H', len(tags))]
+    values = []
+    for tag, value_offset in layout:
+        encoded = tags[tag].encode(order)
+        if value_offset is None:
+            block.append(struct.pack(order + 'HHI', tag, tags[tag].type, tags[tag].count) + encoded.ljust(4, b'\0'))
+        else:
+            block.append(struct.pack(order + 'HHII', tag, tags[tag].type, tags[tag].count, value_offset))
+            values.append(encoded + b'\0' * (len(encoded) % 2))
+    block.append(struct.pack(order + 'I', 0 if last else end))
+
+    block = b''.join(block + values + [tile for tile in tiles if tile])
+    return block.ljust(end - position, b'\0'), end
+
+
+def write_tiff(f, order, images):
+    """ Writes a tiled classic TIFF.
+    :param f:
+        A file opened for writing in binary mode
+    :type f:
+        File
+    :param order:
+        The byte order, ``<`` or ``>``
+    :type order:
+        String
+    :param images:
+        (tags, tiles) of each image, the full resolution image first followed by its overviews. The
+        tags are a dict of tag to Tag without the tile offsets and byte counts, and the tiles are the
+        compressed bytes of each tile (None for a sparse tile).
+    :type images:
+        List
+    """
+    f.write((b'II' if order == '<' else b'MM') + struct.pack(order + 'HI', 42, 8))
+
+    position = 8
+    for i, (tags, tiles) in enumerate(images):
+        block, position = _image_block(order, tags, tiles, position, i == len(images) - 1)
+        f.write(block)
+
+
+class RangeReader(object):
+    """ Reads byte ranges of a remote file over the shared session. The first ``header_size`` bytes are
+    fetched once and kept, since the IFDs of a cloud optimized GeoTIFF are at the start of the file.
+    Smaller reads outside of the kept bytes (e.g. the IFD of an overview at the end of the file) fetch
+    and keep a block of ``block_size`` bytes, so that an IFD and its values cost one request.
+    """
+
+    def __init__(self, url, header_size=64 * 1024, block_size=16 * 1024):
+        self.url = url
+        self.header_size = header_size
+        self.block_size = block_size
+        self.chunks = []
+        self.bytes_read = 0
+
+    def fetch(self, offset, length):
+        response = get_session().get(self.url, headers={'Range': 'bytes={0}-{1}'.format(offset, offset + length - 1)})
+        if response.status_code == 200:
+            response.close()
+            raise RangeNotSupported('{0} does not support range requests'.format(self.url))
+        check_status(self.url, response.status_code, (206,))
+
+        self.bytes_read += len(response.content)
+        return response.content
+
+    def read(self, offset, length, readahead=True):
+        if not self.chunks:
+            self.chunks.append((0, self.fetch(0, self.header_size)))
+
+        for start, data in self.chunks:
+            if start <= offset and offset + length <= start + len(data):
+                return data[offset - start:offset - start + length]
+
+        if not readahead or length >= self.block_size:
+            return self.fetch(offset, length)
+
+        data = self.fetch(offset, self.block_size)
+        self.chunks.append((offset, data))
+        return data[:length]
+
+
+def coalesce(ranges, gap=16 * 1024):
+    """ Merges (offset, length) byte ranges that are less than ``gap`` bytes apart """
+    merged = []
+    for offset, length in sorted(set(ranges)):
+        if merged and offset - (merged[-1][0] + merged[-1][1]) <= gap:
+            start = merged[-1][0]
+            merged[-1] = (start, max(merged[-1][1], offset + length - start))
+        else:
+            merged.append((offset, length))
+    return merged
+
+
+class COG(object):
+    """ A remote cloud optimized GeoTIFF.
+    :param url:
+        The url of the GeoTIFF
+    :type url:
+        String
+    :param header_size:
+        The number of bytes read at once from the start of the file to parse the IFDs. Default value
+        is 64 KB.
+    :type header_size:
+        Integer
+    """
+
+    def __init__(self, url, header_size=64 * 1024):
+        self.url = url
+        self.reader = RangeReader(url, header_size)
+        self.order, ifds = read_ifds(self.reader.read)
+        self.images = [ifd for ifd in ifds if not ifd.is_mask]
+
+        if not self.images or not all(ifd.tiled for ifd in self.images):
+            raise NotCloudOptimized('{0} is not a tiled GeoTIFF'.format(url))
+
+    @property
+    def overviews(self):
+        """ The number of internal overviews """
+        return len(self.images) - 1
+
+    def image(self, overview=0):
+        if not 0 <= overview < len(self.images):
+            raise ValueError('{0} has {1} overviews'.format(self.url, self.overviews))
+        return self.images[overview]
+
+    def transform(self, overview=0):
+        """ Returns the (x, y) origin and (x, y) pixel size of an overview, or None if the image isn't
+        georeferenced with a tiepoint and a pixel scale
+        """
+        full = self.images[0]
+        scale = full.get(MODEL_PIXEL_SCALE)
+        tiepoint = full.get(MODEL_TIEPOINT)
+        if not scale or not tiepoint:
+            return None
+
+        factor_x = float(full.width) / self.image(overview).width
+        factor_y = float(full.height) / self.image(overview).height
+        origin = (tiepoint[3] - tiepoint[0] * scale[0], tiepoint[4] + tiepoint[1] * scale[1])
+        return origin, (scale[0] * factor_x, scale[1] * factor_y)
+
+    def pixel_window(self, bbox=None, window=None, overview=0):
+        """ Returns the (col_off, row_off, width, height) window of an overview that covers a bounding
+        box (minx, miny, maxx, maxy) in the coordinates of the image, or a window of the full
+        resolution image
+        """
+        image = self.image(overview)
+
+        if bbox is not None:
+            transform = self.transform(overview)
+            if transform is None:
+                raise NotCloudOptimized('{0} is not georeferenced, use a pixel window'.format(self.url))
+            (x, y), (size_x, size_y) = transform
+            col0 = int(math.floor((bbox[0] - x) / size_x))
+            row0 = int(math.floor((y - bbox[3]) / size_y))
+            col1 = int(math.ceil((bbox[2] - x) / size_x))
+            row1 = int(math.ceil((y - bbox[1]) / size_y))
+        elif window is not None:
+            factor_x = float(self.images[0].width) / image.width
+            factor_y = float(self.images[0].height) / image.height
+            col0 = int(math.floor(window[0] / factor_x))
+            row0 = int(math.floor(window[1] / factor_y))
+            col1 = int(math.ceil((window[0] + window[2]) / factor_x))
+            row1 = int(math.ceil((window[1] + window[3]) / factor_y))
+        else:
+            raise ValueError('A bbox or a window is required')
+
+        col0, row0 = max(col0, 0), max(row0, 0)
+        col1, row1 = min(col1, image.width), min(row1, image.height)
+        if col1 <= col0 or row1 <= row0:
+            raise ValueError('The window does not intersect {0}'.format(self.url))
+
+        return col0, row0, col1 - col0, row1 - row0
+
+    def read(self, target, bbox=None, window=None, overview=0, max_workers=1):
+        """ Fetches the tiles covering a window and writes them into a local GeoTIFF.
+        :param target:
+            The path of the GeoTIFF to write
+        :type target:
+            String
+        :param bbox:
+            (minx, miny, maxx, maxy) in the coordinates of the image
+        :type bbox:
+            Tuple
+        :param window:
+            (col_off, row_off, width, height) in pixels of the full resolution image
+        :type window:
+            Tuple
+        :param overview:
+            0 for the full resolution image, 1 for the first overview and so on. Default value is 0.
+        :type overview:
+            Integer
+        :param max_workers:
+            The number of ranges fetched at the same time. Default value is 1.
+        :type max_workers:
+            Integer
+        :returns:
+            (String) the path to the file
+        """
+        image = self.image(overview)
+        col_off, row_off, width, height = self.pixel_window(bbox, window, overview)
+        tile_width, tile_height = image.tile_size
+
+        columns = range(col_off // tile_width, (col_off + width - 1) // tile_width + 1)
+        rows = range(row_off // tile_height, (row_off + height - 1) // tile_height + 1)
+        per_plane = image.tiles_across * image.tiles_down
+        indexes = [plane * per_plane + row * image.tiles_across + column
+                   for plane in range(image.planes) for row in rows for column in columns]
+
+        offsets = image.get(TILE_OFFSETS)
+        counts = image.get(TILE_BYTE_COUNTS)
+        ranges = coalesce([(offsets[i], counts[i]) for i in indexes if counts[i]])
+        results = run_concurrently(lambda r: self.reader.read(r[0], r[1], False), ranges, max_workers)
+
+        chunks = []
+        for (offset, length), (data, e) in zip(ranges, results):
+            if e is not None:
+                raise e
+            chunks.append((offset, data))
+
+        def tile(i):
+            if not counts[i]:
+                return None
+            for offset, data in chunks:
+                if offset <= offsets[i] < offset + len(data):
+                    return data[offsets[i] - offset:offsets[i] - offset + counts[i]]
+
+        tags = dict((tag, image.tags.get(tag) or self.images[0].tags[tag])
+                    for tag in COPIED_TAGS if tag in image.tags or (tag in GEO_TAGS and tag in self.images[0].tags))
+        tags[IMAGE_WIDTH] = Tag(LONG, (len(columns) * tile_width,))
+        tags[IMAGE_LENGTH] = Tag(LONG, (len(rows) * tile_height,))
+        tags[TILE_WIDTH] = Tag(SHORT, (tile_width,))
+        tags[TILE_LENGTH] = Tag(SHORT, (tile_height,))
+
+        transform = self.transform(overview)
+        if transform is not None:
+            (x, y), (size_x, size_y) = transform
+            scale = self.images[0].get(MODEL_PIXEL_SCALE)
+            tags[MODEL_PIXEL_SCALE] = Tag(DOUBLE, (size_x, size_y, scale[2] if len(scale) > 2 else 0.0))
+            tags[MODEL_TIEPOINT] = Tag(DOUBLE, (0.0, 0.0, 0.0, x + columns[0] * tile_width * size_x,
+                                                y - rows[0] * tile_height * size_y, 0.0))
+
+        with open(target + '.part', 'wb') as f:
+            write_tiff(f, self.order, [(tags, [tile(i) for i in indexes])])
+        os.replace(target + '.part', target)
+
+        logger.info('read {0} of {1} tiles of {2} ({3} bytes)'.format(
+            len(indexes), per_plane * image.planes, self.url, self.reader.bytes_read))
+        return target
+
+
+def read_window(url, target, bbox=None, window=None, overview=0, max_workers=1):
+    """ Writes the tiles of a remote cloud optimized GeoTIFF that cover a window into a local GeoTIFF.
+    See COG.read.
+    """
+    return COG(url).read(target, bbox, window, overview, max_workers)
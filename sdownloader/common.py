@@ -1,20 +1,82 @@
 import re
+import time
 import logging
 import datetime
+import threading
 from os import makedirs
-from os.path import join, exists, getsize
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os.path import join, exists, getsize, basename
 
-import requests
 from wordpad import pad
-from homura import download
 
-from .errors import IncorrectLandsat8SceneId, RemoteFileDoesntExist, IncorrectSentine2SceneId
+from . import policy, events
+from .integrity import Checksum
+from .errors import (IncorrectLandsat8SceneId, RemoteFileDoesntExist, IncorrectSentine2SceneId, RangeNotSupported,
+                     TransientError, TransferInterrupted)
 
 logger = logging.getLogger('sdownloader')
 S3_LANDSAT = 'http://landsat-pds.s3.amazonaws.com/'
 S3_SENTINEL = 'http://sentinel-s2-l1c.s3.amazonaws.com/'
 GOOGLE = 'http://storage.googleapis.com/earthengine-public/landsat/'
 
+RemoteFile = namedtuple('RemoteFile', ['url', 'status', 'size', 'etag', 'md5'])
+
+
+class ProbeCache(object):
+    """ Keeps the result of a HEAD request so that the existence check, the size check in fetch and
+    the download of a file share one round-trip. Entries expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl=300, maxsize=100000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self.entries[url]
+                return None
+            return entry[1]
+
+    def put(self, remote):
+        with self.lock:
+            self.entries.pop(remote.url, None)
+            self.entries[remote.url] = (time.time(), remote)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, url):
+        with self.lock:
+            self.entries.pop(url, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+probe_cache = ProbeCache()
+
+
+_mgrs_pattern = re.compile(r'(\d+)([A-Z])([A-Z]{2})')
+_compact_date = re.compile(r'^(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2}))?$')
+_slashes = re.compile(r'(^/|/$)')
+
+
+def _parse_date(value, fmt):
+    """ strptime for the compact dates of scene ids (%Y%m%d and %Y%m%dT%H%M%S), without parsing the
+    format for every scene
+    """
+    match = _compact_date.match(value)
+    if match is None or (match.group(4) is None) != ('T' not in fmt):
+        return datetime.datetime.strptime(value, fmt)
+    return datetime.datetime(*[int(g) for g in match.groups() if g is not None])
+
 
 def sentinel_scene_interpreter(scene_name):
     """ This function converts a tile/scene name
@@ -31,7 +93,7 @@ def sentinel_scene_interpreter(scene_name):
 
         if len(splitted) > 5:
             version = int(splitted[-1].split('.')[-1]) - 1
-            date = datetime.datetime.strptime(splitted[-4], '%Y%m%dT%H%M%S')
+            date = _parse_date(splitted[-4], '%Y%m%dT%H%M%S')
 
             mgrs = splitted[-2]
             utm = int(mgrs[1:3])
@@ -39,9 +101,8 @@ def sentinel_scene_interpreter(scene_name):
             grid_square = mgrs[4:6]
         else:
             version = int(splitted[-1])
-            date = datetime.datetime.strptime(splitted[2], '%Y%m%d')
-            pattern = re.compile('(\d+)([A-Z])([A-Z]{2})')
-            mgrs = pattern.match(splitted[3])
+            date = _parse_date(splitted[2], '%Y%m%d')
+            mgrs = _mgrs_pattern.match(splitted[3])
 
             if mgrs:
                 utm = int(mgrs.group(1))
@@ -60,7 +121,7 @@ def sentinel_scene_interpreter(scene_name):
             version
         )
 
-    except (ValueError):
+    except (ValueError, IndexError):
         raise IncorrectSentine2SceneId('Incorrect Scene for Sentinel-2 provided')
 
 
@@ -113,6 +174,30 @@ def check_create_folder(folder_path):
     return folder_path
 
 
+def get_remote_file(url):
+    """ Sends a HEAD request for a url, or returns the result of an earlier one from the probe cache.
+    :param url:
+        The url that has to be checked.
+    :type url:
+        String
+    :returns:
+        (RemoteFile) with the status, size, ETag and MD5 (if known) of the remote file
+    """
+    remote = probe_cache.get(url)
+
+    if remote is None:
+        from .session import get_session
+        response = get_session().head(url)
+        if policy.is_transient(response.status_code):
+            # still throttled or failing after the retries of the session, not a missing file
+            raise TransientError('{0} returned {1}'.format(url, response.status_code))
+        checksum = Checksum.from_headers(response.headers)
+        remote = RemoteFile(url, response.status_code, checksum.size, checksum.etag, checksum.expected_md5)
+        probe_cache.put(remote)
+
+    return remote
+
+
 def get_remote_file_size(url):
     """ Gets the filesize of a remote file.
     :param url:
@@ -122,8 +207,7 @@ def get_remote_file_size(url):
     :returns:
         int
     """
-    headers = requests.head(url).headers
-    return int(headers['content-length'])
+    return get_remote_file(url).size
 
 
 def remote_file_exists(url):
@@ -135,7 +219,7 @@ def remote_file_exists(url):
         :returns:
             **True** if remote file exists and **False** if it doesn't exist.
         """
-        status = requests.head(url).status_code
+        status = get_remote_file(url).status
 
         if status == 200:
             return True
@@ -143,10 +227,179 @@ def remote_file_exists(url):
             raise RemoteFileDoesntExist
 
 
+S3_NAMESPACE = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+
+def list_prefix(url):
+    """ Lists the files in the S3 folder of a url with a ListObjectsV2 request and caches a RemoteFile for
+    each of them, so that the existence and size checks of all the bands of a scene take one request.
+    :param url:
+        The url of a file, or of a folder ending in ``/``
+    :type url:
+        String
+    :returns:
+        (dict) of url to RemoteFile of the files in the folder
+    """
+    from xml.etree import ElementTree
+    from .session import get_session
+
+    scheme, rest = url.split('://', 1)
+    host, key = rest.split('/', 1)
+    bucket = '{0}://{1}/'.format(scheme, host)
+    prefix = key.split('?')[0].rsplit('/', 1)[0] + '/' if '/' in key else ''
+
+    found = {}
+    params = {'list-type': 2, 'prefix': prefix, 'delimiter': '/'}
+    while True:
+        response = get_session().get(bucket, params=params)
+        policy.check_status(bucket, response.status_code)
+
+        tree = ElementTree.fromstring(response.content)
+        for item in tree.iter(S3_NAMESPACE + 'Contents'):
+            remote = RemoteFile(bucket + item.findtext(S3_NAMESPACE + 'Key'), 200,
+                                int(item.findtext(S3_NAMESPACE + 'Size')), item.findtext(S3_NAMESPACE + 'ETag'), None)
+            probe_cache.put(remote)
+            found[remote.url] = remote
+
+        token = tree.findtext(S3_NAMESPACE + 'NextContinuationToken')
+        if tree.findtext(S3_NAMESPACE + 'IsTruncated') != 'true' or not token:
+            return found
+        params['continuation-token'] = token
+
+
+def list_remote_files(urls, max_workers=1):
+    """ Resolves the existence and size of many S3 files with one listing per folder instead of a HEAD
+    request per file. The urls missing from the listing of their folder are cached as 404s. A folder
+    that can't be listed is left to the HEAD requests.
+    :param urls:
+        The urls of the files
+    :type urls:
+        List
+    :param max_workers:
+        The number of folders listed at the same time. Default value is 1.
+    :type max_workers:
+        Integer
+    """
+    folders = OrderedDict()
+    for url in urls:
+        folders.setdefault(url.rsplit('/', 1)[0] + '/', []).append(url)
+
+    results = run_concurrently(list_prefix, list(folders), max_workers)
+    for (folder, folder_urls), (found, e) in zip(folders.items(), results):
+        if e is not None:
+            logger.info('could not list {0} ({1}), using HEAD requests'.format(folder, e))
+            continue
+
+        for url in folder_urls:
+            if url not in found:
+                probe_cache.put(RemoteFile(url, 404, None, None, None))
+
+
+def run_concurrently(func, items, max_workers=1):
+    """ Calls a function on every item using a pool of threads.
+    :param func:
+        The function to call with each item
+    :type func:
+        Callable
+    :param items:
+        The arguments to pass to the function, one per call
+    :type items:
+        List
+    :param max_workers:
+        The maximum number of threads. Default value is 1.
+    :type max_workers:
+        Integer
+    :returns:
+        (List) of (result, exception) tuples in the order of the items
+    """
+
+    def call(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    if max_workers <= 1 or len(items) <= 1:
+        return [call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
+
+def iter_concurrently(func, items, max_workers=1, max_in_flight=None):
+    """ Calls a function on every item of an iterable using a pool of threads and yields the results as
+    they complete. Items are only taken from the iterable when there is room for them, so arbitrarily
+    long iterables (generators) are processed with bounded memory.
+    :param func:
+        The function to call with each item
+    :type func:
+        Callable
+    :param items:
+        The arguments to pass to the function, one per call
+    :type items:
+        Iterable
+    :param max_workers:
+        The maximum number of threads. Default value is 1.
+    :type max_workers:
+        Integer
+    :param max_in_flight:
+        The maximum number of items submitted and not yet yielded. Default value is max_workers.
+    :type max_in_flight:
+        Integer
+    :returns:
+        (Generator) of (item, result, exception) tuples in completion order
+    """
+    max_workers = max(1, max_workers)
+    max_in_flight = max(1, max_in_flight or max_workers)
+    items = iter(items)
+
+    def call(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    if max_workers == 1 and max_in_flight == 1:
+        for item in items:
+            result, e = call(item)
+            yield item, result, e
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        try:
+            while True:
+                for item in items:
+                    pending[executor.submit(call, item)] = item
+                    if len(pending) >= max_in_flight:
+                        break
+
+                if not pending:
+                    return
+
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result, e = future.result()
+                    yield pending.pop(future), result, e
+        finally:
+            # the consumer stopped early, don't start the items that are still queued
+            for future in pending:
+                future.cancel()
+
+
+def unique(items):
+    """ Yields the items of an iterable in their order, leaving out repeats """
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
 def remove_slash(value):
     """ Removes slash from beginning and end of a string """
     assert isinstance(value, str)
-    return re.sub('(^\/|\/$)', '', value)
+    return _slashes.sub('', value)
 
 
 def url_builder(segments):
@@ -181,6 +434,24 @@ def amazon_s3_url_landsat8(sat, band):
         return url_builder([S3_LANDSAT, sat['sat'], sat['path'], sat['row'], sat['scene'], filename])
 
 
+def landsat8_band_filenames(scene, bands):
+    """
+    Return the file names of the given bands of a landsat8 scene, along with MTL.txt and the QA band
+    :param scene:
+        The scene ID
+    :type scene:
+        String
+    :param bands:
+        A list of bands
+    :type bands:
+        List
+    :returns:
+        (List) of file names
+    """
+    names = ['%s_B%s.TIF' % (scene, band) for band in bands if band not in ['MTL', 'QA', 'BQA']]
+    return names + ['%s_BQA.TIF' % scene, '%s_MTL.txt' % scene]
+
+
 def amazon_s3_url_sentinel2(path, band, suffix='B', frmt='jp2'):
         """
         Return an amazon s3 url for a sentinel2 scene band
@@ -219,7 +490,73 @@ def google_storage_url_landsat8(sat):
     return url_builder([GOOGLE, sat['sat'], sat['path'], sat['row'], filename])
 
 
-def fetch(url, path):
+def download(url, path, resume=False, existing_size=None, verify=False, hedge=None):
+    """ Streams a given url into a file in the given directory over the shared session.
+    :param url:
+        The url to be downloaded.
+    :type url:
+        String
+    :param path:
+        The directory path to where the file should be stored
+    :type path:
+        String
+    :param resume:
+        Continue an earlier, interrupted download of the file. Default value is False.
+    :type resume:
+        Boolean
+    :param existing_size:
+        The size of a local copy of the file. The copy is kept if the GET response reports the same
+        size. Default value is None.
+    :type existing_size:
+        Integer
+    :param verify:
+        Check the file against the ETag or MD5 of the response while it streams in. Default value is False.
+    :type verify:
+        Boolean
+    :param hedge:
+        If provided, a duplicate request is sent when the transfer is slower than this many bytes per
+        second, see hedge.hedged_download. Default value is None.
+    :type hedge:
+        Float
+    :returns:
+        (String) the path to the file
+    """
+    # remove query parameters from the filename
+    filename = url.split('/')[-1].split('?')[0]
+
+    if hedge:
+        from .hedge import hedged_download
+        return hedged_download(url, join(path, filename), hedge, resume=resume, existing_size=existing_size,
+                               verify=verify)
+
+    from .transfer import stream_download
+    return stream_download(url, join(path, filename), resume=resume, existing_size=existing_size, verify=verify)
+
+
+def _transfer(url, path, target, remote, existing_size, engine, segment_size, segments, resume, verify, hedge):
+    """ Downloads a url with the engine and transfer options of fetch """
+    if engine == 'homura':
+        from homura import download as homura_download
+        homura_download(url, path)
+
+    elif segment_size and remote is not None and remote.size is not None and remote.size > segment_size:
+        from .transfer import segmented_download
+        checksum = Checksum(remote.size, remote.md5, remote.etag) if verify else None
+        try:
+            segmented_download(url, target, remote.size, segment_size, segments, resume, checksum, remote.etag)
+        except RangeNotSupported:
+            logger.info('{0} does not support range requests, using a single stream'.format(basename(target)))
+            download(url, path, resume, verify=verify, hedge=hedge)
+
+    elif remote is None and existing_size is not None:
+        download(url, path, resume, existing_size, verify=verify, hedge=hedge)
+
+    else:
+        download(url, path, resume, verify=verify, hedge=hedge)
+
+
+def fetch(url, path, engine='requests', segment_size=None, segments=4, resume=False, probe=True, cache=None,
+          verify=False, hedge=None):
     """ Downloads a given url to a give path.
     :param url:
         The url to be downloaded.
@@ -229,27 +566,105 @@ def fetch(url, path):
         The directory path to where the image should be stored
     :type path:
         String
-    :param filename:
-        The filename that has to be downloaded
-    :type filename:
+    :param engine:
+        ``requests`` streams the file over the shared session, ``homura`` uses homura/pycurl.
+        Default value is ``requests``.
+    :type engine:
         String
+    :param segment_size:
+        If provided, files larger than segment_size bytes are fetched as parallel byte ranges of this
+        size. Default value is None.
+    :type segment_size:
+        Integer
+    :param segments:
+        The number of byte ranges fetched in parallel. Default value is 4.
+    :type segments:
+        Integer
+    :param resume:
+        Continue from the partial file and journal left by an interrupted download instead of
+        starting over. Default value is False.
+    :type resume:
+        Boolean
+    :param probe:
+        Send a HEAD request (or reuse a cached one) to check the size of an existing file. If False,
+        only a probe that is already cached is used and the size is otherwise taken from the headers
+        of the GET response. Default value is True.
+    :type probe:
+        Boolean
+    :param cache:
+        A FileCache to link the file from, if it holds a copy with the same ETag and size, and to add
+        the downloaded file to. Requires a probe. Default value is None.
+    :type cache:
+        FileCache
+    :param verify:
+        Compute the MD5 of the file while it downloads, compare it with the S3 ETag or the Google MD5
+        and record it in the manifest.json of the folder. A file that doesn't match is removed and
+        ChecksumMismatch is raised. Default value is False.
+    :type verify:
+        Boolean
+    :param hedge:
+        Send a duplicate request when a single stream transfer is slower than this many bytes per
+        second. The first copy to finish is kept. Default value is None.
+    :type hedge:
+        Float
     :returns:
         Boolean
     """
 
-    segments = url.split('/')
-    filename = segments[-1]
-
     # remove query parameters from the filename
-    filename = filename.split('?')[0]
+    filename = url.split('/')[-1].split('?')[0]
+    target = join(path, filename)
+
+    remote = probe_cache.get(url)
+    if (probe or cache) and remote is None and (exists(target) or segment_size or cache):
+        remote = get_remote_file(url)
+    probe_cache.pop(url)
 
-    if exists(join(path, filename)):
-        size = getsize(join(path, filename))
-        if size == get_remote_file_size(url):
-            logger.info('{0} already exists on your system'.format(filename))
+    if remote is not None and remote.status != 200:
+        raise RemoteFileDoesntExist('{0} returned {1}'.format(url, remote.status))
+
+    existing_size = getsize(target) if exists(target) else None
+
+    if remote is not None and remote.size is not None and existing_size == remote.size:
+        logger.info('{0} already exists on your system'.format(filename))
+        events.emit('cache', url=url, cache='local', hit=True)
+
+    elif cache is not None and cache.get(url, remote.etag, remote.size, target):
+        return target
 
     else:
-        download(url, path)
+        host = policy.for_url(url)
+        attempt = 0
+        start = time.time()
+        while True:
+            try:
+                with host.slot():
+                    _transfer(url, path, target, remote, existing_size, engine, segment_size, segments, resume,
+                              verify, hedge)
+                break
+            except TransferInterrupted as e:
+                # the adapter already retried the request itself, only a broken body is resumed here
+                if attempt >= host.retries:
+                    raise
+                logger.warning('{0} failed ({1}), resuming'.format(filename, e))
+                delay = policy.backoff(attempt)
+                events.emit('retry', url=url, host=host.host, attempt=attempt + 1, reason=type(e).__name__,
+                            delay=delay)
+                time.sleep(delay)
+                host.retried()
+                attempt += 1
+                # continue from the bytes already on disk
+                resume = True
+
+        if events.enabled() and exists(target):
+            elapsed = time.time() - start
+            size = getsize(target) - (existing_size if resume and existing_size else 0)
+            events.emit('transfer', url=url, host=host.host, engine=engine, bytes=size, elapsed=elapsed,
+                        rate=size / elapsed if elapsed > 0 else None)
+
     logger.info('stored at {0}'.format(path))
 
-    return join(path, filename)
+    if cache is not None and exists(target) and getsize(target) == remote.size:
+        cache.put(url, remote.etag, remote.size, target)
+
+    return target
@@ -1,22 +1,205 @@
 import os
+import re
 import glob
+import json
+import shutil
 import logging
 import tarfile
 import subprocess
+from sys import intern
 
-from .common import remote_file_exists, check_create_folder, fetch
+from .common import (remote_file_exists, check_create_folder, fetch, run_concurrently, iter_concurrently,
+                     get_remote_file, landsat8_band_filenames, list_remote_files)
+from . import events
+from .plan import PlanItem
+from .integrity import complete_files, mark_complete
+from .errors import RemoteFileDoesntExist, RemoteFilesMissing, DownloadError, NotCloudOptimized
 
 logger = logging.getLogger('sdownloader')
 
 
+def tar_index(zip_file):
+    """ Returns the offset and size of the members of an uncompressed tarball, or None if the tarball is
+    compressed. The index is kept in a ``<tarball>.index.json`` sidecar file so that the headers are only
+    read once.
+    """
+    index_file = zip_file + '.index.json'
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(zip_file):
+        with open(index_file) as f:
+            return json.load(f)
+
+    try:
+        tar = tarfile.open(zip_file, 'r:')
+    except tarfile.ReadError:
+        return None
+
+    with tar:
+        index = dict((m.name, [m.offset_data, m.size]) for m in tar if m.isfile())
+
+    with open(index_file, 'w') as f:
+        json.dump(index, f)
+
+    return index
+
+
+def extract_tar(zip_file, path, members=None):
+    """ Extracts a tarball into a folder.
+    :param zip_file:
+        The path to the tarball
+    :type zip_file:
+        String
+    :param path:
+        The directory to extract to
+    :type path:
+        String
+    :param members:
+        The file names to extract. Default value is None (everything).
+    :type members:
+        List
+    """
+    check_create_folder(path)
+
+    if members is None:
+        with tarfile.open(zip_file, 'r') as tar:
+            tar.extractall(path=path)
+        return
+
+    members = set(members)
+    index = tar_index(zip_file)
+
+    if index is not None:
+        # seek straight to the data of the members
+        with open(zip_file, 'rb') as f:
+            for name, (offset, size) in index.items():
+                if os.path.basename(name) in members:
+                    f.seek(offset)
+                    with open(os.path.join(path, os.path.basename(name)), 'wb') as out:
+                        shutil.copyfileobj(LimitedReader(f, size), out)
+        return
+
+    with tarfile.open(zip_file, 'r') as tar:
+        for member in tar:
+            name = os.path.basename(member.name)
+            if member.isfile() and name in members:
+                with open(os.path.join(path, name), 'wb') as out:
+                    shutil.copyfileobj(tar.extractfile(member), out)
+                members.discard(name)
+                # stop decompressing once all the members are out
+                if not members:
+                    break
+
+
+PARALLEL_DECOMPRESSORS = {
+    '.bz': ['pbzip2', 'lbzip2'],
+    '.bz2': ['pbzip2', 'lbzip2'],
+    '.gz': ['pigz'],
+}
+
+
+def tar_command(zip_file, path, members=None):
+    """ Returns the tar command that extracts a tarball, using a parallel decompressor (pbzip2, lbzip2 or
+    pigz) if one is on the PATH
+    """
+    command = ['tar']
+
+    for program in PARALLEL_DECOMPRESSORS.get(os.path.splitext(zip_file)[-1], []):
+        if shutil.which(program):
+            command += ['-I', program]
+            break
+
+    command += ['-xf', zip_file, '-C', path]
+    if members:
+        command += ['--wildcards', '--no-anchored'] + list(members)
+
+    return command
+
+
+class LimitedReader(object):
+    """ Reads at most size bytes from a file """
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+ZIP_FORMATS = ('.gz', '.bz', '.bz2', '.tar')
+
+_band_pattern = re.compile(r'_?B([0-9A-Z]+)\.(?:TIF|JP2)$', re.IGNORECASE)
+
+
+def band_key(band):
+    """ Normalizes a band (4, '4', 'B04', 'QA', 'BQA') into the key used by the band indexes """
+    band = str(band).upper()
+    if band.startswith('B'):
+        band = band[1:]
+    return band.lstrip('0') or band
+
+
+def band_of(filename):
+    """ Returns the band key of an image file name, or None if it isn't the image of a band """
+    match = _band_pattern.search(filename)
+    return band_key(match.group(1)) if match else None
+
+
+class FileList(list):
+    """ The paths of ``Scene.files`` or ``Scene.band_files``. The list is built when the attribute is
+    accessed and writes every change through to the scene, so that ``scene.files.append(path)`` keeps
+    working like it did when the paths were a plain list.
+    """
+
+    def __init__(self, scene, attr, paths):
+        super(FileList, self).__init__(paths)
+        self.scene = scene
+        self.attr = attr
+
+    def __reduce__(self):
+        # a copy or a pickle (e.g. for the unzip workers) is a plain list
+        return list, (list(self),)
+
+    def _write(name):
+        method = getattr(list, name)
+
+        def write(self, *args):
+            result = method(self, *args)
+            setattr(self.scene, self.attr, list(self))
+            return self if name in ('__iadd__', '__imul__') else result
+
+        write.__name__ = name
+        return write
+
+    for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+                  '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+        locals()[_name] = _write(_name)
+    del _name, _write
+
+
 class Scene(object):
+    """ A downloaded scene and its files.
 
-    def __init__(self, name, files=None):
+    The files are stored as interned folders and base names, so that the many files of a scene (and
+    all the scenes in the same folder) share a single copy of their folder. ``files`` and
+    ``band_files`` build the full paths when they are accessed, as a FileList: changing that list in
+    place (``append``, ``extend``, ``del`` ...) or assigning a new one updates the scene.
+    """
+
+    __slots__ = ('name', 'bands', 'zipped', 'zip_file', '_folders', '_names', '_zip_index', '_band_index')
+
+    def __init__(self, name, files=None, bands=None):
         self.name = name
         self.zipped = False
-        self.files = []
         self.zip_file = None
-        self.band_files = []
+        self.bands = bands
+        self._folders = []
+        self._names = []
+        self._zip_index = None
+        self._band_index = None
 
         if isinstance(files, str):
             self.add(files)
@@ -25,15 +208,62 @@ class Scene(object):
                 self.add(f)
 
     def add(self, f):
-        zip_formats = ['.gz', '.bz', '.bz2']
-        if os.path.splitext(os.path.basename(f))[-1] in zip_formats:
+        folder, name = os.path.split(f)
+        if os.path.splitext(name)[-1] in ZIP_FORMATS:
             self.zipped = True
             self.zip_file = f
-        else:
-            self.band_files.append(f)
-        self.files.append(f)
+            self._zip_index = len(self._names)
+        self._folders.append(intern(folder))
+        self._names.append(name)
+        self._band_index = None
 
-    def unzip(self, path=None):
+    @property
+    def files(self):
+        return FileList(self, 'files', [os.path.join(folder, name) for folder, name in zip(self._folders, self._names)])
+
+    @files.setter
+    def files(self, files):
+        zipped = self.zipped
+        self._folders = []
+        self._names = []
+        self._zip_index = None
+        for f in files:
+            self.add(f)
+        self.zipped = zipped
+
+    @property
+    def band_files(self):
+        return FileList(self, 'band_files', [os.path.join(folder, name)
+                                             for i, (folder, name) in enumerate(zip(self._folders, self._names))
+                                             if i != self._zip_index])
+
+    @band_files.setter
+    def band_files(self, band_files):
+        zipped = self.zipped
+        self.files = ([self.zip_file] if self._zip_index is not None else []) + list(band_files)
+        self.zipped = zipped
+
+    def files_for_band(self, band):
+        """ Returns the paths of the images of a band (e.g. 4, 'B04' or 'QA') """
+        if self._band_index is None:
+            index = {}
+            for i, name in enumerate(self._names):
+                key = band_of(name)
+                if key is not None and i != self._zip_index:
+                    index.setdefault(key, []).append(i)
+            self._band_index = index
+
+        return [os.path.join(self._folders[i], self._names[i]) for i in self._band_index.get(band_key(band), [])]
+
+    def unzip(self, path=None, bands=None, external=False):
+        """
+        Extracts the images of the zip file into path (a folder named after the scene by default).
+        Only the given bands, or the bands the scene was downloaded for, are extracted along with
+        MTL.txt and the QA band. All members are extracted if no bands are known.
+
+        With external, the tarball is extracted by the tar command and a parallel decompressor if one
+        is available, which is also the fallback for tarballs the tarfile module can't read.
+        """
 
         if not path:
             path = os.path.join(os.path.split(self.zip_file)[0], self.name)
@@ -41,12 +271,16 @@ class Scene(object):
         if not self.zipped:
             raise Exception('Scene does not have a zip file associated with it')
         else:
+            bands = bands or self.bands
+            members = landsat8_band_filenames(self.name, bands) if bands else None
+
             try:
-                tar = tarfile.open(self.zip_file, 'r')
-                tar.extractall(path=path)
-                tar.close()
+                if external:
+                    raise tarfile.ReadError
+                extract_tar(self.zip_file, path, members)
             except tarfile.ReadError:
-                subprocess.check_call(['tar', '-xf', self.zip_file, '-C', path])
+                check_create_folder(path)
+                subprocess.check_call(tar_command(self.zip_file, path, members))
 
             formats = ['*.tif', '*.TIF', '*.jp2']
 
@@ -61,6 +295,9 @@ class Scene(object):
 
 
 class Scenes(object):
+    """ An ordered collection of scenes, indexed by position and by name """
+
+    __slots__ = ('scenes_list', 'scenes_dict')
 
     def __init__(self, scenes=[]):
         self.scenes_dict = {}
@@ -84,8 +321,14 @@ class Scenes(object):
         else:
             raise Exception('Key is not supported.')
 
+    def __iter__(self):
+        return iter(self.scenes_list)
+
+    def __contains__(self, name):
+        return name in self.scenes_dict
+
     def __len__(self):
-        return len(self.scenes_dict.keys())
+        return len(self.scenes_dict)
 
     def __str__(self):
         return '[Scenes]: Includes %s scenes' % len(self)
@@ -94,8 +337,8 @@ class Scenes(object):
         self.scenes_list.append(self.validate(scene))
         self.scenes_dict[scene.name] = scene
 
-    def add_with_files(self, name, files):
-        self.add(Scene(name, files))
+    def add_with_files(self, name, files, bands=None):
+        self.add(Scene(name, files, bands))
 
     def validate(self, scene):
         if not isinstance(scene, Scene):
@@ -107,57 +350,428 @@ class Scenes(object):
         if not isinstance(scenes, Scenes):
             raise Exception('scenes must be an instance of Scenes')
 
-        for s in scenes:
-            self.add(s)
+        self.scenes_list.extend(scenes.scenes_list)
+        self.scenes_dict.update(scenes.scenes_dict)
 
     @property
     def scenes(self):
-        return [s.name for s in self]
-
-    def unzip(self):
-        for i, scene in enumerate(self):
-            scene.unzip()
+        return [s.name for s in self.scenes_list]
 
+    def files_for_band(self, band):
+        """ Returns the paths of the images of a band in all scenes, in the order of the scenes """
+        return [f for scene in self.scenes_list for f in scene.files_for_band(band)]
 
-class S3DownloadMixin(object):
-
-    def s3(self, scenes, bands):
+    def unzip(self, workers=1, external=False):
         """
-        Amazon S3 downloader
+        Extracts the zip files of all zipped scenes, spread over ``workers`` processes. See Scene.unzip
+        for external.
         """
-        if not isinstance(scenes, list):
-            raise Exception('Expected scene list')
+        zipped = [scene for scene in self if scene.zipped]
+
+        if workers <= 1 or len(zipped) <= 1:
+            for scene in zipped:
+                scene.unzip(external=external)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(zipped))) as executor:
+            results = executor.map(unzip_scene, zipped, [external] * len(zipped))
+            for scene, files in zip(zipped, results):
+                scene.files = files
+                scene.zipped = False
+
+
+def unzip_scene(scene, external=False):
+    """ Unzips a scene in a worker process and returns its updated files """
+    scene.unzip(external=external)
+    return scene.files
+
+
+def collect_scenes(jobs, results, source):
+    """ Builds a Scenes object from the (result, exception) tuples of the fetched files of each job.
+    Raises DownloadError with the partial Scenes if any of the files failed.
+    """
+    scene_objs = Scenes()
+    failures = {}
+    results = iter(results)
+
+    for scene, folder, urls in jobs:
+        files = []
+        for url in urls:
+            f, e = next(results)
+            if isinstance(f, list):
+                files.extend(f)
+            elif e is None:
+                files.append(f)
+            else:
+                logger.error('{0} failed: {1}'.format(url, e))
+                failures[url] = e
 
-        scene_objs = Scenes()
+        scene_objs.add_with_files(scene, files)
 
-        logger.info('Source: AWS S3')
-        for scene in scenes:
-            files = []
+    raise_failures(failures, scene_objs, source)
+    return scene_objs
+
+
+def raise_failures(failures, scene_objs, source):
+    """ Raises RemoteFilesMissing if any of the failed urls is missing on the source, or DownloadError if
+    they failed otherwise, with the Scenes that were downloaded
+    """
+    missing = [url for url, e in failures.items() if isinstance(e, RemoteFileDoesntExist)]
+    if missing:
+        raise RemoteFilesMissing('{0} not available on {1}'.format(', '.join(sorted(missing)), source),
+                                 failures, scene_objs)
+    elif failures:
+        raise DownloadError('Failed to download {0} files from {1}'.format(len(failures), source),
+                            failures, scene_objs)
 
-            path = self.scene_interpreter(scene)
 
-            urls = []
+class S3DownloadMixin(object):
 
-            for band in bands:
-                # get url for the band
-                url = self.amazon_s3_url(path, band)
+    max_workers = 1
+    engine = 'requests'
+    per_host_limit = 8
+    resume = False
+    probe = 'head'
+    segment_size = None
+    segments = 4
+    cache = None
+    verify = False
+    revalidate = 'always'
+    hedge = None
+
+    def _fetch(self, url, folder, single_file=False):
+        """ Fetches a file with the transfer options of the downloader. Single-file sources (tarballs)
+        are fetched in parallel byte ranges if segment_size is set.
+        """
+        options = {}
+        if single_file:
+            options = {'segment_size': self.segment_size, 'segments': self.segments}
 
-                # make sure it exist
-                remote_file_exists(url)
-                urls.append(url)
+        return fetch(url, folder, engine=self.engine, resume=self.resume, probe=bool(self.probe), cache=self.cache,
+                     verify=self.verify, hedge=self.hedge, **options)
 
+    def _s3_jobs(self, scenes, bands):
+        """ Returns a (scene, folder, urls) tuple for each scene """
+        if not isinstance(scenes, list):
+            raise Exception('Expected scene list')
+
+        # resolve the urls of all scenes in one pass
+        resolved, errors = self.resolver(scenes, bands)
+        if errors:
+            raise list(errors.values())[0]
+
+        jobs = []
+        for scene, path, urls, google in resolved:
             if '/' in scene:
                 scene_file = scene.replace('/', '_')
             else:
                 scene_file = scene
 
-            folder = os.path.join(self.download_dir, scene_file)
+            jobs.append((scene, os.path.join(self.download_dir, scene_file), list(urls)))
+
+        return jobs
+
+    def _complete(self, scene, folder, names=None):
+        """
+        Returns the files of a scene that an earlier run recorded as complete in the manifest of the
+        folder, or None if the scene has to be fetched again. With ``revalidate='never'`` only the
+        local files and sizes are checked, with ``'etag'`` each source file is also probed once and
+        its ETag (or size, if no ETag was recorded) compared with the manifest, and with ``'always'``
+        the manifest is not used. Files that changed on the remote are removed.
+        """
+        if self.revalidate == 'always':
+            return None
+        elif self.revalidate not in ['never', 'etag']:
+            raise Exception('revalidate must be one of never, etag or always')
+
+        entries = complete_files(folder, scene, names)
+        if entries is None:
+            return None
+
+        if self.revalidate == 'etag':
+            urls = sorted(set(entry['url'] for entry in entries.values() if entry.get('url')))
+            remotes = dict(zip(urls, run_concurrently(get_remote_file, urls, self.max_workers)))
+            stale = []
+            for path, entry in entries.items():
+                if not entry.get('url'):
+                    continue
+                remote, e = remotes[entry['url']]
+                if e is not None or remote.status != 200:
+                    return None
+                if entry.get('etag') is not None and remote.etag != entry['etag']:
+                    stale.append(path)
+                elif entry.get('etag') is None and remote.size != entry['size']:
+                    stale.append(path)
+
+            if stale:
+                # the remote files changed, the local copies can't be kept even if the size matches
+                for path in stale:
+                    logger.info('{0} changed on the remote'.format(os.path.basename(path)))
+                    os.remove(path)
+                return None
+
+        logger.info('{0} is already complete in {1}'.format(scene, folder))
+        events.emit('scene', scene=scene, source='manifest', files=len(entries))
+        return list(entries)
+
+    def _mark_complete(self, scene, source, files):
+        """ Records the fetched files of a scene in the manifest of their folder and reports the source
+        the scene came from
+        """
+        if not isinstance(files, list):
+            files = [files]
+        events.emit('scene', scene=scene, source=source, files=len(files))
+        if files and all(os.path.exists(f) for f in files):
+            mark_complete(os.path.dirname(files[0]), scene, source, files)
+
+    def _fetch_item(self, item, url):
+        """ Fetches a file of a PlanItem """
+        return self._fetch(url, item.folder, single_file=item.source != 's3')
+
+    def s3(self, scenes, bands):
+        """
+        Amazon S3 downloader
+
+        The existence checks and downloads of all bands are spread over ``max_workers`` threads. A
+        failed download does not stop the rest of the batch: the failures are collected per file and
+        raised together in a DownloadError once every other file has been fetched.
+
+        With ``probe=None`` the HEAD requests are skipped and a missing band is only detected by the
+        status of its GET request. With ``probe='list'`` the folder of each scene is listed once and the
+        bands are looked up in the listing instead of being probed one by one.
+
+        Scenes that an earlier run completed are returned from the manifest of their folder without
+        being fetched again, see ``revalidate``.
+        """
+        jobs = self._s3_jobs(scenes, bands)
+
+        logger.info('Source: AWS S3')
+
+        complete = {}
+        for scene, folder, urls in jobs:
+            files = self._complete(scene, folder, [url.split('/')[-1] for url in urls])
+            if files is not None:
+                complete[scene] = files
+
+        def in_order(fetched):
+            scene_objs = Scenes()
+            for scene, folder, urls in jobs:
+                if scene in complete:
+                    scene_objs.add_with_files(scene, complete[scene])
+                elif scene in fetched:
+                    scene_objs.add(fetched[scene])
+            return scene_objs
+
+        try:
+            fetched = self._s3_fetch([job for job in jobs if job[0] not in complete])
+        except DownloadError as e:
+            e.scenes = in_order(e.scenes or Scenes())
+            raise
+
+        return in_order(fetched)
+
+    def _s3_fetch(self, jobs):
+        """ Probes and fetches the files of the (scene, folder, urls) jobs. A scene with a file that is
+        missing or can't be checked is not downloaded, the other scenes are, and the failures are raised
+        at the end.
+        """
+        if not jobs:
+            return Scenes()
+
+        failures = {}
+        if self.probe:
+            # check all the bands before downloading anything
+            all_urls = [url for scene, folder, urls in jobs for url in urls]
+            if self.probe == 'list':
+                list_remote_files(all_urls, self.max_workers)
+            results = run_concurrently(remote_file_exists, all_urls, self.max_workers)
+            failures = dict((url, e) for url, (r, e) in zip(all_urls, results) if e is not None)
+            for url, e in sorted(failures.items()):
+                logger.error('{0} failed: {1}'.format(url, e))
+
+        jobs = [job for job in jobs if not any(url in failures for url in job[2])]
+
+        tasks = []
+        for scene, folder, urls in jobs:
             # create folder
             check_create_folder(folder)
+            tasks.extend((url, folder) for url in urls)
+
+        results = run_concurrently(lambda task: self._fetch(*task), tasks, self.max_workers)
+        try:
+            scene_objs = collect_scenes(jobs, results, 'AWS S3')
+        except DownloadError as e:
+            scene_objs = e.scenes
+            failures.update(e.failures)
+
+        for scene, folder, urls in jobs:
+            if not any(url in failures for url in urls):
+                self._mark_complete(scene, 's3', scene_objs[scene].files)
 
+        raise_failures(failures, scene_objs, 'AWS S3')
+        return scene_objs
+
+    def s3_window(self, scenes, bands, bbox=None, window=None, overview=0, suffix='_window'):
+        """
+        Reads a window of the bands of each scene from Amazon S3 instead of the whole files. Only the
+        header and the tiles of the bands that cover the window are fetched with Range requests and
+        written into ``<band><suffix>.TIF`` in the scene folder. Text files (e.g. MTL) are fetched whole.
+        The bands and the tile ranges of each band are both read by up to ``max_workers`` threads.
+
+        See cog.COG.read for the bbox, window and overview arguments.
+        """
+        jobs = self._s3_jobs(scenes, bands)
+
+        for scene, folder, urls in jobs:
             for url in urls:
-                files.append(fetch(url, folder))
+                if not url.endswith(('.TIF', '.tif', '.txt')):
+                    raise NotCloudOptimized('{0} is not a GeoTIFF, windowed reads need cloud optimized '
+                                            'GeoTIFFs'.format(url.split('/')[-1]))
+
+        from .cog import read_window
+
+        def read(task):
+            url, folder = task
+            if url.endswith('.txt'):
+                return self._fetch(url, folder)
+            name = os.path.splitext(url.split('/')[-1])[0]
+            return read_window(url, os.path.join(folder, name + suffix + '.TIF'), bbox, window, overview,
+                               self.max_workers)
+
+        tasks = []
+        for scene, folder, urls in jobs:
+            check_create_folder(folder)
+            tasks.extend((url, folder) for url in urls)
+
+        logger.info('Source: AWS S3 (windowed)')
+        results = run_concurrently(read, tasks, self.max_workers)
+        return collect_scenes(jobs, results, 'AWS S3')
+
+    def _plan_s3(self, scenes, bands):
+        """ Probes the bands of all scenes on AWS S3 concurrently.
+        :returns:
+            (List) of PlanItems of the scenes available on S3 and (dict) of the other scenes to the error
+            raised for them
+        """
+        jobs = self._s3_jobs(scenes, bands)
+
+        all_urls = [url for scene, folder, urls in jobs for url in urls]
+        if self.probe == 'list':
+            list_remote_files(all_urls, self.max_workers)
+        results = dict(zip(all_urls, run_concurrently(get_remote_file, all_urls, self.max_workers)))
+
+        items = []
+        unresolved = {}
+        for scene, folder, urls in jobs:
+            errors = [results[url][1] for url in urls if results[url][1] is not None]
+            missing = [url for url in urls if results[url][1] is None and results[url][0].status != 200]
+
+            if errors:
+                unresolved[scene] = errors[0]
+            elif missing:
+                unresolved[scene] = RemoteFileDoesntExist('{0} not available on AWS S3'.format(', '.join(missing)))
+            else:
+                items.append(PlanItem(scene, 's3', folder, urls, [results[url][0].size for url in urls]))
+
+        return items, unresolved
+
+    def _iter_scenes(self, download_scene, scenes, max_in_flight=None, on_error=None):
+        """
+        Runs download_scene (a function returning the Scenes of one scene id) on ``max_in_flight``
+        threads (``max_workers`` if not given) and yields every Scene as soon as its files are on disk,
+        in completion order. The files of each scene have their own pool of ``max_workers`` threads.
+        The scenes that failed are passed to ``on_error`` with their exception, or raised together in a
+        DownloadError once all the others are yielded.
+        """
+        failures = {}
+        threads = max_in_flight or self.max_workers
+        for scene, result, e in iter_concurrently(download_scene, scenes, threads, max_in_flight):
+            if e is not None:
+                logger.error('{0} failed: {1}'.format(scene, e))
+                if on_error is not None:
+                    on_error(scene, e)
+                else:
+                    failures[scene] = e
+                continue
+
+            for scene_obj in result:
+                yield scene_obj
+
+        if failures:
+            raise DownloadError('Failed to download {0} scenes'.format(len(failures)), failures)
+
+    def execute(self, plan):
+        """
+        Downloads the files of a DownloadPlan on ``max_workers`` threads, biggest files first
+        :param plan:
+            A plan created by the plan method
+        :type plan:
+            DownloadPlan
+        :returns:
+            (Scenes) in the order of the plan
+        """
+        for item in plan:
+            check_create_folder(item.folder)
+
+        files = plan.files()
+        results = run_concurrently(lambda f: self._fetch_item(f[0], f[1]), files, self.max_workers)
+        by_file = dict(((item.scene, url), result) for (item, url, size), result in zip(files, results))
+
+        jobs = [(item.scene, item.folder, item.urls) for item in plan]
+        scene_objs = collect_scenes(jobs, [by_file[(item.scene, url)] for item in plan for url in item.urls],
+                                    'the plan')
 
-            scene_objs.add_with_files(scene, files)
+        for item in plan:
+            scene_objs[item.scene].bands = item.bands
+            self._mark_complete(item.scene, item.source, scene_objs[item.scene].files)
 
         return scene_objs
+
+    def enqueue(self, queue, plan):
+        """
+        Puts the files of a DownloadPlan on a work queue shared with other nodes, see ``work``
+        :param queue:
+            A workqueue.SQLiteQueue or workqueue.RedisQueue
+        :type queue:
+            WorkQueue
+        :param plan:
+            A plan created by the plan method
+        :type plan:
+            DownloadPlan
+        :returns:
+            (Integer) the number of files added, the files that are already queued or done are skipped
+        """
+        from .workqueue import enqueue
+
+        return enqueue(queue, plan)
+
+    def work(self, queue, max_tasks=None, wait=False, lease=60):
+        """
+        Claims the files of a work queue and downloads them on ``max_workers`` threads until the queue
+        is empty. The lease of each file is renewed while it downloads, and the files of a node that
+        stopped renewing its leases are downloaded by the next node that claims a task. The manifest of
+        a scene is written by the node that completes its last file.
+        :param queue:
+            A workqueue.SQLiteQueue or workqueue.RedisQueue
+        :type queue:
+            WorkQueue
+        :param max_tasks:
+            Stop after this number of files. Default value is None (no limit).
+        :type max_tasks:
+            Integer
+        :param wait:
+            Keep polling the queue for new files when it is empty. Default value is False.
+        :type wait:
+            Boolean
+        :param lease:
+            The seconds a file is leased for. Default value is 60.
+        :type lease:
+            Float
+        :returns:
+            (dict) the number of files done and failed by this node
+        """
+        from .workqueue import Worker
+
+        return Worker(self, queue, lease=lease).run(max_tasks, wait)
@@ -16,3 +16,49 @@ class IncorrectSentine2SceneId(Exception):
 class USGSInventoryAccessMissing(Exception):
     """ Exception for when User does not have access to USGS Inventory Service """
     pass
+
+
+class RangeNotSupported(Exception):
+    """ Exception to be used when the remote server ignores HTTP Range requests """
+    pass
+
+
+class ChecksumMismatch(Exception):
+    """ Exception to be used when a downloaded file doesn't match the checksum of the remote file """
+    pass
+
+
+class DownloadError(Exception):
+    """ Exception to be used when one or more files of a batch failed to download """
+
+    def __init__(self, message, failures=None, scenes=None):
+        super(DownloadError, self).__init__(message)
+        self.failures = failures or {}
+        self.scenes = scenes
+
+
+class RemoteFilesMissing(DownloadError, RemoteFileDoesntExist):
+    """ Exception to be used when files of a batch don't exist remotely. The rest of the batch was
+    downloaded and is in ``scenes``.
+    """
+    pass
+
+
+class TransientError(Exception):
+    """ Exception to be used when a host keeps throttling or failing after all retries """
+    pass
+
+
+class TransferInterrupted(TransientError):
+    """ Exception to be used when the body of a response stops before all its bytes are received """
+    pass
+
+
+class NotCloudOptimized(Exception):
+    """ Exception to be used when a windowed read is requested from a file that is not a tiled GeoTIFF """
+    pass
+
+
+class TransferCancelled(Exception):
+    """ Exception to be used when a transfer is cancelled because another copy of it finished first """
+    pass
@@ -0,0 +1,173 @@
+""" Instrumentation events
+
+Requests, retries, transfers, cache lookups and the source of each scene are published as events to
+the callbacks registered with ``subscribe``. An event is a dict with the ``event`` name, the ``time``
+and the fields of the event:
+
+- ``request``: ``method``, ``url``, ``host``, ``status`` (None on a connection error), ``elapsed`` (the
+  seconds until the response headers arrived: the probe latency of a HEAD, the time to first byte of a
+  GET) and ``error``
+- ``retry``: ``url``, ``host``, ``attempt``, ``reason`` and ``delay`` (the seconds slept before it)
+- ``transfer``: ``url``, ``host``, ``engine``, ``bytes``, ``elapsed`` and ``rate`` (bytes per second)
+- ``cache``: ``url``, ``cache`` (``local`` for a file already in the download folder, ``shared`` for
+  a FileCache) and ``hit``
+- ``scene``: ``scene``, ``source`` (``s3``, ``google``, ``usgs`` or ``manifest``) and ``files``
+- ``race``: ``source`` (the winner), ``sources`` and ``latency`` (the average probe latency of the winner)
+- ``hedge``: ``url``, ``host``, ``rate`` (of the slow transfer) and ``attempt``
+
+JSONLinesExporter and PrometheusExporter are callbacks that write the events to a file.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger('sdownloader')
+
+_lock = threading.Lock()
+_subscribers = []
+
+
+def subscribe(callback):
+    """ Registers a callback that is called with every event, from the thread that emitted it.
+    :param callback:
+        A function taking the event dict
+    :type callback:
+        Callable
+    :returns:
+        The callback
+    """
+    with _lock:
+        _subscribers.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    """ Removes a callback registered with subscribe """
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def enabled():
+    """ Whether any callback is subscribed, to skip measurements that nobody receives """
+    return bool(_subscribers)
+
+
+def emit(name, **fields):
+    """ Sends an event to the subscribers. Does nothing if there are none, and the errors of the
+    callbacks are logged instead of interrupting the download.
+    """
+    if not _subscribers:
+        return
+
+    fields['event'] = name
+    fields['time'] = time.time()
+    for callback in list(_subscribers):
+        try:
+            callback(fields)
+        except Exception as e:
+            logger.warning('event callback {0} failed: {1}'.format(callback, e))
+
+
+class JSONLinesExporter(object):
+    """ Writes every event as a line of JSON.
+    :param output:
+        A path, opened for appending, or a file object
+    :type output:
+        String or File
+    """
+
+    def __init__(self, output):
+        self.lock = threading.Lock()
+        self.owned = isinstance(output, str)
+        self.f = open(output, 'a') if self.owned else output
+
+    def __call__(self, event):
+        line = json.dumps(event, sort_keys=True, default=str) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def close(self):
+        if self.owned:
+            self.f.close()
+
+
+class PrometheusExporter(object):
+    """ Aggregates the events into counters per host, cache and source, rendered in the Prometheus text
+    format. ``write`` replaces a file atomically, e.g. for the textfile collector of the node exporter.
+    """
+
+    METRICS = [
+        ('sdownloader_requests_total', 'counter', 'HTTP requests by host, method and status'),
+        ('sdownloader_request_seconds', 'summary', 'Seconds until the response headers arrived'),
+        ('sdownloader_retries_total', 'counter', 'Retried requests and transfers by host'),
+        ('sdownloader_transfers_total', 'counter', 'Completed transfers by host'),
+        ('sdownloader_transfer_bytes_total', 'counter', 'Bytes of the completed transfers by host'),
+        ('sdownloader_transfer_seconds_total', 'counter', 'Seconds spent in completed transfers by host'),
+        ('sdownloader_cache_lookups_total', 'counter', 'Cache lookups by cache and result'),
+        ('sdownloader_scenes_total', 'counter', 'Scenes by source'),
+        ('sdownloader_races_total', 'counter', 'Source races won by source'),
+        ('sdownloader_hedges_total', 'counter', 'Hedged requests by host'),
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+
+    def add(self, metric, labels, value=1):
+        with self.lock:
+            self.values[(metric, tuple(sorted(labels.items())))] += value
+
+    def __call__(self, event):
+        name = event['event']
+        if name == 'request':
+            self.add('sdownloader_requests_total',
+                     {'host': event['host'], 'method': event['method'], 'status': str(event['status'])})
+            self.add('sdownloader_request_seconds_sum', {'host': event['host'], 'method': event['method']},
+                     event['elapsed'])
+            self.add('sdownloader_request_seconds_count', {'host': event['host'], 'method': event['method']})
+        elif name == 'retry':
+            self.add('sdownloader_retries_total', {'host': event['host']})
+        elif name == 'transfer':
+            self.add('sdownloader_transfers_total', {'host': event['host']})
+            self.add('sdownloader_transfer_bytes_total', {'host': event['host']}, event['bytes'])
+            self.add('sdownloader_transfer_seconds_total', {'host': event['host']}, event['elapsed'])
+        elif name == 'cache':
+            self.add('sdownloader_cache_lookups_total',
+                     {'cache': event['cache'], 'result': 'hit' if event['hit'] else 'miss'})
+        elif name == 'scene':
+            self.add('sdownloader_scenes_total', {'source': event['source']})
+        elif name == 'race':
+            self.add('sdownloader_races_total', {'source': event['source']})
+        elif name == 'hedge':
+            self.add('sdownloader_hedges_total', {'host': event['host']})
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text exposition format """
+        with self.lock:
+            values = sorted(self.values.items())
+
+        lines = []
+        for metric, type, help in self.METRICS:
+            names = [metric + '_sum', metric + '_count'] if type == 'summary' else [metric]
+            samples = [(name, labels, value) for (name, labels), value in values if name in names]
+            if not samples:
+                continue
+            lines.append('# HELP {0} {1}'.format(metric, help))
+            lines.append('# TYPE {0} {1}'.format(metric, type))
+            for name, labels, value in samples:
+                label = ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for k, v in labels)
+                lines.append('{0}{{{1}}} {2}'.format(name, label, repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """ Writes the metrics to a file, replacing it atomically """
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
@@ -0,0 +1,337 @@
+""" Source racing and hedged transfers
+
+``race`` probes several sources of the same scene in parallel and returns the first one that has it.
+The probe latency of every source is kept as a moving average. Once each source has been measured a
+few times, the fastest source is probed alone for twice its expected latency before the others join
+the race, so that a reliably faster source costs one probe instead of one per source.
+
+``hedged_download`` streams a file like transfer.stream_download, but when the transfer is still
+slower than a threshold after a grace period it sends a duplicate request into a hidden folder next to
+the file. The first copy to finish is kept and the other one is cancelled.
+"""
+import os
+import time
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import events
+from .policy import host_of
+from .integrity import load_manifest, update_manifest, forget
+from .transfer import stream_download, Cancel, Journal, PART_SUFFIX
+
+logger = logging.getLogger('sdownloader')
+
+HEDGE_FOLDER = '.hedge'
+
+_lock = threading.Lock()
+_sources = {}
+_options = {
+    'grace': 2.0,
+    'interval': 0.25,
+    'max_hedges': 1,
+    'alpha': 0.3,
+    'min_samples': 3,
+}
+
+
+class SourceStats(object):
+    """ Moving averages of the probe latency and the transfer throughput of a source """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = None
+        self.throughput = None
+        self.probes = 0
+        self.wins = 0
+        self.transfers = 0
+
+    @staticmethod
+    def average(current, value):
+        if current is None:
+            return value
+        return current + _options['alpha'] * (value - current)
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latency = self.average(self.latency, seconds)
+            self.probes += 1
+
+    def record_throughput(self, rate):
+        with self.lock:
+            self.throughput = self.average(self.throughput, rate)
+            self.transfers += 1
+
+    def won(self):
+        with self.lock:
+            self.wins += 1
+
+    def stats(self):
+        with self.lock:
+            return {'latency': self.latency, 'throughput': self.throughput, 'probes': self.probes,
+                    'wins': self.wins, 'transfers': self.transfers}
+
+
+def for_source(name):
+    """ Returns the SourceStats of a source """
+    with _lock:
+        if name not in _sources:
+            _sources[name] = SourceStats()
+        return _sources[name]
+
+
+def ranked(names):
+    """ Orders sources by their expected latency. Sources that haven't been measured enough come first,
+    in their given order, so that they are measured.
+    """
+    def key(item):
+        i, name = item
+        source = for_source(name)
+        if source.probes < _options['min_samples']:
+            return (0, 0, i)
+        return (1, source.latency, i)
+
+    return [name for i, name in sorted(enumerate(names), key=key)]
+
+
+def head_start(names):
+    """ Returns the seconds the first of the ranked sources is probed alone: twice its expected latency
+    if every source has been measured enough, 0 (a full race) otherwise
+    """
+    if len(names) < 2 or any(for_source(name).probes < _options['min_samples'] for name in names):
+        return 0
+    return 2 * for_source(names[0]).latency
+
+
+def race(candidates):
+    """ Probes sources in parallel and returns the first one whose probe succeeds. The probes that
+    haven't started yet are cancelled, and the latency of every probe that runs is recorded.
+    :param candidates:
+        (source name, probe function) tuples in order of preference
+    :type candidates:
+        List
+    :returns:
+        (String) the name of the winning source and the result of its probe. If all probes fail, the
+        exception of the first candidate is raised.
+    """
+    probes = dict(candidates)
+    order = ranked([name for name, probe in candidates])
+
+    def timed(name):
+        start = time.time()
+        try:
+            return probes[name]()
+        finally:
+            for_source(name).record_latency(time.time() - start)
+
+    executor = ThreadPoolExecutor(len(order))
+    futures = {}
+    try:
+        first = executor.submit(timed, order[0])
+        futures[first] = order[0]
+        delay = head_start(order)
+        if delay:
+            wait([first], timeout=delay)
+
+        if not first.done() or first.exception() is not None:
+            # the first source didn't answer within its head start, race the others
+            for name in order[1:]:
+                futures[executor.submit(timed, name)] = name
+
+        while True:
+            done = [f for f in futures if f.done()]
+            answered = [f for f in done if f.exception() is None]
+            if answered:
+                future = min(answered, key=lambda f: order.index(futures[f]))
+                name = futures[future]
+                for other in futures:
+                    other.cancel()
+                for_source(name).won()
+                events.emit('race', source=name, sources=order, latency=for_source(name).latency)
+                return name, future.result()
+
+            if len(done) == len(futures):
+                break
+            wait([f for f in futures if not f.done()], return_when=FIRST_COMPLETED)
+    finally:
+        executor.shutdown(wait=False)
+
+    errors = dict((name, future.exception()) for future, name in futures.items())
+    raise errors[candidates[0][0]]
+
+
+def stats():
+    """ Returns the latency (seconds), throughput (bytes per second), probes, race wins and transfers
+    of every source
+    """
+    with _lock:
+        names = list(_sources)
+    return dict((name, for_source(name).stats()) for name in names)
+
+
+def reset():
+    """ Forgets the statistics of all sources """
+    with _lock:
+        _sources.clear()
+
+
+def configure(**options):
+    """ Configures source racing and hedged transfers.
+    :param grace:
+        The seconds a transfer runs before its throughput is compared with the threshold. Default
+        value is 2.
+    :type grace:
+        Float
+    :param interval:
+        The seconds between two throughput checks. Default value is 0.25.
+    :type interval:
+        Float
+    :param max_hedges:
+        The number of duplicate requests a transfer can get. Default value is 1.
+    :type max_hedges:
+        Integer
+    :param alpha:
+        The weight of a new measurement in the moving averages. Default value is 0.3.
+    :type alpha:
+        Float
+    :param min_samples:
+        The number of probes of every source before the fastest one gets a head start. Default value
+        is 3.
+    :type min_samples:
+        Integer
+    """
+    for key in options:
+        if key not in _options:
+            raise ValueError('Unknown hedge option: {0}'.format(key))
+
+    with _lock:
+        _options.update(options)
+
+
+class Attempt(object):
+    """ One of the copies of a hedged transfer """
+
+    def __init__(self, path):
+        self.path = path
+        self.cancel = Cancel()
+        self.bytes = 0
+        self.started = time.time()
+        self.future = None
+
+    def progress(self, size):
+        self.bytes += size
+
+    def rate(self):
+        return self.bytes / max(time.time() - self.started, 1e-6)
+
+    @property
+    def running(self):
+        return not self.future.done()
+
+
+def _discard(attempt, target):
+    """ Removes the partial file and journal of a cancelled attempt """
+    if attempt.path == target:
+        part = target + PART_SUFFIX
+        Journal(part).remove()
+        if os.path.exists(part):
+            os.remove(part)
+    else:
+        shutil.rmtree(os.path.dirname(attempt.path), ignore_errors=True)
+        forget(os.path.dirname(attempt.path))
+
+
+def _promote(attempt, target):
+    """ Moves the file of a winning hedge into place, along with its manifest entry """
+    folder, name = os.path.split(target)
+    entry = load_manifest(os.path.dirname(attempt.path))['files'].get(name)
+    forget(os.path.dirname(attempt.path))
+    os.replace(attempt.path, target)
+    if entry is not None:
+        update_manifest(folder, lambda manifest: manifest['files'].__setitem__(name, entry))
+    shutil.rmtree(os.path.dirname(attempt.path), ignore_errors=True)
+
+
+def hedged_download(url, target, threshold, resume=False, existing_size=None, verify=False):
+    """ Streams a url into a file, with duplicate requests for slow transfers.
+    :param url:
+        The url to be downloaded.
+    :type url:
+        String
+    :param target:
+        The path of the file to write
+    :type target:
+        String
+    :param threshold:
+        The throughput in bytes per second below which a duplicate request is sent once the grace
+        period is over
+    :type threshold:
+        Float
+    :param resume:
+        Continue the first request from the journal of an earlier download. Default value is False.
+    :type resume:
+        Boolean
+    :param existing_size:
+        The size of a local copy of the file, see stream_download. Default value is None.
+    :type existing_size:
+        Integer
+    :param verify:
+        Check the file against the ETag or MD5 of the response. Default value is False.
+    :type verify:
+        Boolean
+    :returns:
+        (String) the path to the file
+    """
+    folder, name = os.path.split(target)
+    executor = ThreadPoolExecutor(1 + _options['max_hedges'])
+    attempts = []
+
+    def start(path, resume):
+        attempt = Attempt(path)
+        attempt.future = executor.submit(stream_download, url, path, resume=resume, existing_size=existing_size,
+                                         verify=verify, cancel=attempt.cancel, progress=attempt.progress)
+        attempts.append(attempt)
+
+    winner = None
+    try:
+        start(target, resume)
+        while winner is None:
+            wait([a.future for a in attempts if a.running], timeout=_options['interval'],
+                 return_when=FIRST_COMPLETED)
+
+            for attempt in attempts:
+                if not attempt.running and attempt.future.exception() is None:
+                    winner = attempt
+                    break
+            else:
+                running = [a for a in attempts if a.running]
+                if not running:
+                    raise attempts[0].future.exception()
+
+                slow = all(time.time() - a.started >= _options['grace'] and a.rate() < threshold for a in running)
+                if slow and len(attempts) <= _options['max_hedges']:
+                    rate = max(a.rate() for a in running)
+                    logger.info('{0} is at {1:.0f} B/s, sending a hedged request'.format(name, rate))
+                    events.emit('hedge', url=url, host=host_of(url), rate=rate, attempt=len(attempts))
+                    path = os.path.join(folder, HEDGE_FOLDER, '{0}.{1}'.format(name, len(attempts)), name)
+                    if not os.path.exists(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    start(path, False)
+    finally:
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel.set()
+        executor.shutdown(wait=True)
+
+        for attempt in attempts:
+            if attempt is not winner and (winner is not None or attempt.path != target):
+                _discard(attempt, target)
+        if winner is not None and winner.path != target:
+            _promote(winner, target)
+        try:
+            os.rmdir(os.path.join(folder, HEDGE_FOLDER))
+        except OSError:
+            pass
+
+    return target
@@ -0,0 +1,372 @@
+""" Integrity checks of downloaded files
+
+Checksums are computed while the bytes stream in and compared with the S3 ETag (plain or multipart)
+or the MD5 in Google's ``x-goog-hash`` header. The results are recorded in a ``manifest.json`` in the
+folder of the files, which ``revalidate`` uses to check the files on disk again later.
+
+The entries of the downloaded files are kept in memory and written with the next update of the
+manifest, which is at the latest when their scene is marked complete, so that a folder of n files
+isn't rewritten n times. The manifest is updated under a lock of the folder, re-read and replaced
+atomically, so that several processes can share a download folder.
+"""
+import os
+import re
+import json
+import mmap
+import time
+import atexit
+import base64
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .errors import ChecksumMismatch
+
+logger = logging.getLogger('sdownloader')
+
+MANIFEST = 'manifest.json'
+MB = 1024 * 1024
+
+# the part sizes tried when too many whole numbers of MB give the number of parts of a multipart ETag
+COMMON_PART_SIZES = [5, 8, 10, 15, 16, 25, 32, 50, 64, 100, 128, 256, 512]
+MAX_PART_SIZES = 8
+
+_etag_pattern = re.compile(r'^"?([0-9a-f]{32})(?:-(\d+))?"?$')
+_locks = {}
+_locks_lock = threading.Lock()
+_pending = {}
+
+
+class Checksum(object):
+    """ Incremental MD5 of a file, along with the per-part MD5s needed to rebuild a multipart ETag.
+    :param size:
+        The size of the file
+    :type size:
+        Integer
+    :param md5:
+        The expected MD5 (hex), if known
+    :type md5:
+        String
+    :param etag:
+        The ETag of the file, if known
+    :type etag:
+        String
+    """
+
+    def __init__(self, size=None, md5=None, etag=None):
+        self.size = size
+        self.expected_md5 = md5
+        self.etag = etag
+        self.parts = None
+        self.part_sizes = None
+        self.md5 = hashlib.md5()
+        self.multipart = []
+
+        match = _etag_pattern.match(etag or '')
+        if match and match.group(2):
+            self.parts = int(match.group(2))
+            self.part_sizes = multipart_part_sizes(size, self.parts) if size else []
+            self.multipart = [MultipartHash(part_size) for part_size in self.part_sizes]
+        elif match and self.expected_md5 is None:
+            self.expected_md5 = match.group(1)
+
+    @classmethod
+    def from_headers(cls, headers, size=None):
+        """ Builds a Checksum from the headers of a S3 or Google Storage response """
+        md5 = None
+        for value in headers.get('x-goog-hash', '').split(','):
+            if value.strip().startswith('md5='):
+                md5 = base64.b64decode(value.strip()[4:]).hex()
+
+        if size is None and 'content-length' in headers:
+            size = int(headers['content-length'])
+
+        return cls(size, md5, headers.get('etag'))
+
+    def update(self, data):
+        self.md5.update(data)
+        for multipart in self.multipart:
+            multipart.update(data)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+    def matches(self):
+        """ Returns True or False, or None if there is nothing to compare the checksum with. The part size
+        of a multipart ETag isn't known, so a multipart ETag that matches none of the candidate part
+        sizes gives None rather than False: the upload may have used another part size.
+        """
+        if self.expected_md5 is not None:
+            return self.hexdigest() == self.expected_md5
+        if self.multipart:
+            if any(multipart.etag() == self.etag.strip('"') for multipart in self.multipart):
+                return True
+            logger.info('{0} matches none of the part sizes {1}'.format(self.etag, self.part_sizes))
+        return None
+
+
+class MultipartHash(object):
+    """ The per-part MD5s of a file split in parts of a given size, to rebuild a multipart ETag """
+
+    def __init__(self, part_size):
+        self.part_size = part_size
+        self.part = hashlib.md5()
+        self.digests = []
+        self.filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.part_size - self.filled)
+            self.part.update(view[:take])
+            self.filled += take
+            view = view[take:]
+            if self.filled == self.part_size:
+                self.digests.append(self.part.digest())
+                self.part = hashlib.md5()
+                self.filled = 0
+
+    def etag(self):
+        digests = list(self.digests)
+        if self.filled:
+            digests.append(self.part.digest())
+        return '{0}-{1}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+def multipart_part_sizes(size, parts):
+    """ Returns the part sizes a multipart upload of a file could have used: every whole number of MB
+    that splits the file in the given number of parts, or the exact size of the parts if no whole number
+    of MB does. If there are more than MAX_PART_SIZES of them, only the common part sizes are kept, and
+    an empty list is returned if that still leaves too many or none (the ETag can't be verified).
+    """
+    if parts <= 1:
+        return [max(size, 1)]
+
+    smallest = -(-size // parts)
+    largest = (size - 1) // (parts - 1)
+    sizes = list(range(-(-smallest // MB) * MB, largest + 1, MB))
+    if not sizes:
+        return [smallest]
+
+    if len(sizes) > MAX_PART_SIZES:
+        sizes = [part_size for part_size in sizes if part_size // MB in COMMON_PART_SIZES]
+        if len(sizes) > MAX_PART_SIZES:
+            return []
+    return sizes
+
+
+def hash_file(path, checksum=None, chunk_size=8 * MB):
+    """ Hashes a local file through a memory map """
+    checksum = checksum or Checksum(os.path.getsize(path))
+
+    if os.path.getsize(path):
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                view = memoryview(m)
+                for offset in range(0, len(m), chunk_size):
+                    checksum.update(view[offset:offset + chunk_size])
+                view.release()
+            finally:
+                m.close()
+
+    return checksum
+
+
+def _lock(folder):
+    with _locks_lock:
+        return _locks.setdefault(os.path.abspath(folder), threading.Lock())
+
+
+@contextmanager
+def _folder_lock(folder):
+    """ Locks a folder against the other threads and, where flock is available, the other processes """
+    with _lock(folder):
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def _read_manifest(folder):
+    path = os.path.join(folder, MANIFEST)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning('{0} is not a valid manifest'.format(path))
+    return {'files': {}}
+
+
+def load_manifest(folder):
+    """ Returns the manifest of a folder, with the entries of this process that aren't written yet """
+    manifest = _read_manifest(folder)
+    key = os.path.abspath(folder)
+    with _locks_lock:
+        manifest['files'].update(_pending.get(key, {}))
+    return manifest
+
+
+def update_manifest(folder, update=None):
+    """ Applies update (a function receiving the manifest) to the manifest of a folder, along with the
+    pending entries of its files, and saves it. The manifest is read again under the lock of the
+    folder, so that the updates of other processes are kept.
+    """
+    key = os.path.abspath(folder)
+    with _folder_lock(folder):
+        manifest = _read_manifest(folder)
+        with _locks_lock:
+            pending = _pending.pop(key, {})
+        manifest['files'].update(pending)
+        if update is not None:
+            update(manifest)
+
+        path = os.path.join(folder, MANIFEST)
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    return manifest
+
+
+def flush():
+    """ Writes the pending entries of all folders to their manifests """
+    with _locks_lock:
+        folders = list(_pending)
+    for folder in folders:
+        if os.path.isdir(folder):
+            update_manifest(folder)
+        else:
+            forget(folder)
+
+
+def forget(folder):
+    """ Drops the pending entries of a folder, e.g. a temporary folder that was removed """
+    with _locks_lock:
+        _pending.pop(os.path.abspath(folder), None)
+
+
+atexit.register(flush)
+
+
+def record(path, url, checksum=None, etag=None):
+    """ Records the size, ETag and (if a checksum is given) MD5 of a downloaded file. The entry is
+    written to the manifest of its folder with the next update of the manifest.
+    """
+    entry = {'url': url, 'size': os.path.getsize(path), 'etag': etag}
+    if checksum is not None:
+        entry.update({'md5': checksum.hexdigest(), 'etag': checksum.etag, 'verified': checksum.matches()})
+
+    with _locks_lock:
+        _pending.setdefault(os.path.abspath(os.path.dirname(path)), {})[os.path.basename(path)] = entry
+
+
+def verify(path, url, checksum):
+    """ Records the checksum of a downloaded file. A file that doesn't match its MD5 is removed and
+    ChecksumMismatch is raised. A multipart ETag that matches none of the candidate part sizes is only
+    logged, see Checksum.matches.
+    """
+    record(path, url, checksum)
+    if checksum.matches() is False:
+        os.remove(path)
+        raise ChecksumMismatch('{0} does not match the checksum of {1}'.format(path, url))
+
+
+def mark_complete(folder, scene, source, files):
+    """ Records that all the files of a scene are in a folder, so that a later run can skip the scene
+    without a request. Files without an entry yet are recorded with their size only.
+    :param folder:
+        The folder of the files
+    :type folder:
+        String
+    :param scene:
+        The scene id
+    :type scene:
+        String
+    :param source:
+        The source the files were downloaded from (s3, google or usgs)
+    :type source:
+        String
+    :param files:
+        The paths of the files of the scene
+    :type files:
+        List
+    """
+    names = [os.path.basename(f) for f in files]
+
+    def update(manifest):
+        for name in names:
+            entry = manifest['files'].setdefault(name, {'url': None, 'etag': None})
+            entry['size'] = os.path.getsize(os.path.join(folder, name))
+        manifest.setdefault('scenes', {})[scene] = {'source': source, 'files': names, 'completed': time.time()}
+
+    update_manifest(folder, update)
+
+
+def complete_files(folder, scene, names=None):
+    """ Returns the manifest entries of the files of a scene if the scene was marked complete and all
+    its files are still on disk with their recorded size, and None otherwise.
+    :param names:
+        The file names the scene must include. Default value is None (the recorded files).
+    :type names:
+        List
+    :returns:
+        (dict) of path to manifest entry
+    """
+    manifest = load_manifest(folder)
+    done = manifest.get('scenes', {}).get(scene)
+    if done is None or (names is not None and not set(names) <= set(done['files'])):
+        return None
+
+    entries = {}
+    for name in (names if names is not None else done['files']):
+        path = os.path.join(folder, name)
+        entry = manifest['files'].get(name)
+        if entry is None or not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return None
+        entries[path] = entry
+    return entries
+
+
+def revalidate(folder, workers=4):
+    """ Hashes the files listed in the manifest of a folder again, in parallel.
+    :param folder:
+        The folder of the files
+    :type folder:
+        String
+    :param workers:
+        The number of files hashed at the same time. Default value is 4.
+    :type workers:
+        Integer
+    :returns:
+        (dict) of file name to True if the file matches its manifest entry, False if it doesn't and None
+        if it is missing
+    """
+    entries = load_manifest(folder)['files']
+
+    def check(name):
+        path = os.path.join(folder, name)
+        entry = entries[name]
+        if not os.path.exists(path):
+            return None
+        if os.path.getsize(path) != entry['size']:
+            return False
+
+        checksum = hash_file(path, Checksum(entry['size'], entry.get('md5'), entry.get('etag')))
+        return checksum.matches() is not False
+
+    names = sorted(entries)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return dict(zip(names, executor.map(check, names)))
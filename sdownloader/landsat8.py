@@ -1,17 +1,68 @@
+import os
+import sys
+import time
 import logging
-from xml.etree import ElementTree
+import threading
 
-from usgs import api, USGSError
-
-from .download import S3DownloadMixin, Scenes
+from . import resolve
+from .cache import FileCache
+from .download import S3DownloadMixin, Scene, Scenes, raise_failures
+from .plan import DownloadPlan, PlanItem
 from .common import (landsat_scene_interpreter, amazon_s3_url_landsat8, check_create_folder,
-                     fetch, google_storage_url_landsat8, remote_file_exists)
+                     google_storage_url_landsat8, remote_file_exists, get_remote_file, run_concurrently,
+                     landsat8_band_filenames, list_remote_files, unique)
 
-from .errors import RemoteFileDoesntExist, USGSInventoryAccessMissing
+from .errors import RemoteFileDoesntExist, USGSInventoryAccessMissing, DownloadError
 
 logger = logging.getLogger('sdownloader')
 
 
+def __getattr__(name):
+    """ Imports the usgs package the first time ``api`` or ``USGSError`` is used, so that scenes on AWS
+    and Google Storage don't pay for it
+    """
+    if name in ['api', 'USGSError']:
+        from usgs import api, USGSError
+        globals().update(api=api, USGSError=USGSError)
+        return globals()[name]
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+def usgs_api():
+    """ Returns the usgs ``api`` module and ``USGSError``, through the module so that they can be patched """
+    module = sys.modules[__name__]
+    return module.api, module.USGSError
+
+
+def usgs_key_expired(error):
+    """ Whether an EarthExplorer API error was caused by an expired or invalidated API key """
+    message = str(getattr(error, 'message', error)).lower()
+    return 'expired' in message or 'auth_invalid' in message
+
+
+def match_download_urls(scenes, results):
+    """ Matches the results of a batched api.download call with the scenes of the batch. The results
+    are either urls containing the scene id, or dicts with ``entityId`` and ``url``.
+    :returns:
+        (dict) of scene to download url
+    """
+    urls = {}
+    for result in results or []:
+        if isinstance(result, dict):
+            urls[result.get('entityId')] = result.get('url')
+        else:
+            for scene in scenes:
+                if scene in result:
+                    urls[scene] = result
+                    break
+
+    if not urls and results and len(results) == len(scenes):
+        # urls without the scene id are returned in the order of the request
+        urls = dict(zip(scenes, results))
+
+    return dict((scene, url) for scene, url in urls.items() if scene in scenes and url)
+
+
 class Landsat8(S3DownloadMixin):
     """ Landsat8 downloader class """
 
@@ -28,12 +79,37 @@ class Landsat8(S3DownloadMixin):
         'quality': 'BQA'
     }
 
-    def __init__(self, download_dir, usgs_user=None, usgs_pass=None):
+    # EarthExplorer API keys expire after an hour, renew them a little earlier
+    usgs_key_ttl = 55 * 60
+
+    def __init__(self, download_dir, usgs_user=None, usgs_pass=None, max_workers=1, engine='requests',
+                 per_host_limit=8, segment_size=None, segments=4, resume=False, probe='head',
+                 cache=None, stream_extract=False, keep_archive=False,
+                 verify=False, revalidate='always', usgs_batch_size=50, race=False, hedge=None):
         self.download_dir = download_dir
+        self.max_workers = max_workers
+        self.engine = engine
+        self.per_host_limit = per_host_limit
+        self.segment_size = segment_size
+        self.segments = segments
+        self.resume = resume
+        self.probe = probe
+        self.cache = FileCache(cache) if isinstance(cache, str) else cache
+        self.verify = verify
+        self.revalidate = revalidate
+        self.race = race
+        self.hedge = hedge
+        self.stream_extract = stream_extract
+        self.keep_archive = keep_archive
         self.usgs_user = usgs_user
         self.usgs_pass = usgs_pass
+        self.usgs_batch_size = usgs_batch_size
+        self._usgs_key = None
+        self._usgs_key_time = 0
+        self._usgs_lock = threading.Lock()
         self.scene_interpreter = landsat_scene_interpreter
         self.amazon_s3_url = amazon_s3_url_landsat8
+        self.resolver = resolve.landsat8
 
         # Make sure download directory exist
         check_create_folder(self.download_dir)
@@ -47,6 +123,21 @@ class Landsat8(S3DownloadMixin):
                     pass
         return bands
 
+    def _s3_bands(self, bands):
+        """ Returns the bands with MTL.txt and the QA band added, or None if no bands are provided """
+        if not isinstance(bands, list):
+            return None
+
+        bands = list(bands)
+        # Always grab MTL.txt and QA band if bands are specified
+        if 'QA' not in bands and 'BQA' not in bands:
+            bands.append('QA')
+
+        if 'MTL' not in bands:
+            bands.append('MTL')
+
+        return bands
+
     def download(self, scenes, bands=None):
         """
         Download scenese from Google Storage or Amazon S3 if bands are provided
@@ -62,77 +153,478 @@ class Landsat8(S3DownloadMixin):
             (List) includes downloaded scenes as key and source as value (aws or google)
         """
 
-        bands = self._band_converter(bands)
+        if self.engine == 'asyncio':
+            from . import aio
+            return aio.run(self.download_async(scenes, bands))
+
+        requested = self._band_converter(bands)
+        bands = self._s3_bands(requested)
 
         if isinstance(scenes, list):
+            scenes = list(unique(scenes))
             scene_objs = Scenes()
+            usgs_scenes = []
 
             for scene in scenes:
-
-                # for all scenes if bands provided, first check AWS, if the bands exist
-                # download them, otherwise use Google and then USGS.
                 try:
-                    # if bands are not provided, directly go to Goodle and then USGS
-                    if not isinstance(bands, list):
-                        raise RemoteFileDoesntExist
-                    # Always grab MTL.txt and QA band if bands are specified
-                    if 'BQA' not in bands:
-                        bands.append('QA')
+                    scene_objs.merge(self._download_scene(scene, bands, requested, usgs=False))
+                except RemoteFileDoesntExist:
+                    usgs_scenes.append(scene)
 
-                    if 'MTL' not in bands:
-                        bands.append('MTL')
+            # the scenes only available on USGS are resolved in batches and fetched together
+            if usgs_scenes:
+                scene_objs.merge(self.usgs(usgs_scenes, requested))
+                scene_objs = Scenes([scene_objs[scene] for scene in scenes if scene in scene_objs])
 
-                    scene_objs.merge(self.s3([scene], bands))
+            return scene_objs
 
-                except RemoteFileDoesntExist:
-                    try:
-                        scene_objs.merge(self.google([scene]))
-                    except RemoteFileDoesntExist:
-                        scene_objs.merge(self.usgs([scene]))
+        else:
+            raise Exception('Expected sceneIDs list')
 
-            return scene_objs
+    def iter_download(self, scenes, bands=None, max_in_flight=None, on_error=None):
+        """
+        Downloads scenes like download, but yields each Scene as soon as its files are on disk, in
+        completion order, so that processing can start while the rest of the batch downloads. The
+        scenes only available on USGS are looked up and fetched in batches of ``usgs_batch_size``, and
+        repeated scene IDs are downloaded once.
+        :param scenes:
+            An iterable of scene IDs. It is consumed lazily, so it can be a generator of any length.
+        :type scenes:
+            Iterable
+        :param bands:
+            A list of bands. Default value is None.
+        :type bands:
+            List
+        :param max_in_flight:
+            The number of scenes downloading at the same time. Default value is max_workers.
+        :type max_in_flight:
+            Integer
+        :param on_error:
+            A function called with the scene ID and the exception of every scene that failed. Default
+            value is None (the failures are raised in a DownloadError at the end).
+        :type on_error:
+            Callable
+        :returns:
+            (Generator) of Scene. Scenes that failed are raised in a DownloadError at the end.
+        """
+        requested = self._band_converter(bands)
+        bands = self._s3_bands(requested)
+        failures = {}
+        usgs_scenes = []
+
+        def failed(scene, e):
+            if on_error is not None:
+                on_error(scene, e)
+            else:
+                failures[scene] = e
+
+        def missing(scene, e):
+            # the scenes only available on USGS are looked up and fetched in batches of usgs_batch_size
+            if isinstance(e, RemoteFileDoesntExist):
+                usgs_scenes.append(scene)
+            else:
+                failed(scene, e)
+
+        def download_scene(scene):
+            return self._download_scene(scene, bands, requested, usgs=False)
+
+        def usgs_batch():
+            batch = list(usgs_scenes)
+            del usgs_scenes[:]
+            return self._iter_usgs(batch, requested, failed)
+
+        for scene_obj in self._iter_scenes(download_scene, unique(scenes), max_in_flight, missing):
+            yield scene_obj
+            if len(usgs_scenes) >= self.usgs_batch_size:
+                for usgs_scene in usgs_batch():
+                    yield usgs_scene
+
+        while usgs_scenes:
+            for usgs_scene in usgs_batch():
+                yield usgs_scene
+
+        if failures:
+            raise DownloadError('Failed to download {0} scenes'.format(len(failures)), failures)
+
+    def download_window(self, scenes, bands, bbox=None, window=None, overview=0):
+        """
+        Reads only a window of the bands from Amazon S3. The bands are cloud optimized GeoTIFFs, so
+        the tiles covering the window are fetched with Range requests and written into a small
+        GeoTIFF per band, extended to the tile boundaries.
+        :param scenes:
+            A list of scene IDs
+        :type scenes:
+            List
+        :param bands:
+            A list of bands
+        :type bands:
+            List
+        :param bbox:
+            (minx, miny, maxx, maxy) in the UTM coordinates of the scene
+        :type bbox:
+            Tuple
+        :param window:
+            (col_off, row_off, width, height) in pixels of the full resolution band
+        :type window:
+            Tuple
+        :param overview:
+            0 for the full resolution, 1 for the first internal overview and so on. Default value is 0.
+        :type overview:
+            Integer
+        :returns:
+            (Scenes) with the ``<band>_window.TIF`` files and the MTL file
+        """
+        return self.s3_window(scenes, self._s3_bands(self._band_converter(bands)), bbox, window, overview)
+
+    def _download_scene(self, scene, bands=None, requested=None, usgs=True):
+        """ Downloads a scene from the first source that has it and returns it in a Scenes object. With
+        ``usgs=False`` a scene that is neither on S3 nor on Google Storage raises RemoteFileDoesntExist.
+        """
+
+        # scenes completed by an earlier run are taken from the manifests without a request
+        local = self._local_scene(scene, bands, requested)
+        if local is not None:
+            return Scenes([local])
+
+        # for all scenes if bands provided, first check AWS, if the bands exist
+        # download them, otherwise use Google and then USGS.
+        try:
+            # if bands are not provided, directly go to Goodle and then USGS
+            if not isinstance(bands, list):
+                raise RemoteFileDoesntExist
+
+            if self.race:
+                return self._race_scene(scene, bands, requested)
+
+            return self.s3([scene], bands)
+
+        except RemoteFileDoesntExist:
+            try:
+                return self.google([scene], requested)
+            except RemoteFileDoesntExist:
+                if not usgs:
+                    raise
+                return self.usgs([scene], requested)
+
+    def _race_scene(self, scene, bands, requested=None):
+        """
+        Probes the bands of a scene on AWS S3 and its tarball on Google Storage in parallel and downloads
+        the scene from the source that answers first. The throughput of the transfer is recorded for
+        the source, see hedge.stats.
+        """
+        s3_urls = self._s3_jobs([scene], bands)[0][2]
+        google_url = google_storage_url_landsat8(landsat_scene_interpreter(scene))
+
+        def probe_s3():
+            if self.probe == 'list':
+                list_remote_files(s3_urls)
+            for result, e in run_concurrently(remote_file_exists, s3_urls, self.max_workers):
+                if e is not None:
+                    raise e
+
+        from .hedge import race, for_source
+
+        source, result = race([('s3', probe_s3), ('google', lambda: remote_file_exists(google_url))])
+        logger.info('{0} answered first for {1}'.format(source, scene))
+
+        start = time.time()
+        if source == 's3':
+            scene_objs = self.s3([scene], bands)
+        else:
+            # only the requested bands are taken from the tarball, like they would have been from S3
+            scene_objs = self.google([scene], requested, extract=True)
+
+        size = sum(os.path.getsize(f) for s in scene_objs for f in s.files if os.path.exists(f))
+        for_source(source).record_throughput(size / max(time.time() - start, 1e-6))
+        return scene_objs
+
+    def _local_scene(self, scene, bands=None, requested=None):
+        """ Returns the Scene of a scene that an earlier run completed from any source, or None """
+        if self.revalidate == 'always':
+            return None
+
+        if isinstance(bands, list):
+            scene, folder, urls = self._s3_jobs([scene], bands)[0]
+            files = self._complete(scene, folder, [url.split('/')[-1] for url in urls])
+            if files is not None:
+                return Scene(scene, files)
+
+        # a raced scene taken from Google has its requested bands extracted
+        folder, names = self._archive_folder(scene, requested, True if self.race and requested else None)
+        files = self._complete(scene, folder, names)
+        if files is not None:
+            return Scene(scene, files, requested)
 
+        return None
+
+    def _archive_folder(self, scene, bands=None, extract=None):
+        """ Returns the folder the tarball (or its extracted images) of a scene is stored in, and the
+        file names expected there if they are known in advance
+        """
+        if not (self.stream_extract if extract is None else extract):
+            return self.download_dir, None
+
+        names = None
+        if bands:
+            names = [name for name in landsat8_band_filenames(scene, bands) if name.lower().endswith('.tif')]
+        return os.path.join(self.download_dir, scene), names
+
+    def plan(self, scenes, bands=None):
+        """
+        Resolves the source of every scene before anything is downloaded. The bands of all scenes are
+        probed on AWS S3 concurrently, then the remaining scenes on Google Storage and finally USGS.
+        :param scenes:
+            A list of scene IDs
+        :type scenes:
+            List
+        :param bands:
+            A list of bands. Default value is None.
+        :type scenes:
+            List
+        :returns:
+            (DownloadPlan) to inspect or pass to execute
+        """
+        if not isinstance(scenes, list):
+            raise Exception('Expected sceneIDs list')
+
+        requested = self._band_converter(bands)
+        bands = self._s3_bands(requested)
+
+        items = {}
+        unresolved = {}
+        if isinstance(bands, list):
+            s3_items, unresolved = self._plan_s3(scenes, bands)
+            items.update((item.scene, item) for item in s3_items)
         else:
+            unresolved = dict((scene, RemoteFileDoesntExist()) for scene in scenes)
+
+        remaining = [scene for scene in scenes if scene in unresolved]
+        results = run_concurrently(lambda scene: self._plan_google(scene, requested), remaining, self.max_workers)
+        for scene, (item, e) in zip(remaining, results):
+            if e is None:
+                items[scene] = item
+                del unresolved[scene]
+            else:
+                unresolved[scene] = e
+
+        remaining = [scene for scene in scenes if scene in unresolved]
+        if remaining:
+            usgs_items, unresolved_usgs = self._plan_usgs(remaining, requested)
+            items.update(usgs_items)
+            for scene in usgs_items:
+                del unresolved[scene]
+            unresolved.update(unresolved_usgs)
+
+        return DownloadPlan([items[scene] for scene in scenes if scene in items], unresolved)
+
+    def _plan_google(self, scene, bands=None):
+        url = google_storage_url_landsat8(landsat_scene_interpreter(scene))
+        remote = get_remote_file(url)
+        if remote.status != 200:
+            raise RemoteFileDoesntExist('{0} not available on Google Storage'.format(scene))
+        return PlanItem(scene, 'google', self.download_dir, [url], [remote.size], bands)
+
+    def _plan_usgs(self, scenes, bands=None):
+        """ Resolves the EarthExplorer urls of scenes in batches.
+        :returns:
+            (dict) of the PlanItems of the scenes available on USGS and (dict) of the other scenes to the
+            error raised for them
+        """
+        try:
+            urls = self._usgs_download_urls(scenes)
+        except Exception as e:
+            return {}, dict((scene, e) for scene in scenes)
+
+        items = {}
+        unresolved = {}
+        for scene in scenes:
+            if scene in urls:
+                items[scene] = PlanItem(scene, 'usgs', self.download_dir, [urls[scene]], [None], bands)
+            else:
+                unresolved[scene] = RemoteFileDoesntExist(
+                    '{0} not available on AWS S3, Google or USGS Earth Explorer'.format(scene))
+
+        return items, unresolved
+
+    def download_async(self, scenes, bands=None):
+        """
+        asyncio variant of download. Returns an awaitable that downloads all scenes concurrently over
+        one event loop, with at most ``per_host_limit`` connections to each host. Raises ValueError if
+        options the asyncio engine doesn't implement are set, see aio.UNSUPPORTED_OPTIONS.
+        """
+        if not isinstance(scenes, list):
             raise Exception('Expected sceneIDs list')
 
-    def usgs(self, scenes):
-        """ Downloads the image from USGS """
+        from . import aio
+        aio.check_options(self)
+        return aio.landsat8_download(self, scenes, bands)
+
+    def usgs(self, scenes, bands=None):
+        """
+        Downloads the images from USGS. The download urls of all scenes are requested in batches of
+        ``usgs_batch_size`` with one API key, which is kept for the lifetime of the downloader, and the
+        tarballs are fetched on ``max_workers`` threads. The bands are recorded on the scenes to limit
+        what is extracted. A scene that isn't on USGS doesn't stop the others, the failures are raised
+        at the end.
+        """
 
         if not isinstance(scenes, list):
             raise Exception('Expected sceneIDs list')
 
+        # download from usgs if login information is provided
+        if not (self.usgs_user and self.usgs_pass):
+            raise RemoteFileDoesntExist('{0} not available on AWS S3 or Google Storage'.format(' - '.join(scenes)))
+
+        files = {}
+        pending = []
+        for scene in scenes:
+            complete = self._complete(scene, *self._archive_folder(scene, bands))
+            if complete is None:
+                pending.append(scene)
+            else:
+                files[scene] = complete
+
+        # the failures are keyed by scene, a scene that isn't on USGS doesn't stop the others
+        failures = {}
+        if pending:
+            urls = self._usgs_download_urls(pending)
+            for scene in pending:
+                if scene not in urls:
+                    failures[scene] = RemoteFileDoesntExist(
+                        '{0} not available on AWS S3, Google or USGS Earth Explorer'.format(scene))
+            pending = [scene for scene in pending if scene in urls]
+
+            logger.info('Source: USGS EarthExplorer')
+            results = run_concurrently(lambda scene: self._fetch_archive(scene, urls[scene], bands), pending,
+                                       self.max_workers)
+            for scene, (result, e) in zip(pending, results):
+                if e is not None:
+                    logger.error('{0} failed: {1}'.format(urls[scene], e))
+                    failures[scene] = e
+                else:
+                    files[scene] = result
+                    self._mark_complete(scene, 'usgs', result)
+
         scene_objs = Scenes()
+        for scene in scenes:
+            if scene in files:
+                scene_objs.add_with_files(scene, files[scene], bands)
 
-        # download from usgs if login information is provided
-        if self.usgs_user and self.usgs_pass:
+        raise_failures(failures, scene_objs, 'USGS Earth Explorer')
+        return scene_objs
+
+    def _iter_usgs(self, scenes, bands, failed):
+        """ Downloads scenes from USGS together, like usgs, and yields them. Each scene that failed is
+        passed to ``failed`` with its exception.
+        """
+        try:
+            scene_objs = self.usgs(scenes, bands)
+        except DownloadError as e:
+            scene_objs = e.scenes or Scenes()
+            for scene in scenes:
+                if scene not in scene_objs:
+                    failed(scene, e.failures.get(scene, e))
+        except Exception as e:
+            scene_objs = Scenes()
+            for scene in scenes:
+                failed(scene, e)
+
+        for scene_obj in scene_objs:
+            yield scene_obj
+
+    def _usgs_login(self, expired=None):
+        """ Returns the EarthExplorer API key, logging in only if there is no key yet, if it is older
+        than usgs_key_ttl or if it is the ``expired`` key rejected by the API
+        """
+        api, USGSError = usgs_api()
+        with self._usgs_lock:
+            if (self._usgs_key is None or self._usgs_key == expired or
+                    time.time() - self._usgs_key_time > self.usgs_key_ttl):
+                try:
+                    self._usgs_key = api.login(self.usgs_user, self.usgs_pass)
+                except USGSError as e:
+                    from xml.etree import ElementTree
+                    error_tree = ElementTree.fromstring(str(e.message))
+                    error_text = error_tree.find("SOAP-ENV:Body/SOAP-ENV:Fault/faultstring", api.NAMESPACES).text
+                    raise USGSInventoryAccessMissing(error_text)
+                self._usgs_key_time = time.time()
+
+            return self._usgs_key
+
+    def _usgs_download_urls(self, scenes):
+        """ Requests the EarthExplorer download urls of scenes in batches of usgs_batch_size. A batch
+        rejected because the API key expired is requested again with a new key.
+        :returns:
+            (dict) of scene to download url of the scenes available on USGS
+        """
+        if not (self.usgs_user and self.usgs_pass):
+            raise RemoteFileDoesntExist('{0} not available on AWS S3 or Google Storage'.format(' - '.join(scenes)))
+
+        api, USGSError = usgs_api()
+        urls = {}
+        for i in range(0, len(scenes), self.usgs_batch_size):
+            batch = scenes[i:i + self.usgs_batch_size]
+            api_key = self._usgs_login()
             try:
-                api_key = api.login(self.usgs_user, self.usgs_pass)
+                results = api.download('LANDSAT_8', 'EE', batch, api_key=api_key)
             except USGSError as e:
-                error_tree = ElementTree.fromstring(str(e.message))
-                error_text = error_tree.find("SOAP-ENV:Body/SOAP-ENV:Fault/faultstring", api.NAMESPACES).text
-                raise USGSInventoryAccessMissing(error_text)
+                if not usgs_key_expired(e):
+                    raise
+                logger.info('USGS API key expired, logging in again')
+                results = api.download('LANDSAT_8', 'EE', batch, api_key=self._usgs_login(expired=api_key))
 
-            for scene in scenes:
-                download_urls = api.download('LANDSAT_8', 'EE', [scene], api_key=api_key)
-                if download_urls:
-                    logger.info('Source: USGS EarthExplorer')
-                    scene_objs.add_with_files(scene, fetch(download_urls[0], self.download_dir))
+            urls.update(match_download_urls(batch, results))
 
-                else:
-                    raise RemoteFileDoesntExist('{0} not available on AWS S3, Google or USGS Earth Explorer'.format(
-                                                ' - '.join(scene)))
+        return urls
 
-            return scene_objs
+    def _usgs_download_url(self, scene):
+        """ Returns the EarthExplorer download url of a scene """
+        urls = self._usgs_download_urls([scene])
+        if scene in urls:
+            return urls[scene]
+
+        raise RemoteFileDoesntExist('{0} not available on AWS S3, Google or USGS Earth Explorer'.format(scene))
+
+    def _fetch_archive(self, scene, url, bands=None, extract=None):
+        """
+        Fetches the tarball of a scene. With stream_extract (or extract), the images (only the given
+        bands if provided) are extracted into the scene folder while the tarball downloads and the
+        tarball is only stored if keep_archive is set.
+        """
+        if not (self.stream_extract if extract is None else extract):
+            return self._fetch(url, self.download_dir, single_file=True)
+
+        folder = check_create_folder(os.path.join(self.download_dir, scene))
+        archive = None
+        if self.keep_archive:
+            archive = os.path.join(self.download_dir, url.split('/')[-1].split('?')[0])
+
+        from .transfer import stream_extract
+
+        members = landsat8_band_filenames(scene, bands) if bands else None
+        files = stream_extract(url, folder, archive, members)
+        return [f for f in files if os.path.splitext(f)[-1].lower() in ['.tif', '.jp2']]
 
-        raise RemoteFileDoesntExist('{0} not available on AWS S3 or Google Storage'.format(' - '.join(scenes)))
+    def _fetch_item(self, item, url):
+        if item.source == 's3':
+            return super(Landsat8, self)._fetch_item(item, url)
+        return self._fetch_archive(item.scene, url, item.bands)
 
-    def google(self, scenes):
+    def google(self, scenes, bands=None, extract=None):
         """
         Google Storage Downloader.
         :param scene:
             The scene id
         :type scene:
             List
+        :param bands:
+            The bands to extract from the tarballs. Default value is None (all bands).
+        :type bands:
+            List
+        :param extract:
+            Extract the images while the tarballs download. Default value is None (stream_extract).
+        :type extract:
+            Boolean
         :param path:
             The directory path to where the image should be stored
         :type path:
@@ -148,10 +640,16 @@ class Landsat8(S3DownloadMixin):
         logger.info('Source: Google Storge')
 
         for scene in scenes:
-            sat = landsat_scene_interpreter(scene)
-            url = google_storage_url_landsat8(sat)
-            remote_file_exists(url)
+            files = self._complete(scene, *self._archive_folder(scene, bands, extract))
+            if files is None:
+                sat = landsat_scene_interpreter(scene)
+                url = google_storage_url_landsat8(sat)
+                if self.probe:
+                    remote_file_exists(url)
+
+                files = self._fetch_archive(scene, url, bands, extract)
+                self._mark_complete(scene, 'google', files)
 
-            scene_objs.add_with_files(scene, fetch(url, self.download_dir))
+            scene_objs.add_with_files(scene, files, bands)
 
         return scene_objs
@@ -0,0 +1,96 @@
+""" Download plans
+
+A plan records, for every scene of a batch, the source it will be downloaded from and the urls and
+sizes of its files. It is built before anything is transferred so that a batch can be inspected,
+costed and dry-run, and is then run by the ``execute`` method of the downloaders.
+"""
+
+
+class PlanItem(object):
+    """ The files of a scene and the source they are downloaded from """
+
+    def __init__(self, scene, source, folder, urls, sizes, bands=None):
+        self.scene = scene
+        self.source = source
+        self.folder = folder
+        self.urls = urls
+        self.sizes = sizes
+        self.bands = bands
+
+    @property
+    def total_bytes(self):
+        return sum(size or 0 for size in self.sizes)
+
+    def to_dict(self):
+        return {
+            'scene': self.scene,
+            'source': self.source,
+            'folder': self.folder,
+            'files': [{'url': url, 'size': size} for url, size in zip(self.urls, self.sizes)],
+        }
+
+    def __str__(self):
+        return '{0} ({1}, {2} files, {3} bytes)'.format(self.scene, self.source, len(self.urls), self.total_bytes)
+
+
+class DownloadPlan(object):
+    """ The resolved sources of a batch of scenes.
+
+    ``items`` holds a PlanItem per resolved scene in the order of the input and ``unresolved`` maps the
+    scenes that are not available on any source to the error that was raised for them.
+    """
+
+    def __init__(self, items=None, unresolved=None):
+        self.items = items or []
+        self.unresolved = unresolved or {}
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self.items[key]
+        for item in self.items:
+            if item.scene == key:
+                return item
+        raise KeyError(key)
+
+    def __str__(self):
+        return '[DownloadPlan]: {0} scenes, {1} files, {2} bytes'.format(
+            len(self), len(self.files()), self.total_bytes)
+
+    @property
+    def scenes(self):
+        return [item.scene for item in self.items]
+
+    @property
+    def total_bytes(self):
+        return sum(item.total_bytes for item in self.items)
+
+    def by_source(self):
+        """ Returns the number of scenes and bytes per source """
+        sources = {}
+        for item in self.items:
+            summary = sources.setdefault(item.source, {'scenes': 0, 'bytes': 0})
+            summary['scenes'] += 1
+            summary['bytes'] += item.total_bytes
+        return sources
+
+    def files(self):
+        """ Returns (item, url, size) for every file, biggest first """
+        files = [(item, url, size) for item in self.items for url, size in zip(item.urls, item.sizes)]
+        return sorted(files, key=lambda f: f[2] or 0, reverse=True)
+
+    def estimate_seconds(self, bytes_per_second):
+        """ Returns the time it takes to transfer the plan at the given throughput """
+        return self.total_bytes / float(bytes_per_second)
+
+    def to_dict(self):
+        return {
+            'scenes': [item.to_dict() for item in self.items],
+            'unresolved': dict((scene, str(e)) for scene, e in self.unresolved.items()),
+            'total_bytes': self.total_bytes,
+        }
@@ -0,0 +1,298 @@
+""" Transport policy: retries, rate limits and adaptive concurrency per host.
+
+Throttling (429) and server errors (5xx) are transient: the request is retried with jittered
+exponential backoff and only turned into a TransientError once the retries are exhausted, while a 404
+or 403 is reported as a missing file straight away. A response whose body breaks off is not retried
+here: the transfer resumes from the bytes already on disk (see ``common.fetch``). Every host has a
+token bucket capping its request rate and an AIMD limiter for its concurrent transfers, which is
+halved when the host throttles or fails and grows back by one slot per window of successful requests.
+"""
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+from .errors import RemoteFileDoesntExist, TransientError
+
+logger = logging.getLogger('sdownloader')
+
+TRANSIENT_STATUSES = [429, 500, 502, 503, 504]
+
+_lock = threading.Lock()
+_hosts = {}
+_overrides = {}
+_options = {
+    'retries': 5,
+    'backoff': 0.5,
+    'max_backoff': 30,
+    'rate': None,
+    'burst': 50,
+    'max_concurrency': 32,
+}
+
+# requests per second allowed per host, unless configured otherwise
+HOST_RATES = {
+    'landsat-pds.s3.amazonaws.com': 200,
+    'sentinel-s2-l1c.s3.amazonaws.com': 200,
+    'storage.googleapis.com': 200,
+    'earthexplorer.usgs.gov': 5,
+    'dds.cr.usgs.gov': 5,
+}
+
+
+def host_of(url):
+    """ Returns the host name of a url """
+    return url.split('://', 1)[-1].split('/', 1)[0].split(':')[0].lower()
+
+
+def backoff(attempt, base=None, cap=None):
+    """ Returns a random delay between 0 and the exponential backoff of an attempt (full jitter) """
+    base = _options['backoff'] if base is None else base
+    cap = _options['max_backoff'] if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def max_backoff():
+    return _options['max_backoff']
+
+
+def is_transient(status):
+    return status in TRANSIENT_STATUSES
+
+
+def check_status(url, status, expected=(200,)):
+    """ Raises TransientError for a throttled or failed request and RemoteFileDoesntExist for any other
+    unexpected status
+    """
+    if status in expected:
+        return
+    if is_transient(status):
+        raise TransientError('{0} returned {1}'.format(url, status))
+    raise RemoteFileDoesntExist('{0} returned {1}'.format(url, status))
+
+
+class TokenBucket(object):
+    """ Allows ``rate`` requests per second on average, with bursts of up to ``burst`` requests.
+    :param rate:
+        The number of tokens added per second, or None for no limit
+    :type rate:
+        Float
+    :param burst:
+        The size of the bucket
+    :type burst:
+        Integer
+    """
+
+    def __init__(self, rate=None, burst=50):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ Takes a token if one is available. Returns 0 if it did, or the seconds until the next one """
+        if not self.rate:
+            return 0
+
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """ Takes a token, waiting until one is available """
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AIMDLimiter(object):
+    """ Concurrency limit that grows by one slot after ``limit`` successes in a row and is halved on
+    every throttled or failed request.
+    :param maximum:
+        The largest number of concurrent slots
+    :type maximum:
+        Integer
+    :param minimum:
+        The smallest number of concurrent slots. Default value is 1.
+    :type minimum:
+        Integer
+    """
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def try_acquire(self):
+        """ Takes a slot if one is free, without waiting. Returns whether it did. """
+        with self.condition:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def success(self):
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def failure(self):
+        with self.condition:
+            self.successes = 0
+            limit = max(self.minimum, self.limit // 2)
+            if limit < self.limit:
+                logger.info('reducing concurrency from {0} to {1}'.format(self.limit, limit))
+            self.limit = limit
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class HostPolicy(object):
+    """ The rate limit, concurrency limit and error counters of a host """
+
+    def __init__(self, host, rate=None, burst=50, max_concurrency=32, retries=5):
+        self.host = host
+        self.retries = retries
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AIMDLimiter(max_concurrency)
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def before_request(self):
+        self.bucket.acquire()
+        self._count('requests')
+
+    def reserve(self):
+        """ Non-blocking before_request for the asyncio engine. Returns 0 once the request may be sent,
+        or the seconds to wait before trying again.
+        """
+        wait = self.bucket.reserve()
+        if not wait:
+            self._count('requests')
+        return wait
+
+    def record(self, status=None, error=None):
+        """ Feeds the outcome of a request to the concurrency limiter """
+        if error is not None or is_transient(status):
+            self._count('throttled' if status == 429 else 'errors')
+            self.limiter.failure()
+        else:
+            self.limiter.success()
+
+    def retried(self):
+        self._count('retries')
+
+    def slot(self):
+        """ Context manager holding one of the concurrent transfer slots of the host """
+        return self.limiter.slot()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['concurrency'] = self.limiter.limit
+        return stats
+
+
+def configure(host=None, **options):
+    """ Configures the transport policy of all hosts, or of one host if ``host`` is given. Hosts keep
+    their current limits unless they are reconfigured.
+    :param retries:
+        The number of times a throttled or failed request is retried. Default value is 5.
+    :type retries:
+        Integer
+    :param backoff:
+        The base of the exponential backoff in seconds. Default value is 0.5.
+    :type backoff:
+        Float
+    :param max_backoff:
+        The longest delay between two attempts in seconds. Default value is 30.
+    :type max_backoff:
+        Float
+    :param rate:
+        The number of requests per second allowed per host. Default value is None (the HOST_RATES
+        of the known hosts and no limit for the others).
+    :type rate:
+        Float
+    :param burst:
+        The number of requests that can be sent at once before the rate applies. Default value is 50.
+    :type burst:
+        Integer
+    :param max_concurrency:
+        The largest number of concurrent transfers per host. Default value is 32.
+    :type max_concurrency:
+        Integer
+    """
+    for key in options:
+        if key not in _options:
+            raise ValueError('Unknown policy option: {0}'.format(key))
+
+    with _lock:
+        if host is None:
+            _options.update(options)
+            _hosts.clear()
+        else:
+            _overrides.setdefault(host, {}).update(options)
+            _hosts.pop(host, None)
+
+
+def for_url(url):
+    """ Returns the HostPolicy of the host of a url """
+    host = host_of(url)
+    with _lock:
+        if host not in _hosts:
+            settings = dict(_options)
+            if settings['rate'] is None:
+                settings['rate'] = HOST_RATES.get(host)
+            settings.update(_overrides.get(host, {}))
+            _hosts[host] = HostPolicy(host, settings['rate'], settings['burst'], settings['max_concurrency'],
+                                     settings['retries'])
+        return _hosts[host]
+
+
+def stats():
+    """ Returns the request, retry and error counters and the current concurrency of every host """
+    with _lock:
+        hosts = dict(_hosts)
+    return dict((host, policy.stats()) for host, policy in hosts.items())
+
+
+def reset():
+    """ Drops the counters of all hosts and the limits they adapted to """
+    with _lock:
+        _hosts.clear()
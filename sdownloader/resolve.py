@@ -0,0 +1,89 @@
+""" Bulk resolution of scene ids
+
+Turns a whole job manifest of scene ids into the S3 and Google Storage urls of their bands in one
+pass. The url prefixes and band file names are built once per call instead of once per scene, and
+invalid ids are collected per scene instead of stopping the batch.
+"""
+from collections import namedtuple, OrderedDict
+
+from wordpad import pad
+
+from . import common
+from .errors import IncorrectLandsat8SceneId, IncorrectSentine2SceneId
+
+ResolvedScene = namedtuple('ResolvedScene', ['scene', 'path', 's3', 'google'])
+
+
+def landsat8(scenes, bands=None):
+    """ Resolves the urls of many Landsat 8 scenes.
+    :param scenes:
+        An iterable of scene IDs (a list, a generator or an array of strings)
+    :type scenes:
+        Iterable
+    :param bands:
+        The bands to build S3 urls for, as accepted by amazon_s3_url_landsat8. Default value is None
+        (no S3 urls).
+    :type bands:
+        List
+    :returns:
+        (List) of ResolvedScene records with the S3 path, the S3 urls of the bands and the Google Storage
+        url of each valid scene, in the order of the input, and (OrderedDict) of invalid scene IDs to
+        the IncorrectLandsat8SceneId raised for them
+    """
+    s3 = common.remove_slash(common.S3_LANDSAT)
+    google = common.remove_slash(common.GOOGLE)
+    suffixes = ['_%s.txt' % band if band == 'MTL' else '_B%s.TIF' % band for band in bands or []]
+
+    resolved = []
+    errors = OrderedDict()
+    append = resolved.append
+
+    for scene in scenes:
+        if not isinstance(scene, str) or len(scene) != 21:
+            errors[scene] = IncorrectLandsat8SceneId('Received incorrect scene')
+            continue
+
+        path = 'L%s/%s/%s' % (scene[2], scene[3:6], scene[6:9])
+        prefix = '%s/%s/%s/%s' % (s3, path, scene, scene)
+        append(ResolvedScene(scene, path, tuple([prefix + suffix for suffix in suffixes]),
+                             '%s/%s/%s.tar.bz' % (google, path, scene)))
+
+    return resolved, errors
+
+
+def sentinel2(scenes, bands=None):
+    """ Resolves the urls of many Sentinel 2 tiles.
+    :param scenes:
+        An iterable of scene names or S3 paths (e.g. tiles/34/R/CS/2016/3/25/0)
+    :type scenes:
+        Iterable
+    :param bands:
+        The band numbers to build S3 urls for. Default value is None (no S3 urls).
+    :type bands:
+        List
+    :returns:
+        (List) of ResolvedScene records with the S3 path and the S3 urls of the bands of each valid
+        scene, and (OrderedDict) of invalid scenes to the IncorrectSentine2SceneId raised for them
+    """
+    s3 = common.S3_SENTINEL
+    suffixes = ['/B%s.jp2' % pad(band, 2) for band in bands or []]
+    interpret = common.sentinel_scene_interpreter
+
+    resolved = []
+    errors = OrderedDict()
+    append = resolved.append
+
+    for scene in scenes:
+        try:
+            path = interpret(scene)
+        except IncorrectSentine2SceneId as e:
+            errors[scene] = e
+            continue
+        except AssertionError:
+            errors[scene] = IncorrectSentine2SceneId('Incorrect Scene for Sentinel-2 provided')
+            continue
+
+        prefix = s3 + path
+        append(ResolvedScene(scene, path, tuple([prefix + suffix for suffix in suffixes]), None))
+
+    return resolved, errors
@@ -1,7 +1,10 @@
 import logging
 
+from . import resolve
+from .cache import FileCache
 from .download import S3DownloadMixin
-from .common import sentinel_scene_interpreter, amazon_s3_url_sentinel2, check_create_folder
+from .plan import DownloadPlan
+from .common import sentinel_scene_interpreter, amazon_s3_url_sentinel2, check_create_folder, unique
 
 logger = logging.getLogger('sdownloader')
 
@@ -19,10 +22,21 @@ class Sentinel2(S3DownloadMixin):
         'swir2': 12
     }
 
-    def __init__(self, download_dir):
+    def __init__(self, download_dir, max_workers=1, engine='requests', per_host_limit=8, resume=False,
+                 probe='head', cache=None, verify=False, revalidate='always', hedge=None):
         self.download_dir = download_dir
+        self.max_workers = max_workers
+        self.engine = engine
+        self.per_host_limit = per_host_limit
+        self.resume = resume
+        self.probe = probe
+        self.cache = FileCache(cache) if isinstance(cache, str) else cache
+        self.verify = verify
+        self.revalidate = revalidate
+        self.hedge = hedge
         self.scene_interpreter = sentinel_scene_interpreter
         self.amazon_s3_url = amazon_s3_url_sentinel2
+        self.resolver = resolve.sentinel2
 
         # Make sure download directory exist
         check_create_folder(self.download_dir)
@@ -53,9 +67,77 @@ class Sentinel2(S3DownloadMixin):
         :returns:
             (List) includes downloaded scenes as key and source as value (aws or google)
         """
+        if self.engine == 'asyncio':
+            from . import aio
+            return aio.run(self.download_async(scenes, bands))
+
         bands = self._band_converter(bands)
 
         if isinstance(scenes, list):
-            return self.s3(scenes, bands)
+            return self.s3(list(unique(scenes)), bands)
         else:
             raise Exception('Expected scene list')
+
+    def iter_download(self, scenes, bands, max_in_flight=None, on_error=None):
+        """
+        Downloads scenes like download, but yields each Scene as soon as its bands are on disk, in
+        completion order.
+        :param scenes:
+            An iterable of scenes. It is consumed lazily, so it can be a generator of any length.
+        :type scenes:
+            Iterable
+        :param bands:
+            A list of bands.
+        :type bands:
+            List
+        :param max_in_flight:
+            The number of scenes downloading at the same time. Default value is max_workers.
+        :type max_in_flight:
+            Integer
+        :param on_error:
+            A function called with the scene ID and the exception of every scene that failed. Default
+            value is None (the failures are raised in a DownloadError at the end).
+        :type on_error:
+            Callable
+        :returns:
+            (Generator) of Scene. Scenes that failed are raised in a DownloadError at the end.
+        """
+        bands = self._band_converter(bands)
+        return self._iter_scenes(lambda scene: self.s3([scene], bands), unique(scenes), max_in_flight, on_error)
+
+    def download_window(self, scenes, bands, bbox=None, window=None, overview=0):
+        """
+        Windowed reads like Landsat8.download_window. The Sentinel 2 bands on S3 are JPEG2000 files,
+        which can't be read by tiles, so this raises NotCloudOptimized.
+        """
+        return self.s3_window(scenes, self._band_converter(bands), bbox, window, overview)
+
+    def plan(self, scenes, bands):
+        """
+        Probes the bands of every scene on Amazon S3 concurrently before anything is downloaded
+        :param scenes:
+            A list of scenes
+        :type scenes:
+            List
+        :param bands:
+            A list of bands.
+        :type scenes:
+            List
+        :returns:
+            (DownloadPlan) to inspect or pass to execute
+        """
+        items, unresolved = self._plan_s3(scenes, self._band_converter(bands))
+        return DownloadPlan(items, unresolved)
+
+    def download_async(self, scenes, bands):
+        """
+        asyncio variant of download. Returns an awaitable that downloads all scenes concurrently over
+        one event loop, with at most ``per_host_limit`` connections to each host. Raises ValueError if
+        options the asyncio engine doesn't implement are set, see aio.UNSUPPORTED_OPTIONS.
+        """
+        if not isinstance(scenes, list):
+            raise Exception('Expected scene list')
+
+        from . import aio
+        aio.check_options(self)
+        return aio.sentinel2_download(self, scenes, bands)
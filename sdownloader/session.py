@@ -0,0 +1,187 @@
+""" Shared HTTP session with keep-alive connection pooling.
+
+All probes and transfers go through the session returned by ``get_session`` so that connections to
+S3, Google Storage and USGS are reused across files instead of being set up for every request.
+"""
+import time
+import logging
+import threading
+
+import urllib3
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from . import policy, events
+
+logger = logging.getLogger('sdownloader')
+
+_lock = threading.Lock()
+_session = None
+_options = {
+    'pool_connections': 10,
+    'pool_maxsize': 32,
+    'timeout': 60,
+}
+_stats = {
+    'opened': 0,
+    'requests': 0,
+}
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+class CountingHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        super(CountingHTTPConnection, self).connect()
+        _count('opened')
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        super(CountingHTTPSConnection, self).connect()
+        _count('opened')
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+def unresolvable(error):
+    """ Whether a connection error comes from a host name that doesn't resolve, which isn't retried """
+    reason = getattr(error.args[0] if error.args else None, 'reason', None)
+    return isinstance(reason, getattr(urllib3.exceptions, 'NameResolutionError', ()))
+
+
+def retry_after(response):
+    """ Returns the delay in seconds requested by the Retry-After header of a response, if any """
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class PooledAdapter(HTTPAdapter):
+    """ HTTPAdapter that counts the connections it opens and the requests it sends, and applies the
+    transport policy of the host: rate limiting, and retries with backoff of throttled (429) and failed
+    (5xx, connection errors) requests.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = _options['timeout']
+
+        host = policy.for_url(request.url)
+        attempt = 0
+        while True:
+            host.before_request()
+            _count('requests')
+            delay = None
+            start = time.time()
+            try:
+                response = super(PooledAdapter, self).send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                host.record(error=e)
+                events.emit('request', method=request.method, url=request.url, host=host.host, status=None,
+                            elapsed=time.time() - start, error=str(e))
+                if attempt >= host.retries or unresolvable(e):
+                    raise
+                logger.warning('{0} failed: {1}'.format(request.url, e))
+                reason = type(e).__name__
+            else:
+                host.record(response.status_code)
+                events.emit('request', method=request.method, url=request.url, host=host.host,
+                            status=response.status_code, elapsed=time.time() - start, error=None)
+                if not policy.is_transient(response.status_code) or attempt >= host.retries:
+                    return response
+                logger.warning('{0} returned {1}'.format(request.url, response.status_code))
+                delay = retry_after(response)
+                reason = str(response.status_code)
+                response.close()
+
+            delay = min(max(policy.backoff(attempt), delay or 0), policy.max_backoff())
+            events.emit('retry', url=request.url, host=host.host, attempt=attempt + 1, reason=reason, delay=delay)
+            time.sleep(delay)
+            host.retried()
+            attempt += 1
+
+
+def configure(**options):
+    """ Configures the shared session. The session is rebuilt on its next use.
+    :param pool_connections:
+        The number of hosts to keep connection pools for. Default value is 10.
+    :type pool_connections:
+        Integer
+    :param pool_maxsize:
+        The maximum number of connections kept alive per host. Should be at least the number of
+        download workers. Default value is 32.
+    :type pool_maxsize:
+        Integer
+    :param timeout:
+        The connect and read timeout in seconds. Default value is 60.
+    :type timeout:
+        Integer
+    """
+    global _session
+
+    for key in options:
+        if key not in _options:
+            raise ValueError('Unknown session option: {0}'.format(key))
+
+    with _lock:
+        _options.update(options)
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_session():
+    """ Returns the shared requests session, creating it on first use """
+    global _session
+
+    with _lock:
+        if _session is None:
+            adapter = PooledAdapter(pool_connections=_options['pool_connections'],
+                                    pool_maxsize=_options['pool_maxsize'])
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+
+        return _session
+
+
+def stats():
+    """ Returns the number of connections opened and reused by the shared session.
+    :returns:
+        (dict) with ``opened``, ``reused`` and ``requests`` counters
+    """
+    with _lock:
+        return {
+            'opened': _stats['opened'],
+            'reused': max(_stats['requests'] - _stats['opened'], 0),
+            'requests': _stats['requests'],
+        }
+
+
+def reset_stats():
+    """ Sets the connection counters back to zero """
+    with _lock:
+        for key in _stats:
+            _stats[key] = 0
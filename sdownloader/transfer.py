@@ -0,0 +1,519 @@
+""" Resumable and ranged transfers
+
+Files are written to ``<file>.part`` next to a small ``<file>.part.json`` journal that records the
+byte ranges already on disk. A restarted download only requests the missing ranges with HTTP Range
+requests, and the partial file is atomically renamed into place once it is complete.
+"""
+import os
+import json
+import shutil
+import logging
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .session import get_session
+from .integrity import Checksum, hash_file, record, verify as verify_checksum
+from .policy import check_status
+from .errors import RangeNotSupported, TransferCancelled, TransferInterrupted
+
+logger = logging.getLogger('sdownloader')
+
+PART_SUFFIX = '.part'
+
+# errors raised while a response body streams in, after the request itself has succeeded
+STREAM_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                 requests.exceptions.ChunkedEncodingError)
+
+
+def byte_ranges(size, segment_size, start=0):
+    """ Splits the bytes start-size into (start, end) byte ranges, end inclusive """
+    return [(s, min(s + segment_size, size) - 1) for s in range(start, size, segment_size)]
+
+
+def preallocate(target, size):
+    """ Creates the target file (if it doesn't exist) with the given size """
+    mode = 'r+b' if os.path.exists(target) else 'wb'
+    with open(target, mode) as f:
+        f.truncate(size)
+
+
+class Journal(object):
+    """ Sidecar file recording the byte ranges of a partial download that are already on disk.
+    :param part:
+        The path of the partial file
+    :type part:
+        String
+    :param size:
+        The size of the complete file, if known
+    :type size:
+        Integer
+    :param etag:
+        The ETag of the remote file the bytes on disk come from, if known
+    :type etag:
+        String
+    """
+
+    def __init__(self, part, size=None, etag=None):
+        self.part = part
+        self.path = part + '.json'
+        self.size = size
+        self.etag = etag
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, part, size=None, etag=None):
+        """ Loads the journal of a partial file. An unreadable journal, a missing partial file or a
+        size or ETag that doesn't match the remote file give an empty journal.
+        """
+        journal = cls(part, size, etag)
+
+        if os.path.exists(journal.path) and os.path.exists(part):
+            try:
+                with open(journal.path) as f:
+                    data = json.load(f)
+            except ValueError:
+                return journal
+
+            if (size is None or data.get('size') == size) and (etag is None or data.get('etag') in (None, etag)):
+                journal.size = data.get('size')
+                journal.etag = etag or data.get('etag')
+                journal.ranges = [tuple(r) for r in data.get('ranges', [])]
+
+        return journal
+
+    def add(self, start, end):
+        """ Records the bytes start-end (inclusive) as written and saves the journal """
+        with self.lock:
+            ranges = sorted(self.ranges + [(start, end)])
+            merged = [ranges[0]]
+            for s, e in ranges[1:]:
+                if s <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+                else:
+                    merged.append((s, e))
+            self.ranges = merged
+            self.save()
+
+    def reset(self, size=None, etag=None):
+        with self.lock:
+            self.size = size
+            self.etag = etag
+            self.ranges = []
+            self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'size': self.size, 'etag': self.etag, 'ranges': self.ranges}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @property
+    def offset(self):
+        """ The number of contiguous bytes on disk from the start of the file """
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1] + 1
+        return 0
+
+    def missing(self):
+        """ Returns the (start, end) byte ranges that are not on disk yet """
+        gaps = []
+        position = 0
+        for start, end in self.ranges:
+            if start > position:
+                gaps.append((position, start - 1))
+            position = max(position, end + 1)
+        if position < self.size:
+            gaps.append((position, self.size - 1))
+        return gaps
+
+    @property
+    def complete(self):
+        return self.size is not None and not self.missing()
+
+
+def finish(part, target, journal):
+    """ Atomically moves a complete partial file into place and removes its journal """
+    os.replace(part, target)
+    journal.remove()
+    return target
+
+
+class PositionalWriter(object):
+    """ Writes chunks at absolute offsets of an open file from several threads """
+
+    def __init__(self, f):
+        self.f = f
+        self.fd = f.fileno()
+        self.lock = threading.Lock()
+
+    def write(self, offset, data):
+        if hasattr(os, 'pwrite'):
+            while data:
+                written = os.pwrite(self.fd, data, offset)
+                offset += written
+                data = data[written:]
+        else:
+            with self.lock:
+                self.f.seek(offset)
+                self.f.write(data)
+
+
+class Cancel(object):
+    """ Cancels a running stream_download from another thread by closing its response """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+
+    def attach(self, response):
+        self.response = response
+        if self.event.is_set():
+            response.close()
+
+    def set(self):
+        self.event.set()
+        if self.response is not None:
+            self.response.close()
+
+    def is_set(self):
+        return self.event.is_set()
+
+
+def content_size(response):
+    """ Returns the size of the whole remote file from a 200 or 206 response """
+    if response.status_code == 206:
+        return int(response.headers['content-range'].split('/')[-1])
+    return int(response.headers['content-length'])
+
+
+def stream_download(url, target, resume=False, existing_size=None, verify=False, chunk_size=1024 * 1024,
+                    checkpoint=8 * 1024 * 1024, cancel=None, progress=None):
+    """ Streams a url into a file over the shared session.
+    :param url:
+        The url to be downloaded.
+    :type url:
+        String
+    :param target:
+        The path of the file to write
+    :type target:
+        String
+    :param resume:
+        Continue from the bytes recorded in the journal of an earlier, interrupted download.
+        Default value is False.
+    :type resume:
+        Boolean
+    :param existing_size:
+        The size of a local copy of the file. If the GET response reports the same size the body is
+        not read and the copy is kept. Default value is None.
+    :type existing_size:
+        Integer
+    :param verify:
+        Hash the file while it streams in, compare it with the ETag or MD5 header of the response and
+        record it in the manifest of the folder. Default value is False.
+    :type verify:
+        Boolean
+    :param checkpoint:
+        The number of bytes written between journal updates. Default value is 8 MB.
+    :type checkpoint:
+        Integer
+    :param cancel:
+        Stops the transfer with TransferCancelled when it is set. The partial file is kept.
+    :type cancel:
+        Cancel
+    :param progress:
+        Called with the size of every chunk written
+    :type progress:
+        Callable
+    :returns:
+        (String) the path to the file
+    """
+    part = target + PART_SUFFIX
+    journal = Journal.load(part) if resume else Journal(part)
+
+    if journal.complete:
+        # interrupted between the last write and the rename, a range request would get a 416
+        logger.info('{0} is already complete on disk'.format(url))
+        checksum = None
+        if verify:
+            checksum = hash_file(part, Checksum(journal.size, etag=journal.etag))
+        finish(part, target, journal)
+        if checksum is not None:
+            verify_checksum(target, url, checksum)
+        else:
+            record(target, url, etag=journal.etag)
+        return target
+
+    offset = journal.offset
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes={0}-'.format(offset)
+        if journal.etag:
+            # the server sends the whole file instead of the range if it changed since
+            headers['If-Range'] = journal.etag
+    response = get_session().get(url, stream=True, headers=headers)
+    if cancel is not None:
+        cancel.attach(response)
+    checksum = None
+    etag = response.headers.get('etag')
+    try:
+        if response.status_code == 206:
+            if content_size(response) != journal.size:
+                raise RangeNotSupported('{0} changed since the partial download'.format(url))
+            logger.info('resuming {0} from byte {1}'.format(url, offset))
+            mode = 'r+b'
+        elif response.status_code == 200:
+            if existing_size is not None and response.headers.get('content-length') == str(existing_size):
+                logger.info('{0} already exists on your system'.format(os.path.basename(target)))
+                return target
+            offset = 0
+            journal.reset(content_size(response) if 'content-length' in response.headers else None, etag)
+            mode = 'wb'
+        elif response.status_code == 416:
+            raise RangeNotSupported('{0} is shorter than the partial download'.format(url))
+        else:
+            check_status(url, response.status_code)
+
+        if verify:
+            checksum = Checksum.from_headers(response.headers, journal.size)
+            resumed = offset > 0
+
+        with open(part, mode) as f:
+            f.seek(offset)
+            start = offset
+            try:
+                for chunk in response.iter_content(chunk_size):
+                    if checksum is not None and not resumed:
+                        checksum.update(chunk)
+                    f.write(chunk)
+                    offset += len(chunk)
+                    if progress is not None:
+                        progress(len(chunk))
+                    if offset - start >= checkpoint:
+                        f.flush()
+                        journal.add(start, offset - 1)
+                        start = offset
+            except STREAM_ERRORS as e:
+                raise TransferInterrupted('{0} was interrupted at byte {1}: {2}'.format(url, offset, e))
+            finally:
+                # a retry resumes from the last byte written
+                f.flush()
+                if offset > start:
+                    journal.add(start, offset - 1)
+    except RangeNotSupported:
+        response.close()
+        journal.reset()
+        return stream_download(url, target, resume=False, existing_size=existing_size, verify=verify,
+                               chunk_size=chunk_size, checkpoint=checkpoint, cancel=cancel, progress=progress)
+    except Exception:
+        if cancel is not None and cancel.is_set():
+            raise TransferCancelled('{0} was cancelled'.format(url))
+        raise
+    finally:
+        response.close()
+
+    if cancel is not None and cancel.is_set():
+        raise TransferCancelled('{0} was cancelled'.format(url))
+
+    if journal.size is not None and offset != journal.size:
+        raise TransferInterrupted('Incomplete download of {0}: received {1} of {2} bytes'.format(
+            url, offset, journal.size))
+
+    if checksum is not None and resumed:
+        # the start of the file was written by an earlier run
+        hash_file(part, checksum)
+
+    finish(part, target, journal)
+
+    if checksum is not None:
+        verify_checksum(target, url, checksum)
+    else:
+        record(target, url, etag=etag)
+
+    return target
+
+
+def fetch_range(url, writer, start, end, journal=None, chunk_size=1024 * 1024):
+    """ Fetches the bytes start-end (inclusive) of a url and writes them at the same offset """
+    response = get_session().get(url, stream=True, headers={'Range': 'bytes={0}-{1}'.format(start, end)})
+    try:
+        if response.status_code == 200:
+            raise RangeNotSupported('{0} does not support range requests'.format(url))
+        check_status(url, response.status_code, (206,))
+
+        offset = start
+        try:
+            for chunk in response.iter_content(chunk_size):
+                writer.write(offset, chunk)
+                offset += len(chunk)
+        except STREAM_ERRORS as e:
+            raise TransferInterrupted('Range {0}-{1} of {2} was interrupted: {3}'.format(start, end, url, e))
+    finally:
+        response.close()
+
+    if offset != end + 1:
+        raise TransferInterrupted('Incomplete range {0}-{1} of {2}: received {3} bytes'.format(
+            start, end, url, offset - start))
+
+    if journal is not None:
+        journal.add(start, end)
+
+    return start, end
+
+
+def segmented_download(url, target, size, segment_size=64 * 1024 * 1024, segments=4, resume=False,
+                       checksum=None, etag=None):
+    """ Downloads a url into a preallocated file by fetching byte ranges in parallel.
+    :param url:
+        The url to be downloaded.
+    :type url:
+        String
+    :param target:
+        The path of the file to write
+    :type target:
+        String
+    :param size:
+        The size of the remote file, as returned by get_remote_file_size
+    :type size:
+        Integer
+    :param segment_size:
+        The number of bytes fetched by each range request. Default value is 64 MB.
+    :type segment_size:
+        Integer
+    :param segments:
+        The number of ranges fetched in parallel. Default value is 4.
+    :type segments:
+        Integer
+    :param resume:
+        Only fetch the ranges missing from the journal of an earlier, interrupted download.
+        Default value is False.
+    :type resume:
+        Boolean
+    :param checksum:
+        If provided, the complete file is hashed into this Checksum, compared with the expected one and
+        recorded in the manifest of the folder. Default value is None.
+    :type checksum:
+        Checksum
+    :param etag:
+        The ETag recorded in the manifest when no checksum is given. Default value is None.
+    :type etag:
+        String
+    :returns:
+        (String) the path to the file
+    """
+    part = target + PART_SUFFIX
+    journal = Journal.load(part, size, etag) if resume else Journal(part, size, etag)
+    if not journal.ranges:
+        journal.reset(size, etag)
+
+    ranges = []
+    for start, end in journal.missing():
+        ranges.extend(byte_ranges(end + 1, segment_size, start))
+    logger.info('fetching {0} in {1} segments'.format(url, len(ranges)))
+
+    preallocate(part, size)
+    with open(part, 'r+b') as f:
+        writer = PositionalWriter(f)
+        with ThreadPoolExecutor(max_workers=max(1, min(segments, len(ranges)))) as executor:
+            futures = [executor.submit(fetch_range, url, writer, start, end, journal) for start, end in ranges]
+            for future in futures:
+                future.result()
+
+    finish(part, target, journal)
+
+    if checksum is not None:
+        verify_checksum(target, url, hash_file(target, checksum))
+    else:
+        record(target, url, etag=etag)
+
+    return target
+
+
+class TeeReader(object):
+    """ File-like reader that copies everything it reads from a stream into a file """
+
+    def __init__(self, stream, f=None):
+        self.stream = stream
+        self.f = f
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if self.f is not None:
+            self.f.write(data)
+        return data
+
+    def drain(self, chunk_size=1024 * 1024):
+        while self.read(chunk_size):
+            pass
+
+
+def stream_extract(url, folder, archive=None, members=None):
+    """ Extracts a remote tarball into a folder while it downloads, without storing it first.
+    :param url:
+        The url of a tar, tar.gz or tar.bz2 archive
+    :type url:
+        String
+    :param folder:
+        The directory the members of the archive are written to
+    :type folder:
+        String
+    :param archive:
+        If provided, the compressed archive is also written to this path. Default value is None.
+    :type archive:
+        String
+    :param members:
+        The file names to extract. Unless the archive is stored, the download stops as soon as they
+        are all extracted. Default value is None (everything).
+    :type members:
+        List
+    :returns:
+        (List) the paths of the extracted files
+    """
+    response = get_session().get(url, stream=True)
+    f = None
+    files = []
+    try:
+        check_status(url, response.status_code)
+
+        if archive is not None:
+            f = open(archive + PART_SUFFIX, 'wb')
+
+        remaining = set(members) if members is not None else None
+        reader = TeeReader(response.raw, f)
+        with tarfile.open(fileobj=reader, mode='r|*') as tar:
+            for member in tar:
+                # Landsat tarballs are flat, only keep the basename of the members
+                name = os.path.basename(member.name)
+                if not member.isfile() or (remaining is not None and name not in remaining):
+                    continue
+
+                target = os.path.join(folder, name)
+                with open(target + PART_SUFFIX, 'wb') as out:
+                    shutil.copyfileobj(tar.extractfile(member), out)
+                os.replace(target + PART_SUFFIX, target)
+                record(target, url, etag=response.headers.get('etag'))
+                files.append(target)
+
+                if remaining is not None:
+                    remaining.discard(name)
+                    if not remaining and f is None:
+                        break
+
+        if f is not None:
+            reader.drain()
+            f.close()
+            os.replace(archive + PART_SUFFIX, archive)
+    finally:
+        if f is not None and not f.closed:
+            f.close()
+        response.close()
+
+    logger.info('extracted {0} files from {1} into {2}'.format(len(files), url, folder))
+    return files
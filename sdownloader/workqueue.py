@@ -0,0 +1,535 @@
+""" Distributed work queue
+
+A DownloadPlan can be split into one task per file and put on a queue shared by a fleet of nodes.
+Each node runs a Worker that claims tasks under a lease, renews the lease with heartbeats while the
+file downloads, and completes or fails the task. Tasks whose lease expires (the node crashed or lost
+its connection) are put back on the queue by the next claim of any node. Task IDs are derived from the
+scene and the file name, so a plan enqueued twice, or by several nodes, is downloaded once.
+
+SQLiteQueue keeps the queue in a SQLite file, for the nodes of one machine or of a shared filesystem
+with working locks. RedisQueue keeps it in a Redis server, or anything that implements the same
+commands, through a client object such as ``redis.Redis``.
+"""
+import os
+import abc
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+from .plan import PlanItem
+from .common import check_create_folder, run_concurrently
+from .errors import RemoteFileDoesntExist
+
+logger = logging.getLogger('sdownloader')
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Task(object):
+    """ A file of a scene to be downloaded by a worker """
+
+    def __init__(self, id, scene, source, folder, url, size=None, bands=None, attempts=0, worker=None):
+        self.id = id
+        self.scene = scene
+        self.source = source
+        self.folder = folder
+        self.url = url
+        self.size = size
+        self.bands = bands
+        self.attempts = attempts
+        self.worker = worker
+
+    @classmethod
+    def from_item(cls, item, url, size=None):
+        """ Returns the task of a file of a PlanItem """
+        name = url.split('/')[-1].split('?')[0]
+        return cls('{0}/{1}'.format(item.scene, name), item.scene, item.source, item.folder, url, size, item.bands)
+
+    @classmethod
+    def from_json(cls, payload, attempts=0, worker=None):
+        return cls(attempts=attempts, worker=worker, **json.loads(payload))
+
+    def to_json(self):
+        return json.dumps({'id': self.id, 'scene': self.scene, 'source': self.source, 'folder': self.folder,
+                           'url': self.url, 'size': self.size, 'bands': self.bands}, sort_keys=True)
+
+    def plan_item(self):
+        return PlanItem(self.scene, self.source, self.folder, [self.url], [self.size], self.bands)
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.id, self.source)
+
+
+def tasks_of(plan):
+    """ Returns a Task for every file of a DownloadPlan, in the order of the plan """
+    return [Task.from_item(item, url, size) for item in plan for url, size in zip(item.urls, item.sizes)]
+
+
+class WorkQueue(abc.ABC):
+    """ Interface of the queue backends.
+    :param max_attempts:
+        The number of times a task is claimed before it is failed for good. Default value is 3.
+    :type max_attempts:
+        Integer
+    """
+
+    def __init__(self, max_attempts=3):
+        self.max_attempts = max_attempts
+
+    @abc.abstractmethod
+    def put(self, tasks):
+        """ Adds tasks to the end of the queue, skipping the tasks that are already queued, running or done.
+        :returns:
+            (Integer) the number of tasks added
+        """
+
+    @abc.abstractmethod
+    def claim(self, worker, lease=60):
+        """ Puts the expired tasks back on the queue and leases the next task to a worker for ``lease``
+        seconds.
+        :returns:
+            (Task) or None if the queue is empty
+        """
+
+    @abc.abstractmethod
+    def heartbeat(self, task, worker, lease=60):
+        """ Extends the lease of a task.
+        :returns:
+            (Boolean) False if the worker no longer holds the lease
+        """
+
+    @abc.abstractmethod
+    def complete(self, task, worker, files):
+        """ Records the files of a task. A task completed after its lease expired is still accepted.
+        :returns:
+            (Boolean) False if the task was already complete
+        """
+
+    @abc.abstractmethod
+    def fail(self, task, worker, error, retry=True):
+        """ Releases a task after an error. It is queued again unless retry is False or it reached
+        max_attempts.
+        """
+
+    @abc.abstractmethod
+    def requeue_expired(self):
+        """ Puts the tasks whose lease expired back on the queue.
+        :returns:
+            (Integer) the number of tasks requeued
+        """
+
+    @abc.abstractmethod
+    def remaining(self, scene):
+        """ Returns the number of tasks of a scene that are not done """
+
+    @abc.abstractmethod
+    def files(self, scene):
+        """ Returns the files of the completed tasks of a scene """
+
+    @abc.abstractmethod
+    def counts(self):
+        """ Returns the number of tasks in each state """
+
+    @abc.abstractmethod
+    def errors(self):
+        """ Returns the error of every failed task """
+
+
+class SQLiteQueue(WorkQueue):
+    """ Work queue in a SQLite database file.
+    :param path:
+        The path of the database
+    :type path:
+        String
+    """
+
+    def __init__(self, path, max_attempts=3):
+        super(SQLiteQueue, self).__init__(max_attempts)
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        check_create_folder(folder)
+
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS tasks (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE, '
+                       'scene TEXT, payload TEXT, state TEXT, worker TEXT, expires REAL, '
+                       'attempts INTEGER DEFAULT 0, files TEXT, error TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, seq)')
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_scene ON tasks (scene)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            with db:
+                # take the write lock before reading, so that two nodes can't claim the same task
+                db.execute('BEGIN IMMEDIATE')
+                yield db
+        finally:
+            db.close()
+
+    def put(self, tasks):
+        with self._connect() as db:
+            added = 0
+            for task in tasks:
+                added += db.execute('INSERT OR IGNORE INTO tasks (id, scene, payload, state) VALUES (?, ?, ?, ?)',
+                                    (task.id, task.scene, task.to_json(), PENDING)).rowcount
+        return added
+
+    def _requeue_expired(self, db):
+        now = time.time()
+        failed = db.execute('UPDATE tasks SET state = ?, worker = NULL, expires = NULL, error = ? '
+                            'WHERE state = ? AND expires < ? AND attempts >= ?',
+                            (FAILED, 'lease expired', LEASED, now, self.max_attempts)).rowcount
+        requeued = db.execute('UPDATE tasks SET state = ?, worker = NULL, expires = NULL '
+                              'WHERE state = ? AND expires < ?', (PENDING, LEASED, now)).rowcount
+        if failed or requeued:
+            logger.info('{0} expired tasks requeued, {1} failed'.format(requeued, failed))
+        return requeued
+
+    def requeue_expired(self):
+        with self._connect() as db:
+            return self._requeue_expired(db)
+
+    def claim(self, worker, lease=60):
+        with self._connect() as db:
+            self._requeue_expired(db)
+            row = db.execute('SELECT id, payload, attempts FROM tasks WHERE state = ? ORDER BY seq LIMIT 1',
+                             (PENDING,)).fetchone()
+            if row is None:
+                return None
+
+            id, payload, attempts = row
+            db.execute('UPDATE tasks SET state = ?, worker = ?, expires = ?, attempts = ? WHERE id = ?',
+                       (LEASED, worker, time.time() + lease, attempts + 1, id))
+        return Task.from_json(payload, attempts + 1, worker)
+
+    def heartbeat(self, task, worker, lease=60):
+        with self._connect() as db:
+            return db.execute('UPDATE tasks SET expires = ? WHERE id = ? AND state = ? AND worker = ?',
+                              (time.time() + lease, task.id, LEASED, worker)).rowcount == 1
+
+    def complete(self, task, worker, files):
+        with self._connect() as db:
+            return db.execute('UPDATE tasks SET state = ?, worker = ?, expires = NULL, files = ?, error = NULL '
+                              'WHERE id = ? AND state != ?',
+                              (DONE, worker, json.dumps(files), task.id, DONE)).rowcount == 1
+
+    def fail(self, task, worker, error, retry=True):
+        with self._connect() as db:
+            row = db.execute('SELECT attempts FROM tasks WHERE id = ? AND state = ? AND worker = ?',
+                             (task.id, LEASED, worker)).fetchone()
+            if row is None:
+                # the lease expired and the task was already requeued
+                return
+            state = PENDING if retry and row[0] < self.max_attempts else FAILED
+            db.execute('UPDATE tasks SET state = ?, worker = NULL, expires = NULL, error = ? WHERE id = ?',
+                       (state, str(error), task.id))
+
+    def remaining(self, scene):
+        with self._connect() as db:
+            return db.execute('SELECT COUNT(*) FROM tasks WHERE scene = ? AND state != ?', (scene, DONE)).fetchone()[0]
+
+    def files(self, scene):
+        with self._connect() as db:
+            rows = db.execute('SELECT files FROM tasks WHERE scene = ? AND state = ? ORDER BY seq',
+                              (scene, DONE)).fetchall()
+        return [f for row in rows for f in json.loads(row[0])]
+
+    def counts(self):
+        counts = dict((state, 0) for state in [PENDING, LEASED, DONE, FAILED])
+        with self._connect() as db:
+            counts.update(db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+        return counts
+
+    def errors(self):
+        with self._connect() as db:
+            return dict(db.execute('SELECT id, error FROM tasks WHERE state = ?', (FAILED,)).fetchall())
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class RedisQueue(WorkQueue):
+    """ Work queue in Redis. Each operation is a sequence of single-key commands whose return values
+    decide the races between nodes: a task is added by the node whose HSETNX succeeds, requeued by the
+    node whose ZREM of the expired lease (or LREM of an orphaned claim) succeeds and completed by the
+    node whose SADD succeeds.
+
+    A claim moves the task from the pending list to a processing list with RPOPLPUSH before its lease
+    is written, so a node that dies in between leaves the task in the processing list, from where it
+    is requeued once it has gone without a lease for ``claim_timeout`` seconds.
+    :param client:
+        A Redis client, e.g. ``redis.Redis.from_url('redis://host:6379/0')``
+    :type client:
+        Object
+    :param name:
+        The prefix of the keys of the queue. Default value is sdownloader.
+    :type name:
+        String
+    :param claim_timeout:
+        The seconds a claimed task can go without a lease before it is requeued. Default value is 30.
+    :type claim_timeout:
+        Float
+    """
+
+    def __init__(self, client, name='sdownloader', max_attempts=3, claim_timeout=30):
+        super(RedisQueue, self).__init__(max_attempts)
+        self.client = client
+        self.name = name
+        self.claim_timeout = claim_timeout
+
+    def key(self, *parts):
+        return ':'.join((self.name,) + parts)
+
+    def put(self, tasks):
+        added = 0
+        for task in tasks:
+            if self.client.hsetnx(self.key('tasks'), task.id, task.to_json()):
+                self.client.sadd(self.key('scene', task.scene), task.id)
+                self.client.hincrby(self.key('remaining'), task.scene, 1)
+                self.client.lpush(self.key('pending'), task.id)
+                added += 1
+        return added
+
+    def requeue_expired(self):
+        requeued = 0
+        for id in self.client.zrangebyscore(self.key('leases'), '-inf', time.time()):
+            if not self.client.zrem(self.key('leases'), id):
+                # another node requeued it first
+                continue
+            self.client.hdel(self.key('owners'), id)
+            self.client.lrem(self.key('processing'), 1, id)
+            attempts = int(self.client.hget(self.key('attempts'), id) or 0)
+            if attempts >= self.max_attempts:
+                self._failed(id, 'lease expired')
+            else:
+                self.client.rpush(self.key('pending'), id)
+                requeued += 1
+
+        requeued += self._requeue_orphans()
+        if requeued:
+            logger.info('{0} expired tasks requeued'.format(requeued))
+        return requeued
+
+    def _requeue_orphans(self):
+        """ Requeues the tasks of the processing list that were claimed by a node that died before it
+        wrote their lease. The first scan that sees a task without a lease records the time.
+        """
+        requeued = 0
+        now = time.time()
+        for id in self.client.lrange(self.key('processing'), 0, -1):
+            id = _text(id)
+            if self.client.zscore(self.key('leases'), id) is not None:
+                continue
+            self.client.hsetnx(self.key('orphans'), id, now)
+            if now - float(self.client.hget(self.key('orphans'), id) or now) < self.claim_timeout:
+                continue
+            self.client.hdel(self.key('orphans'), id)
+            if not self.client.lrem(self.key('processing'), 1, id):
+                # another node requeued it first
+                continue
+            if not (self.client.sismember(self.key('done'), id) or self.client.sismember(self.key('failed'), id)):
+                self.client.rpush(self.key('pending'), id)
+                requeued += 1
+        return requeued
+
+    def claim(self, worker, lease=60):
+        self.requeue_expired()
+        while True:
+            id = self.client.rpoplpush(self.key('pending'), self.key('processing'))
+            if id is None:
+                return None
+            id = _text(id)
+            if self.client.sismember(self.key('done'), id) or self.client.sismember(self.key('failed'), id):
+                self.client.lrem(self.key('processing'), 1, id)
+                continue
+
+            self.client.zadd(self.key('leases'), {id: time.time() + lease})
+            self.client.hdel(self.key('orphans'), id)
+            self.client.hset(self.key('owners'), id, worker)
+            attempts = self.client.hincrby(self.key('attempts'), id, 1)
+            return Task.from_json(_text(self.client.hget(self.key('tasks'), id)), attempts, worker)
+
+    def _holds(self, task, worker):
+        return _text(self.client.hget(self.key('owners'), task.id)) == worker
+
+    def heartbeat(self, task, worker, lease=60):
+        if not self._holds(task, worker) or self.client.zscore(self.key('leases'), task.id) is None:
+            return False
+        self.client.zadd(self.key('leases'), {task.id: time.time() + lease})
+        return True
+
+    def complete(self, task, worker, files):
+        if self._holds(task, worker):
+            self.client.zrem(self.key('leases'), task.id)
+            self.client.hdel(self.key('owners'), task.id)
+            self.client.lrem(self.key('processing'), 1, task.id)
+        if not self.client.sadd(self.key('done'), task.id):
+            return False
+        self.client.hset(self.key('files'), task.id, json.dumps(files))
+        self.client.hincrby(self.key('remaining'), task.scene, -1)
+        # remove the copy of a task that was requeued while this worker finished it
+        self.client.lrem(self.key('pending'), 0, task.id)
+        return True
+
+    def _failed(self, id, error):
+        self.client.sadd(self.key('failed'), id)
+        self.client.hset(self.key('errors'), id, error)
+
+    def fail(self, task, worker, error, retry=True):
+        if not self._holds(task, worker) or not self.client.zrem(self.key('leases'), task.id):
+            return
+        self.client.hdel(self.key('owners'), task.id)
+        self.client.lrem(self.key('processing'), 1, task.id)
+        if retry and task.attempts < self.max_attempts:
+            self.client.rpush(self.key('pending'), task.id)
+        else:
+            self._failed(task.id, str(error))
+
+    def remaining(self, scene):
+        return int(self.client.hget(self.key('remaining'), scene) or 0)
+
+    def files(self, scene):
+        ids = sorted(_text(id) for id in self.client.smembers(self.key('scene', scene)))
+        files = []
+        for id in ids:
+            value = self.client.hget(self.key('files'), id)
+            if value is not None:
+                files.extend(json.loads(_text(value)))
+        return files
+
+    def counts(self):
+        return {
+            PENDING: self.client.llen(self.key('pending')),
+            LEASED: self.client.zcard(self.key('leases')),
+            DONE: self.client.scard(self.key('done')),
+            FAILED: self.client.scard(self.key('failed')),
+        }
+
+    def errors(self):
+        return dict((_text(id), _text(error)) for id, error in self.client.hgetall(self.key('errors')).items())
+
+
+class Worker(object):
+    """ Downloads the tasks of a queue with the transfer options of a downloader.
+    :param downloader:
+        A Landsat8 or Sentinel2 instance. The tasks are spread over its ``max_workers`` threads.
+    :type downloader:
+        Object
+    :param queue:
+        A SQLiteQueue or RedisQueue
+    :type queue:
+        WorkQueue
+    :param name:
+        The name of the worker in the leases. Default value is the host name, process ID and a random suffix.
+    :type name:
+        String
+    :param lease:
+        The seconds a task is leased for. Default value is 60.
+    :type lease:
+        Float
+    :param heartbeat:
+        The seconds between two renewals of the lease. Default value is a third of the lease.
+    :type heartbeat:
+        Float
+    """
+
+    def __init__(self, downloader, queue, name=None, lease=60, heartbeat=None):
+        self.downloader = downloader
+        self.queue = queue
+        self.name = name or '{0}:{1}:{2}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.lease = lease
+        self.heartbeat = heartbeat or lease / 3.0
+        self.lock = threading.Lock()
+        self.stats = {DONE: 0, FAILED: 0}
+
+    def _heartbeat(self, task, stop):
+        while not stop.wait(self.heartbeat):
+            if not self.queue.heartbeat(task, self.name, self.lease):
+                logger.warning('{0} lost the lease of {1}'.format(self.name, task.id))
+                return
+
+    def process(self, task):
+        """ Downloads the file of a task while its lease is renewed, then records it in the manifest of
+        the scene if it was the last task of the scene
+        """
+        stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(task, stop))
+        beat.daemon = True
+        beat.start()
+        try:
+            check_create_folder(task.folder)
+            files = self.downloader._fetch_item(task.plan_item(), task.url)
+        except Exception as e:
+            logger.error('{0} failed: {1}'.format(task.id, e))
+            self.queue.fail(task, self.name, e, retry=not isinstance(e, RemoteFileDoesntExist))
+            with self.lock:
+                self.stats[FAILED] += 1
+            return
+        finally:
+            stop.set()
+            beat.join()
+
+        if not isinstance(files, list):
+            files = [files]
+        if self.queue.complete(task, self.name, files) and self.queue.remaining(task.scene) == 0:
+            self.downloader._mark_complete(task.scene, task.source, self.queue.files(task.scene))
+        with self.lock:
+            self.stats[DONE] += 1
+
+    def _loop(self, max_tasks, wait, poll):
+        while True:
+            with self.lock:
+                if max_tasks is not None and self.stats[DONE] + self.stats[FAILED] >= max_tasks:
+                    return
+            task = self.queue.claim(self.name, self.lease)
+            if task is None:
+                if not wait:
+                    return
+                time.sleep(poll)
+                continue
+            logger.info('{0} claimed {1}'.format(self.name, task))
+            self.process(task)
+
+    def run(self, max_tasks=None, wait=False, poll=1.0):
+        """ Claims and downloads tasks until the queue is empty.
+        :param max_tasks:
+            Stop after this number of tasks. Default value is None (no limit).
+        :type max_tasks:
+            Integer
+        :param wait:
+            Keep polling an empty queue for new tasks instead of returning. Default value is False.
+        :type wait:
+            Boolean
+        :param poll:
+            The seconds between two claims of an empty queue. Default value is 1.
+        :type poll:
+            Float
+        :returns:
+            (dict) the number of tasks done and failed by this worker
+        """
+        threads = max(self.downloader.max_workers, 1)
+        results = run_concurrently(lambda i: self._loop(max_tasks, wait, poll), list(range(threads)), threads)
+        for result, e in results:
+            if e is not None:
+                raise e
+        return dict(self.stats)
+
+
+def enqueue(queue, plan):
+    """ Puts the files of a DownloadPlan on a queue.
+    :returns:
+        (Integer) the number of tasks added, the files already on the queue are skipped
+    """
+    return queue.put(tasks_of(plan))
@@ -32,16 +32,26 @@ setup(
         'Intended Audience :: Developers',
         'Intended Audience :: Science/Research',
         'License :: Freeware',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
+    python_requires='>=3.7',
     keywords='',
     packages=find_packages(exclude=['docs', 'tests*']),
     include_package_data=True,
     author='Alireza J (scisco)',
     install_requires=install_requires,
+    entry_points={
+        'console_scripts': ['sdownload = sdownloader.cli:main'],
+    },
+    extras_require={
+        'asyncio': ['aiohttp>=3.0'],
+    },
     dependency_links=dependency_links,
     author_email='alireza@developmentseed.org',
     setup_requires=['pytest-runner'],
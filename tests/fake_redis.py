@@ -0,0 +1,136 @@
+""" In-memory stand-in for the redis.Redis commands used by the work queue """
+import threading
+from collections import defaultdict
+
+
+def encode(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class FakeRedis(object):
+    """ Keeps the keys in dicts, lists and sets and returns bytes like a client without decode_responses """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hashes = defaultdict(dict)
+        self.lists = defaultdict(list)
+        self.sets = defaultdict(set)
+        self.zsets = defaultdict(dict)
+
+    def hsetnx(self, name, key, value):
+        with self.lock:
+            if encode(key) in self.hashes[name]:
+                return 0
+            self.hashes[name][encode(key)] = encode(value)
+            return 1
+
+    def hset(self, name, key, value):
+        with self.lock:
+            new = encode(key) not in self.hashes[name]
+            self.hashes[name][encode(key)] = encode(value)
+            return int(new)
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.hashes[name].get(encode(key))
+
+    def hdel(self, name, key):
+        with self.lock:
+            return int(self.hashes[name].pop(encode(key), None) is not None)
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            value = int(self.hashes[name].get(encode(key), 0)) + amount
+            self.hashes[name][encode(key)] = encode(value)
+            return value
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes[name])
+
+    def lpush(self, name, value):
+        with self.lock:
+            self.lists[name].insert(0, encode(value))
+            return len(self.lists[name])
+
+    def rpush(self, name, value):
+        with self.lock:
+            self.lists[name].append(encode(value))
+            return len(self.lists[name])
+
+    def rpop(self, name):
+        with self.lock:
+            if not self.lists[name]:
+                return None
+            return self.lists[name].pop()
+
+    def rpoplpush(self, src, dst):
+        with self.lock:
+            if not self.lists[src]:
+                return None
+            value = self.lists[src].pop()
+            self.lists[dst].insert(0, value)
+            return value
+
+    def lrange(self, name, start, end):
+        with self.lock:
+            return list(self.lists[name][start:None if end == -1 else end + 1])
+
+    def lrem(self, name, count, value):
+        with self.lock:
+            values = self.lists[name]
+            matches = [i for i, v in enumerate(values) if v == encode(value)]
+            if count > 0:
+                matches = matches[:count]
+            for i in reversed(matches):
+                del values[i]
+            return len(matches)
+
+    def llen(self, name):
+        with self.lock:
+            return len(self.lists[name])
+
+    def sadd(self, name, value):
+        with self.lock:
+            if encode(value) in self.sets[name]:
+                return 0
+            self.sets[name].add(encode(value))
+            return 1
+
+    def sismember(self, name, value):
+        with self.lock:
+            return encode(value) in self.sets[name]
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self.sets[name])
+
+    def scard(self, name):
+        with self.lock:
+            return len(self.sets[name])
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            added = len([key for key in mapping if encode(key) not in self.zsets[name]])
+            self.zsets[name].update((encode(key), float(score)) for key, score in mapping.items())
+            return added
+
+    def zrem(self, name, value):
+        with self.lock:
+            return int(self.zsets[name].pop(encode(value), None) is not None)
+
+    def zscore(self, name, value):
+        with self.lock:
+            return self.zsets[name].get(encode(value))
+
+    def zrangebyscore(self, name, min, max):
+        min, max = float(min), float(max)
+        with self.lock:
+            items = sorted((score, key) for key, score in self.zsets[name].items() if min <= score <= max)
+        return [key for score, key in items]
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self.zsets[name])
@@ -0,0 +1,141 @@
+""" A local HTTP server standing in for AWS S3 and Google Storage in the tests """
+import time
+import hashlib
+import threading
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients that cancel a transfer close the connection in the middle of a response
+        pass
+
+
+class FakeServer(object):
+    """ Serves the bytes in ``files`` (a dict of url path to content) on localhost. ``failures`` maps a
+    url path to the statuses returned by its first requests, ``delays`` to the seconds its first
+    requests wait before they are answered and ``truncations`` to the number of body bytes its first
+    responses send before the connection is closed.
+    """
+
+    def __init__(self, files=None, ranges=True, headers=None, failures=None, delays=None, truncations=None):
+        self.files = files or {}
+        self.ranges = ranges
+        self.headers = headers or {}
+        self.failures = failures or {}
+        self.delays = delays or {}
+        self.truncations = truncations or {}
+        self.page_size = 1000
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.respond(body=False)
+
+            def do_GET(self):
+                self.respond(body=True)
+
+            def respond(self, body):
+                server.requests.append((self.command, self.path, self.headers.get('Range')))
+                query = parse_qs(urlparse(self.path).query)
+                if query.get('list-type') == ['2']:
+                    return self.list_objects(query)
+                content = server.files.get(self.path.split('?')[0])
+                failures = server.failures.get(self.path.split('?')[0])
+                delays = server.delays.get(self.path.split('?')[0])
+                if delays:
+                    time.sleep(delays.pop(0))
+
+                if failures:
+                    self.send_response(failures.pop(0))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                if content is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                etag = '"%s"' % hashlib.md5(server.files[self.path.split('?')[0]]).hexdigest()
+                requested = self.headers.get('Range')
+                if self.headers.get('If-Range') not in (None, etag):
+                    requested = None
+                if requested and server.ranges and self.command == 'GET':
+                    start, end = requested.split('=')[1].split('-')
+                    start, end = int(start), min(int(end or len(content) - 1), len(content) - 1)
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end, len(content)))
+                    content = content[start:end + 1]
+                else:
+                    self.send_response(200)
+
+                self.send_header('Accept-Ranges', 'bytes')
+                headers = {'ETag': etag}
+                headers.update(server.headers.get(self.path.split('?')[0], {}))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                truncations = server.truncations.get(self.path.split('?')[0])
+                if body and truncations and self.command == 'GET':
+                    self.wfile.write(content[:truncations.pop(0)])
+                    self.close_connection = True
+                elif body:
+                    self.wfile.write(content)
+
+            def list_objects(self, query):
+                """ Answers a S3 ListObjectsV2 request for the files under a prefix """
+                prefix = query.get('prefix', [''])[0]
+                delimiter = query.get('delimiter', [None])[0]
+                start = int(query.get('continuation-token', ['0'])[0])
+
+                keys = sorted(path[1:] for path in server.files if path[1:].startswith(prefix))
+                if delimiter:
+                    keys = [k for k in keys if delimiter not in k[len(prefix):]]
+                page = keys[start:start + server.page_size]
+                truncated = start + server.page_size < len(keys)
+
+                body = '<?xml version="1.0" encoding="UTF-8"?>'
+                body += '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                body += '<Prefix>%s</Prefix><IsTruncated>%s</IsTruncated>' % (escape(prefix), str(truncated).lower())
+                for key in page:
+                    content = server.files['/' + key]
+                    body += '<Contents><Key>%s</Key><Size>%s</Size><ETag>&quot;%s&quot;</ETag></Contents>' % (
+                        escape(key), len(content), hashlib.md5(content).hexdigest())
+                if truncated:
+                    body += '<NextContinuationToken>%s</NextContinuationToken>' % (start + server.page_size)
+                body += '</ListBucketResult>'
+
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command == 'GET':
+                    self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s/' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
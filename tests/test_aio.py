@@ -0,0 +1,174 @@
+import os
+import errno
+import shutil
+import asyncio
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import aio, policy
+from sdownloader.download import Scenes
+from sdownloader.errors import DownloadError, RemoteFilesMissing
+from sdownloader.landsat8 import Landsat8
+from sdownloader.sentinel2 import Sentinel2
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        policy.configure(backoff=0, retries=2)
+        self.scene = 'LC80010092015051LGN00'
+        self.prefix = '/L8/001/009/%s/%s' % (self.scene, self.scene)
+        self.files = dict(('%s_%s' % (self.prefix, f), f.encode() * 100)
+                          for f in ['B4.TIF', 'B3.TIF', 'BQA.TIF', 'MTL.txt'])
+
+    def tearDown(self):
+        policy.configure(backoff=0.5, retries=5)
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_landsat8_download_async(self):
+        """ Test the awaitable download fetches all bands from S3 """
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, engine='asyncio')
+                results = asyncio.run(l.download_async([self.scene], [4, 3]))
+
+        self.assertTrue(isinstance(results, Scenes))
+        self.assertEqual(results.scenes, [self.scene])
+        self.assertEqual(len(results[self.scene].files), 4)
+        with open(results[self.scene].files[0], 'rb') as f:
+            self.assertEqual(f.read(), b'B4.TIF' * 100)
+
+    def test_landsat8_download_async_falls_back_to_google(self):
+        """ Test google is used when a band is missing on S3 """
+
+        tarball = '/L8/001/009/%s.tar.bz' % self.scene
+        self.files[tarball] = b'tar' * 100
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, engine='asyncio')
+                results = l.download([self.scene], [4, 5])
+
+        self.assertEqual(results[self.scene].zip_file, os.path.join(self.temp_folder, self.scene + '.tar.bz'))
+        self.assertNotIn(('GET', '%s_B4.TIF' % self.prefix, None), server.requests)
+
+    def test_one_request_per_check(self):
+        """ Test fetch uses the result of the existence check instead of sending another HEAD request """
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, engine='asyncio')
+                l.download([self.scene], [4])
+                first = sorted(server.requests)
+                del server.requests[:]
+                l.download([self.scene], [4])
+
+        paths = sorted('%s_%s' % (self.prefix, f) for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+        self.assertEqual(first, [('GET', path, None) for path in paths] + [('HEAD', path, None) for path in paths])
+        self.assertEqual(sorted(server.requests), [('HEAD', path, None) for path in paths])
+
+    def test_existing_file_without_check(self):
+        """ Test a file that exists is compared with the headers of the GET response when it wasn't checked """
+
+        async def fetch(url):
+            async with aio.AsyncFetcher() as fetcher:
+                return await fetcher.fetch(url, self.temp_folder)
+
+        path = '%s_MTL.txt' % self.prefix
+        target = os.path.join(self.temp_folder, path.split('/')[-1])
+        with open(target, 'wb') as f:
+            f.write(b'x' * len(self.files[path]))
+
+        with FakeServer(self.files) as server:
+            self.assertEqual(asyncio.run(fetch(server.url + path.lstrip('/'))), target)
+
+        self.assertEqual(server.requests, [('GET', path, None)])
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * len(self.files[path]))
+
+    def test_retries_follow_the_policy(self):
+        """ Test throttled requests are retried and counted like with the requests engine """
+
+        failures = {'%s_B4.TIF' % self.prefix: [503, 429]}
+        with FakeServer(self.files, failures=failures) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, engine='asyncio')
+                results = l.download([self.scene], [4])
+                stats = policy.stats()['127.0.0.1']
+
+        self.assertEqual(len(results[self.scene].files), 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['throttled'], 1)
+
+    def test_failures_are_collected(self):
+        """ Test a scene that keeps failing doesn't stop the others and every failure is reported """
+
+        other = 'LC80010102015051LGN00'
+        prefix = '/L8/001/010/%s/%s' % (other, other)
+        self.files.update(('%s_%s' % (prefix, f), b'x') for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+
+        with FakeServer(self.files, failures={'%s_B4.TIF' % prefix: [503] * 20}) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, engine='asyncio')
+                with self.assertRaises(DownloadError) as context:
+                    l.download([other, self.scene], [4])
+
+        self.assertEqual(list(context.exception.failures), [other])
+        self.assertEqual(context.exception.scenes.scenes, [self.scene])
+
+    def test_unsupported_options(self):
+        for options in [{'resume': True}, {'verify': True}, {'stream_extract': True}, {'revalidate': 'never'}]:
+            l = Landsat8(download_dir=self.temp_folder, engine='asyncio', **options)
+            self.assertRaises(ValueError, l.download, [self.scene], [4])
+
+        self.assertRaises(ValueError, Sentinel2(download_dir=self.temp_folder, engine='asyncio', resume=True).download,
+                          ['tiles/34/R/CS/2016/3/25/0'], ['red'])
+
+    def test_sentinel2_download(self):
+        """ Test selecting the asyncio engine on Sentinel2 """
+
+        files = {'/tiles/34/R/CS/2016/3/25/0/B04.jp2': b'4' * 10, '/tiles/34/R/CS/2016/3/25/0/B03.jp2': b'3' * 10}
+
+        with FakeServer(files) as server:
+            with mock.patch('sdownloader.common.S3_SENTINEL', server.url):
+                l = Sentinel2(download_dir=self.temp_folder, engine='asyncio', per_host_limit=2)
+                results = l.download(['tiles/34/R/CS/2016/3/25/0'], ['red', 'green'])
+
+        self.assertEqual(len(results[0].files), 2)
+        self.assertTrue(all(os.path.getsize(f) == 10 for f in results[0].files))
+
+    def test_sentinel2_download_missing_band(self):
+        """ Test a scene with a missing band doesn't stop the other scenes from being downloaded """
+
+        files = {'/tiles/34/R/CS/2016/3/25/0/B04.jp2': b'4' * 10, '/tiles/34/R/CS/2016/3/25/0/B03.jp2': b'3' * 10,
+                 '/tiles/34/R/CS/2016/3/26/0/B04.jp2': b'4' * 10}
+        scenes = ['tiles/34/R/CS/2016/3/25/0', 'tiles/34/R/CS/2016/3/26/0']
+
+        with FakeServer(files) as server:
+            with mock.patch('sdownloader.common.S3_SENTINEL', server.url):
+                l = Sentinel2(download_dir=self.temp_folder, engine='asyncio')
+                with self.assertRaises(RemoteFilesMissing) as context:
+                    l.download(scenes, ['red', 'green'])
+
+            fetched = [path for method, path, r in server.requests if method == 'GET']
+
+        failures = list(context.exception.failures)
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].endswith('/tiles/34/R/CS/2016/3/26/0/B03.jp2'))
+        self.assertEqual(context.exception.scenes.scenes, [scenes[0]])
+        self.assertEqual(len(context.exception.scenes[scenes[0]].files), 2)
+        self.assertEqual(sorted(fetched), ['/tiles/34/R/CS/2016/3/25/0/B03.jp2', '/tiles/34/R/CS/2016/3/25/0/B04.jp2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import common
+from sdownloader.cache import FileCache
+from sdownloader.landsat8 import Landsat8
+from sdownloader.sentinel2 import Sentinel2
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.cache_dir = os.path.join(self.temp_folder, 'cache')
+        common.probe_cache.clear()
+        self.scene = 'LC80010092015051LGN00'
+        prefix = '/L8/001/009/%s/%s' % (self.scene, self.scene)
+        self.files = dict(('%s_%s' % (prefix, f), f.encode() * 100) for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_shared_cache(self):
+        """ Test a second job links the files from the cache instead of downloading them """
+
+        cache = FileCache(self.cache_dir)
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                first = Landsat8(download_dir=os.path.join(self.temp_folder, 'job1'), cache=cache)
+                first.download([self.scene], [4])
+
+                del server.requests[:]
+                second = Landsat8(download_dir=os.path.join(self.temp_folder, 'job2'), cache=cache)
+                results = second.download([self.scene], [4])
+
+        self.assertFalse([r for r in server.requests if r[0] == 'GET'])
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 3, 'evicted_bytes': 0, 'files': 3, 'bytes': 2000})
+        with open(results[self.scene].files[0], 'rb') as f:
+            self.assertEqual(f.read(), b'B4.TIF' * 100)
+
+    def test_lru_eviction(self):
+        """ Test the least recently used files are evicted beyond max_bytes """
+
+        source = os.path.join(self.temp_folder, 'file')
+        with open(source, 'wb') as f:
+            f.write(b'x' * 100)
+
+        cache = FileCache(self.cache_dir, max_bytes=250)
+        cache.put('http://a', 'etag', 100, source)
+        cache.put('http://b', 'etag', 100, source)
+        self.assertTrue(cache.get('http://a', 'etag', 100, os.path.join(self.temp_folder, 'a')))
+        cache.put('http://c', 'etag', 100, source)
+
+        self.assertFalse(cache.get('http://b', 'etag', 100, os.path.join(self.temp_folder, 'b')))
+        self.assertTrue(cache.get('http://a', 'etag', 100, os.path.join(self.temp_folder, 'a')))
+        self.assertEqual(cache.stats()['evicted_bytes'], 100)
+
+        # a changed ETag is a miss
+        self.assertFalse(cache.get('http://a', 'other', 100, os.path.join(self.temp_folder, 'a')))
+
+    def test_cache_dir_option(self):
+        l = Sentinel2(download_dir=self.temp_folder, cache=self.cache_dir)
+        self.assertTrue(isinstance(l.cache, FileCache))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'index.sqlite')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import io
+import os
+import json
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import cli, common
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        self.scenes = ['LC80010092015051LGN00', 'LC80010102015051LGN00']
+        self.missing_scene = 'LC82050312015136LGN00'
+        self.files = {}
+        for scene in self.scenes:
+            prefix = '/L8/001/%s/%s/%s' % (scene[6:9], scene, scene)
+            self.files.update(('%s_%s' % (prefix, f), f.encode() * 10) for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+
+        self.manifest = os.path.join(self.temp_folder, 'scenes.txt')
+        with open(self.manifest, 'w') as f:
+            f.write('# scenes of the job\n%s\n\n%s\n%s\n' % (self.scenes[0], self.missing_scene, self.scenes[1]))
+        self.output = os.path.join(self.temp_folder, 'results.jsonl')
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def run_cli(self, *args):
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                status = cli.main(['landsat8', '-d', os.path.join(self.temp_folder, 'scenes')] + list(args))
+        return status, server
+
+    def results(self):
+        with open(self.output) as f:
+            return dict((r['scene'], r) for r in map(json.loads, f))
+
+    def test_parse_bands(self):
+        self.assertEqual(cli.parse_bands('4, 3,quality,'), [4, 3, 'quality'])
+
+    def test_read_scenes_is_lazy(self):
+        lines = iter(['a\n', '# comment\n', 'b  # trailing\n', 'c\n'])
+        scenes = cli.read_scenes(lines, skip=set(['c']))
+        self.assertEqual(next(scenes), 'a')
+        self.assertEqual(next(lines), '# comment\n')
+        self.assertEqual(list(scenes), ['b'])
+
+    def test_download_manifest(self):
+        status, server = self.run_cli(self.manifest, '-o', self.output, '--bands', '4', '--workers', '2')
+
+        self.assertEqual(status, 1)
+        results = self.results()
+        self.assertEqual(sorted(results), sorted(self.scenes + [self.missing_scene]))
+        self.assertEqual(results[self.missing_scene]['status'], 'failed')
+        self.assertEqual(results[self.missing_scene]['error_type'], 'RemoteFileDoesntExist')
+        for scene in self.scenes:
+            self.assertEqual(results[scene]['status'], 'ok')
+            self.assertEqual(len(results[scene]['files']), 3)
+            self.assertTrue(all(os.path.exists(f) for f in results[scene]['files']))
+
+    def test_resume(self):
+        """ Test a resumed run only retries the scenes that are not recorded as ok """
+
+        self.run_cli(self.manifest, '-o', self.output, '--bands', '4')
+        status, server = self.run_cli(self.manifest, '-o', self.output, '--bands', '4', '--resume')
+
+        self.assertEqual(status, 1)
+        self.assertFalse([p for m, p, r in server.requests if '001/009' in p or '001/010' in p])
+        with open(self.output) as f:
+            self.assertEqual([json.loads(line)['scene'] for line in f].count(self.missing_scene), 2)
+
+    def test_stdin_and_stdout(self):
+        stdout = io.StringIO()
+        with mock.patch('sys.stdin', io.StringIO(self.scenes[0] + '\n')), mock.patch('sys.stdout', stdout):
+            status, server = self.run_cli('--bands', '4')
+
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(stdout.getvalue())['scene'], self.scenes[0])
+
+    def test_make_downloader(self):
+        with mock.patch.dict(os.environ, {'SDOWNLOAD_USGS_USER': 'user', 'SDOWNLOAD_USGS_PASS': 'secret'}):
+            args = cli.build_parser().parse_args(['landsat8', '-w', '8', '--band-workers', '2',
+                                                  '--per-host-limit', '16'])
+        with mock.patch('sdownloader.policy.configure') as configure_policy, \
+                mock.patch('sdownloader.session.configure') as configure_session:
+            downloader = cli.make_downloader(args)
+
+        self.assertEqual(downloader.max_workers, 2)
+        self.assertEqual(downloader.per_host_limit, 16)
+        self.assertEqual((downloader.usgs_user, downloader.usgs_pass), ('user', 'secret'))
+        configure_policy.assert_called_once_with(max_concurrency=16)
+        configure_session.assert_called_once_with(pool_maxsize=16)
+
+    def test_default_host_limit(self):
+        args = cli.build_parser().parse_args(['landsat8'])
+        with mock.patch('sdownloader.policy.configure') as configure_policy:
+            cli.make_downloader(args)
+
+        self.assertFalse(configure_policy.called)
+
+    def test_sentinel_requires_bands(self):
+        with mock.patch('sys.stderr', io.StringIO()):
+            self.assertRaises(SystemExit, cli.main, ['sentinel2', self.manifest])
+
+
+if __name__ == '__main__':
+    unittest.main()
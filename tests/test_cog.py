@@ -0,0 +1,156 @@
+import os
+import io
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import cog, common
+from sdownloader.landsat8 import Landsat8
+from sdownloader.sentinel2 import Sentinel2
+from sdownloader.errors import NotCloudOptimized
+
+
+def make_cog(tile_size=10000):
+    """ A 1024x1024 GeoTIFF with 256x256 tiles and one overview. The tiles are filled with their index. """
+    tags = {
+        258: cog.Tag(cog.SHORT, (8,)),
+        259: cog.Tag(cog.SHORT, (8,)),
+        262: cog.Tag(cog.SHORT, (1,)),
+        277: cog.Tag(cog.SHORT, (1,)),
+        322: cog.Tag(cog.SHORT, (256,)),
+        323: cog.Tag(cog.SHORT, (256,)),
+        33550: cog.Tag(cog.DOUBLE, (30.0, 30.0, 0.0)),
+        33922: cog.Tag(cog.DOUBLE, (0.0, 0.0, 0.0, 300000.0, 4000000.0, 0.0)),
+        34737: cog.Tag(cog.ASCII, b'WGS 84 / UTM zone 19N|\0'),
+    }
+    full = dict(tags)
+    full.update({256: cog.Tag(cog.LONG, (1024,)), 257: cog.Tag(cog.LONG, (1024,))})
+    overview = {254: cog.Tag(cog.LONG, (1,)), 256: cog.Tag(cog.LONG, (512,)), 257: cog.Tag(cog.LONG, (512,))}
+    overview.update((tag, tags[tag]) for tag in [258, 259, 262, 277, 322, 323])
+
+    f = io.BytesIO()
+    cog.write_tiff(f, '<', [(full, [bytes([i]) * tile_size for i in range(16)]),
+                            (overview, [bytes([100 + i]) * tile_size for i in range(4)])])
+    return f.getvalue()
+
+
+def parse(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, cog.read_ifds(lambda offset, length: data[offset:offset + length])[1]
+
+
+def tile(data, ifd, i):
+    offset = ifd.get(cog.TILE_OFFSETS)[i]
+    return data[offset:offset + ifd.get(cog.TILE_BYTE_COUNTS)[i]]
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        self.cog = make_cog()
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_read_ifds(self):
+        order, ifds = cog.read_ifds(lambda offset, length: self.cog[offset:offset + length])
+        self.assertEqual(order, '<')
+        self.assertEqual([(ifd.width, ifd.tiles_across) for ifd in ifds], [(1024, 4), (512, 2)])
+        self.assertEqual(ifds[0].get(34737), b'WGS 84 / UTM zone 19N|\0')
+
+    def test_not_a_tiff(self):
+        self.assertRaises(NotCloudOptimized, cog.read_ifds, lambda offset, length: b'\0\0\0\x0cjP  '[:length])
+
+    def test_coalesce(self):
+        self.assertEqual(cog.coalesce([(100, 10), (0, 10), (110, 5), (5000, 10)], gap=0),
+                         [(0, 10), (100, 15), (5000, 10)])
+
+    def test_read_window(self):
+        """ Test only the header and the tile covering the window are fetched """
+
+        with FakeServer({'/B4.TIF': self.cog}) as server:
+            target = os.path.join(self.temp_folder, 'B4_window.TIF')
+            cog.read_window(server.url + 'B4.TIF', target, window=(600, 600, 100, 100))
+
+        data, ifds = parse(target)
+        self.assertEqual(len(ifds), 1)
+        self.assertEqual((ifds[0].width, ifds[0].height), (256, 256))
+        self.assertEqual(tile(data, ifds[0], 0), bytes([10]) * 10000)
+        self.assertEqual(ifds[0].get(cog.MODEL_TIEPOINT), (0.0, 0.0, 0.0, 315360.0, 3984640.0, 0.0))
+        self.assertEqual(ifds[0].get(259), (8,))
+
+        # the header, the IFD of the overview and the tile
+        offset = cog.read_ifds(lambda offset, length: self.cog[offset:offset + length])[1][0].get(cog.TILE_OFFSETS)[10]
+        ranges = [r for m, p, r in server.requests]
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[0], 'bytes=0-65535')
+        self.assertEqual(ranges[2], 'bytes=%s-%s' % (offset, offset + 9999))
+
+    def test_read_bbox_overview(self):
+        """ Test a bbox spanning two tiles of the overview """
+
+        with FakeServer({'/B4.TIF': self.cog}) as server:
+            target = os.path.join(self.temp_folder, 'B4_window.TIF')
+            image = cog.COG(server.url + 'B4.TIF')
+            self.assertEqual(image.overviews, 1)
+            self.assertEqual(image.pixel_window(bbox=(300000 + 60 * 200, 4000000 - 60 * 100, 300000 + 60 * 300,
+                                                      4000000 - 60 * 50), overview=1), (200, 50, 100, 50))
+            image.read(target, bbox=(300000 + 60 * 200, 4000000 - 60 * 100, 300000 + 60 * 300, 4000000 - 60 * 50),
+                       overview=1)
+
+        data, ifds = parse(target)
+        self.assertEqual((ifds[0].width, ifds[0].height), (512, 256))
+        self.assertEqual([tile(data, ifds[0], i) for i in range(2)], [bytes([100]) * 10000, bytes([101]) * 10000])
+        self.assertEqual(ifds[0].get(cog.MODEL_PIXEL_SCALE), (60.0, 60.0, 0.0))
+
+    def test_window_outside_image(self):
+        with FakeServer({'/B4.TIF': self.cog}) as server:
+            image = cog.COG(server.url + 'B4.TIF')
+            self.assertRaises(ValueError, image.pixel_window, window=(2000, 0, 10, 10))
+            self.assertRaises(ValueError, image.pixel_window)
+
+    def test_landsat_download_window(self):
+        scene = 'LC80010092015051LGN00'
+        prefix = '/L8/001/009/%s/%s' % (scene, scene)
+        files = {prefix + '_B4.TIF': self.cog, prefix + '_BQA.TIF': self.cog, prefix + '_MTL.txt': b'MTL'}
+
+        with FakeServer(files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder)
+                scenes = l.download_window([scene], [4], window=(0, 0, 10, 10))
+
+        self.assertEqual(sorted(os.path.basename(f) for f in scenes[scene].files),
+                         ['%s_B4_window.TIF' % scene, '%s_BQA_window.TIF' % scene, '%s_MTL.txt' % scene])
+        self.assertTrue(all(os.path.getsize(f) < 20000 for f in scenes[scene].files))
+
+    def test_download_window_max_workers(self):
+        scene = 'LC80010092015051LGN00'
+        l = Landsat8(download_dir=self.temp_folder, max_workers=4)
+        with mock.patch('sdownloader.cog.read_window') as read_window, \
+                mock.patch('sdownloader.download.S3DownloadMixin._fetch'):
+            l.download_window([scene], [4], window=(0, 0, 10, 10))
+
+        self.assertEqual(read_window.call_count, 2)
+        self.assertTrue(all(call[0][-1] == 4 for call in read_window.call_args_list))
+
+    def test_sentinel_jp2_not_supported(self):
+        s = Sentinel2(download_dir=self.temp_folder)
+        with mock.patch('sdownloader.cog.get_session') as session:
+            self.assertRaises(NotCloudOptimized, s.download_window, ['tiles/34/R/CS/2016/3/25/0'], [4],
+                              window=(0, 0, 10, 10))
+        self.assertFalse(session.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -42,6 +42,17 @@ class Tests(unittest.TestCase):
 
         self.assertTrue(common.fetch(url, self.temp_folder))
 
+    @mock.patch('sdownloader.common.download')
+    def test_fetch_unknown_size(self, mock_download):
+        """ Test a remote file without a Content-Length is downloaded, not taken as already on disk """
+
+        url = 'http://example.com/a/B4.TIF'
+        common.probe_cache.put(common.RemoteFile(url, 200, None, None, None))
+
+        common.fetch(url, self.temp_folder, segment_size=1000)
+
+        self.assertTrue(mock_download.called)
+
     def test_remote_file_size(self):
 
         url = common.google_storage_url_landsat8(common.landsat_scene_interpreter(self.scene))
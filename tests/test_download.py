@@ -0,0 +1,166 @@
+import io
+import os
+import json
+import errno
+import shutil
+import tarfile
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.download import Scene, Scenes, tar_index, tar_command
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.scene = 'LC80010092015051LGN00'
+        self.names = ['B%s.TIF' % b for b in range(1, 12)] + ['BQA.TIF', 'MTL.txt']
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def tarball(self, extension, mode, scene=None):
+        scene = scene or self.scene
+        path = os.path.join(self.temp_folder, scene + extension)
+        with tarfile.open(path, mode) as tar:
+            for name in self.names:
+                data = name.encode() * 100
+                info = tarfile.TarInfo('%s_%s' % (scene, name))
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return path
+
+    def extracted(self):
+        return sorted(os.listdir(os.path.join(self.temp_folder, self.scene)))
+
+    def test_unzip(self):
+        scene = Scene(self.scene, self.tarball('.tar.bz', 'w:bz2'))
+        scene.unzip()
+
+        self.assertFalse(scene.zipped)
+        self.assertEqual(len(self.extracted()), 13)
+        self.assertEqual(len(scene.band_files), 12)
+
+    def test_unzip_bands(self):
+        """ Test only the requested bands, MTL and QA are extracted """
+
+        scene = Scene(self.scene, self.tarball('.tar.bz', 'w:bz2'), bands=[4, 3, 2])
+        scene.unzip()
+
+        expected = ['%s_%s' % (self.scene, name) for name in ['B2.TIF', 'B3.TIF', 'B4.TIF', 'BQA.TIF', 'MTL.txt']]
+        self.assertEqual(self.extracted(), expected)
+        self.assertEqual(len(scene.band_files), 4)
+
+    def test_unzip_bands_indexed(self):
+        """ Test uncompressed tarballs are extracted through a member index """
+
+        path = self.tarball('.tar', 'w')
+        index = tar_index(path)
+        self.assertEqual(len(index), 13)
+        self.assertTrue(os.path.exists(path + '.index.json'))
+
+        scenes = Scenes([Scene(self.scene, path)])
+        scenes[0].unzip(bands=[5])
+
+        self.assertEqual(self.extracted(), ['%s_%s' % (self.scene, name) for name in ['B5.TIF', 'BQA.TIF', 'MTL.txt']])
+        with open(os.path.join(self.temp_folder, self.scene, '%s_B5.TIF' % self.scene), 'rb') as f:
+            self.assertEqual(f.read(), b'B5.TIF' * 100)
+
+
+    def test_scenes_unzip_workers(self):
+        """ Test unzipping scenes in worker processes updates the band files of each scene """
+
+        other = 'LC82050312015136LGN00'
+        scenes = Scenes([Scene(self.scene, self.tarball('.tar.bz', 'w:bz2'), bands=[4]),
+                         Scene(other, self.tarball('.tar.gz', 'w:gz', scene=other)),
+                         Scene('s3_scene', ['B4.TIF'])])
+        scenes.unzip(workers=2)
+
+        self.assertFalse(scenes[0].zipped or scenes[1].zipped)
+        self.assertEqual(len(scenes[0].band_files), 2)
+        self.assertEqual(len(scenes[1].band_files), 12)
+        self.assertEqual(scenes[2].band_files, ['B4.TIF'])
+
+    def test_scene_files(self):
+        """ Test files are stored once per folder and the public lists still work """
+
+        folder = os.path.join(self.temp_folder, self.scene)
+        files = [os.path.join(folder, '%s_%s' % (self.scene, name)) for name in ['B4.TIF', 'BQA.TIF', 'MTL.txt']]
+        scene = Scene(self.scene, [os.path.join(self.temp_folder, self.scene + '.tar.bz')] + files)
+
+        self.assertTrue(scene.zipped)
+        self.assertEqual(scene.files[1:], files)
+        self.assertEqual(scene.band_files, files)
+        self.assertIs(scene._folders[1], scene._folders[2])
+        self.assertFalse(hasattr(scene, '__dict__'))
+
+        scene.band_files = files[:1]
+        self.assertEqual(scene.files, [scene.zip_file, files[0]])
+
+    def test_scene_files_write_through(self):
+        """ Test the lists returned by files and band_files can still be changed in place """
+
+        folder = os.path.join(self.temp_folder, self.scene)
+        files = [os.path.join(folder, '%s_%s' % (self.scene, name)) for name in ['B4.TIF', 'BQA.TIF', 'MTL.txt']]
+        zip_file = os.path.join(self.temp_folder, self.scene + '.tar.bz')
+        scene = Scene(self.scene, [zip_file])
+
+        scene.band_files.extend(files[:2])
+        scene.files.append(files[2])
+        self.assertEqual(scene.files, [zip_file] + files)
+        self.assertEqual(scene.files_for_band(4), files[:1])
+
+        band_files = scene.band_files
+        band_files += files[:1]
+        del scene.band_files[0]
+        scene.files.remove(files[2])
+        self.assertEqual(scene.band_files, [files[1], files[0]])
+        self.assertTrue(scene.zipped)
+        self.assertEqual(json.loads(json.dumps(scene.files)), [zip_file, files[1], files[0]])
+
+    def test_files_for_band(self):
+        scenes = Scenes([Scene(self.scene, ['a/%s_B4.TIF' % self.scene, 'a/%s_BQA.TIF' % self.scene]),
+                         Scene('tiles/34/R/CS/2016/3/25/0', ['b/B04.jp2', 'b/B8A.jp2']),
+                         Scene('zipped', 'c/zipped.tar.bz')])
+
+        self.assertEqual(scenes.files_for_band(4), ['a/%s_B4.TIF' % self.scene, 'b/B04.jp2'])
+        self.assertEqual(scenes.files_for_band('quality'), [])
+        self.assertEqual(scenes.files_for_band('QA'), ['a/%s_BQA.TIF' % self.scene])
+        self.assertEqual(scenes.files_for_band('8a'), ['b/B8A.jp2'])
+
+        scenes[0].add('a/%s_B4.jp2' % self.scene)
+        self.assertEqual(len(scenes.files_for_band('B04')), 3)
+
+    def test_scenes_iter_and_merge(self):
+        scenes = Scenes([Scene('a'), Scene('b')])
+        scenes.merge(Scenes([Scene('c')]))
+
+        self.assertEqual([s.name for s in scenes], ['a', 'b', 'c'])
+        self.assertEqual(scenes.scenes, ['a', 'b', 'c'])
+        self.assertIn('c', scenes)
+        self.assertIs(scenes['c'], scenes[2])
+
+    def test_unzip_external(self):
+        scene = Scene(self.scene, self.tarball('.tar.gz', 'w:gz'), bands=[4])
+        scene.unzip(external=True)
+
+        self.assertEqual(len(self.extracted()), 3)
+
+    @mock.patch('sdownloader.download.shutil.which')
+    def test_tar_command(self, fake_which):
+        fake_which.side_effect = lambda program: '/usr/bin/pigz' if program == 'pigz' else None
+
+        self.assertEqual(tar_command('a.tar.gz', 'out'), ['tar', '-I', 'pigz', '-xf', 'a.tar.gz', '-C', 'out'])
+        self.assertEqual(tar_command('a.tar.bz', 'out', ['a_B4.TIF']),
+                         ['tar', '-xf', 'a.tar.bz', '-C', 'out', '--wildcards', '--no-anchored', 'a_B4.TIF'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import io
+import json
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import common, events, policy
+from sdownloader.landsat8 import Landsat8
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        policy.configure(backoff=0, retries=3)
+        self.events = []
+        events.subscribe(self.events.append)
+        self.scene = 'LC80010092015051LGN00'
+        self.prefix = '/L8/001/009/%s/%s' % (self.scene, self.scene)
+        self.files = dict(('%s_%s' % (self.prefix, f), f.encode() * 100) for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+
+    def tearDown(self):
+        events.unsubscribe(self.events.append)
+        policy.configure(backoff=0.5, retries=5)
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def named(self, name):
+        return [e for e in self.events if e['event'] == name]
+
+    def download(self, failures=None, **options):
+        with FakeServer(self.files, failures=failures) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, **options)
+                return l.download([self.scene], [4])
+
+    def test_download_events(self):
+        self.download()
+
+        requests = self.named('request')
+        self.assertEqual(sorted(e['method'] for e in requests), ['GET'] * 3 + ['HEAD'] * 3)
+        self.assertTrue(all(e['host'] == '127.0.0.1' and e['status'] == 200 and e['elapsed'] >= 0 for e in requests))
+
+        transfers = self.named('transfer')
+        self.assertEqual(sorted(e['bytes'] for e in transfers), [600, 700, 700])
+        self.assertTrue(all(e['engine'] == 'requests' for e in transfers))
+
+        scenes = self.named('scene')
+        self.assertEqual([(e['scene'], e['source'], e['files']) for e in scenes], [(self.scene, 's3', 3)])
+
+    def test_manifest_and_cache_events(self):
+        self.download()
+        del self.events[:]
+        self.download(revalidate='never')
+        self.assertEqual([e['source'] for e in self.named('scene')], ['manifest'])
+
+        common.probe_cache.clear()
+        del self.events[:]
+        self.download()
+        self.assertEqual(len(self.named('cache')), 3)
+        self.assertTrue(all(e['cache'] == 'local' and e['hit'] for e in self.named('cache')))
+
+    def test_retry_events(self):
+        self.download(failures={self.prefix + '_B4.TIF': [503, 429]})
+        retries = self.named('retry')
+        self.assertEqual([(e['attempt'], e['reason']) for e in retries], [(1, '503'), (2, '429')])
+
+    def test_failing_callback(self):
+        def fail(event):
+            raise ValueError('broken')
+
+        events.subscribe(fail)
+        try:
+            scenes = self.download()
+        finally:
+            events.unsubscribe(fail)
+        self.assertEqual(len(scenes[self.scene].files), 3)
+
+    def test_json_lines_exporter(self):
+        output = io.StringIO()
+        exporter = events.subscribe(events.JSONLinesExporter(output))
+        try:
+            self.download()
+        finally:
+            events.unsubscribe(exporter)
+
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(len(lines), len(self.events))
+        self.assertEqual(lines[-1]['event'], 'scene')
+
+    def test_prometheus_exporter(self):
+        exporter = events.subscribe(events.PrometheusExporter())
+        try:
+            self.download()
+        finally:
+            events.unsubscribe(exporter)
+
+        path = os.path.join(self.temp_folder, 'sdownloader.prom')
+        exporter.write(path)
+        with open(path) as f:
+            text = f.read()
+
+        self.assertIn('# TYPE sdownloader_requests_total counter', text)
+        self.assertIn('sdownloader_requests_total{host="127.0.0.1",method="HEAD",status="200"} 3.0', text)
+        self.assertIn('sdownloader_request_seconds_count{host="127.0.0.1",method="GET"} 3.0', text)
+        self.assertIn('sdownloader_transfer_bytes_total{host="127.0.0.1"} 2000.0', text)
+        self.assertIn('sdownloader_scenes_total{source="s3"} 1.0', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import io
+import os
+import time
+import tarfile
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import common, events, hedge
+from sdownloader.landsat8 import Landsat8
+from sdownloader.integrity import load_manifest
+from sdownloader.errors import RemoteFileDoesntExist
+
+
+def probe(seconds, error=None):
+    def run():
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        return seconds
+    return mock.Mock(side_effect=run)
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        hedge.reset()
+        hedge.configure(grace=0.2, interval=0.05)
+
+    def tearDown(self):
+        hedge.configure(grace=2.0, interval=0.25)
+        hedge.reset()
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_race_first_answer_wins(self):
+        source, result = hedge.race([('s3', probe(0.3)), ('google', probe(0.01))])
+        self.assertEqual((source, result), ('google', 0.01))
+        self.assertEqual(hedge.stats()['google']['wins'], 1)
+
+    def test_race_skips_failed_sources(self):
+        source, result = hedge.race([('s3', probe(0, RemoteFileDoesntExist())), ('google', probe(0.05))])
+        self.assertEqual(source, 'google')
+
+        with self.assertRaises(RemoteFileDoesntExist):
+            hedge.race([('s3', probe(0, RemoteFileDoesntExist())), ('google', probe(0, ValueError()))])
+
+    def test_race_head_start(self):
+        """ Test a source that is known to be faster is probed alone """
+
+        for i in range(3):
+            hedge.race([('s3', probe(0.01)), ('google', probe(0.1))])
+            time.sleep(0.1)
+
+        s3, google = probe(0.01), probe(0.1)
+        self.assertEqual(hedge.race([('google', google), ('s3', s3)])[0], 's3')
+        self.assertFalse(google.called)
+        self.assertLess(hedge.stats()['s3']['latency'], hedge.stats()['google']['latency'])
+
+    def test_hedged_download(self):
+        """ Test a stalled transfer gets a duplicate request that replaces it """
+
+        hedges = []
+        events.subscribe(hedges.append)
+        try:
+            with FakeServer({'/B4.TIF': b'4' * 1000}, delays={'/B4.TIF': [1]}) as server:
+                target = os.path.join(self.temp_folder, 'B4.TIF')
+                hedge.hedged_download(server.url + 'B4.TIF', target, threshold=1024 * 1024)
+        finally:
+            events.unsubscribe(hedges.append)
+
+        self.assertEqual([m for m, p, r in server.requests], ['GET', 'GET'])
+        self.assertEqual([e['attempt'] for e in hedges if e['event'] == 'hedge'], [1])
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'4' * 1000)
+        self.assertEqual(sorted(os.listdir(self.temp_folder)), ['B4.TIF', 'manifest.json'])
+        self.assertEqual(load_manifest(self.temp_folder)['files']['B4.TIF']['url'], server.url + 'B4.TIF')
+
+    def test_fast_transfer_is_not_hedged(self):
+        with FakeServer({'/B4.TIF': b'4' * 1000}) as server:
+            common.fetch(server.url + 'B4.TIF', self.temp_folder, hedge=1)
+
+        self.assertEqual([m for m, p, r in server.requests], ['GET'])
+        self.assertEqual(os.path.getsize(os.path.join(self.temp_folder, 'B4.TIF')), 1000)
+
+    def test_landsat_race(self):
+        """ Test a scene that is only on Google Storage is downloaded from there without probing S3 again """
+
+        scene = 'LC80010092015051LGN00'
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:bz2') as tar:
+            for name in ['B4.TIF', 'B5.TIF', 'BQA.TIF', 'MTL.txt']:
+                info = tarfile.TarInfo('%s_%s' % (scene, name))
+                info.size = 100
+                tar.addfile(info, io.BytesIO(b'x' * 100))
+        files = {'/L8/001/009/%s.tar.bz' % scene: buf.getvalue()}
+
+        with FakeServer(files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, race=True)
+                scenes = l.download([scene], [4])
+
+        # only the requested bands are kept, not the whole tarball
+        self.assertEqual(sorted(os.path.basename(f) for f in scenes[scene].files),
+                         ['%s_B4.TIF' % scene, '%s_BQA.TIF' % scene])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_folder, scene + '.tar.bz')))
+        stats = hedge.stats()
+        self.assertEqual((stats['google']['wins'], stats['google']['transfers']), (1, 1))
+        self.assertEqual(stats['s3']['wins'], 0)
+        self.assertEqual(len([p for m, p, r in server.requests if m == 'HEAD' and p.endswith('.tar.bz')]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
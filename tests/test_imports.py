@@ -0,0 +1,46 @@
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['requests', 'urllib3', 'usgs', 'homura', 'pycurl', 'aiohttp']
+
+
+def loaded(statement):
+    """ Returns the heavy modules loaded by a statement in a new interpreter """
+    code = '{0}\nimport sys, json\nprint(json.dumps([m for m in {1!r} if m in sys.modules]))'.format(
+        statement, HEAVY_MODULES)
+    return json.loads(subprocess.check_output([sys.executable, '-c', code], cwd=ROOT).decode())
+
+
+class Tests(unittest.TestCase):
+    """ Guards the startup time of short-lived workers, see benchmarks/import_time.py """
+
+    def test_package_import(self):
+        self.assertEqual(loaded('import sdownloader'), [])
+        self.assertEqual(loaded('from sdownloader.common import sentinel_scene_interpreter, landsat_scene_interpreter'),
+                         [])
+
+    def test_downloader_imports(self):
+        self.assertEqual(loaded('from sdownloader import Sentinel2'), [])
+        self.assertEqual(loaded('from sdownloader import Landsat8; import sdownloader.cli'), [])
+
+    def test_dependencies_on_first_use(self):
+        self.assertEqual(loaded('import sdownloader.landsat8 as l; l.api'), ['requests', 'urllib3', 'usgs'])
+        self.assertIn('requests', loaded('from sdownloader.common import get_remote_file\n'
+                                         'try:\n    get_remote_file("http://127.0.0.1:1/")\nexcept Exception:\n'
+                                         '    pass'))
+
+    def test_lazy_attributes(self):
+        import sdownloader
+        from sdownloader.landsat8 import Landsat8
+        self.assertIs(sdownloader.Landsat8, Landsat8)
+        self.assertIn('Sentinel2', dir(sdownloader))
+        self.assertRaises(AttributeError, getattr, sdownloader, 'Landsat7')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import base64
+import errno
+import shutil
+import hashlib
+import subprocess
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import common, integrity
+from sdownloader.landsat8 import Landsat8
+from sdownloader.errors import ChecksumMismatch
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        self.content = os.urandom(int(2.5 * integrity.MB))
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def multipart_etag(self, part_size):
+        parts = [self.content[i:i + part_size] for i in range(0, len(self.content), part_size)]
+        digest = hashlib.md5(b''.join(hashlib.md5(p).digest() for p in parts)).hexdigest()
+        return '"%s-%s"' % (digest, len(parts))
+
+    def test_multipart_etag(self):
+        """ Test a multipart ETag is rebuilt from chunks that don't line up with the parts """
+
+        checksum = integrity.Checksum(len(self.content), etag=self.multipart_etag(integrity.MB))
+        for i in range(0, len(self.content), 300000):
+            checksum.update(self.content[i:i + 300000])
+
+        self.assertEqual(checksum.part_sizes, [integrity.MB])
+        self.assertTrue(checksum.matches())
+        self.assertEqual(checksum.hexdigest(), hashlib.md5(self.content).hexdigest())
+
+    def test_multipart_part_sizes(self):
+        """ Test every whole number of MB giving the number of parts is a candidate """
+
+        MB = integrity.MB
+        self.assertEqual(integrity.multipart_part_sizes(100 * MB, 7), [15 * MB, 16 * MB])
+        self.assertEqual(integrity.multipart_part_sizes(3 * MB // 2, 3), [MB // 2])
+        self.assertEqual(integrity.multipart_part_sizes(1000 * MB, 2), [512 * MB])
+        self.assertEqual(integrity.multipart_part_sizes(10 * MB, 1), [10 * MB])
+
+    def test_multipart_etag_ambiguous_part_size(self):
+        """ Test a file uploaded with the larger of several possible part sizes matches """
+
+        self.content = os.urandom(integrity.MB * 5 // 2)
+        etag = self.multipart_etag(integrity.MB * 2)
+        checksum = integrity.Checksum(len(self.content), etag=etag)
+        checksum.update(self.content)
+        self.assertEqual(len(checksum.part_sizes), 1)
+
+        self.content = os.urandom(integrity.MB * 21 // 2)
+        checksum = integrity.Checksum(len(self.content), etag=self.multipart_etag(8 * integrity.MB))
+        checksum.update(self.content)
+        self.assertEqual([s // integrity.MB for s in checksum.part_sizes], [6, 7, 8, 9, 10])
+        self.assertTrue(checksum.matches())
+
+    def test_fetch_verify_multipart_unknown_part_size(self):
+        """ Test a file whose multipart ETag can't be rebuilt is kept """
+
+        headers = {'/B4.TIF': {'ETag': '"%s-3"' % hashlib.md5(b'other').hexdigest()}}
+
+        with FakeServer({'/B4.TIF': self.content}, headers=headers) as server:
+            path = common.fetch(server.url + 'B4.TIF', self.temp_folder, verify=True)
+
+        self.assertTrue(os.path.exists(path))
+        self.assertIsNone(integrity.load_manifest(self.temp_folder)['files']['B4.TIF']['verified'])
+
+    def test_manifest_written_once_per_scene(self):
+        """ Test the entries of the files are written with the scene instead of one by one """
+
+        paths = []
+        for name in ['B4.TIF', 'B3.TIF']:
+            paths.append(os.path.join(self.temp_folder, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(b'data')
+            integrity.record(paths[-1], 'http://localhost/' + name)
+
+        self.assertFalse(os.path.exists(os.path.join(self.temp_folder, integrity.MANIFEST)))
+        self.assertEqual(sorted(integrity.load_manifest(self.temp_folder)['files']), ['B3.TIF', 'B4.TIF'])
+
+        integrity.mark_complete(self.temp_folder, 'scene', 's3', paths)
+        with open(os.path.join(self.temp_folder, integrity.MANIFEST)) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['files']['B4.TIF']['url'], 'http://localhost/B4.TIF')
+        self.assertEqual(manifest['scenes']['scene']['files'], ['B4.TIF', 'B3.TIF'])
+
+    def test_manifest_shared_by_processes(self):
+        """ Test concurrent updates of several processes are all kept """
+
+        code = ('import sys\nfrom sdownloader import integrity\n'
+                'for i in range(20):\n'
+                '    integrity.update_manifest(sys.argv[1],\n'
+                '                              lambda m: m["files"].__setitem__(sys.argv[2] + str(i), {}))')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        processes = [subprocess.Popen([sys.executable, '-c', code, self.temp_folder, name], cwd=root)
+                     for name in 'abc']
+        for process in processes:
+            self.assertEqual(process.wait(), 0)
+
+        self.assertEqual(len(integrity.load_manifest(self.temp_folder)['files']), 60)
+
+    def test_google_md5_header(self):
+        md5 = base64.b64encode(hashlib.md5(b'data').digest()).decode()
+        checksum = integrity.Checksum.from_headers({'x-goog-hash': 'crc32c=n03x6A==,md5=%s' % md5, 'etag': 'CJiM'})
+        checksum.update(b'data')
+        self.assertTrue(checksum.matches())
+
+    def test_fetch_verify(self):
+        """ Test the checksum is computed while streaming and recorded in the manifest """
+
+        with FakeServer({'/B4.TIF': self.content}) as server:
+            path = common.fetch(server.url + 'B4.TIF', self.temp_folder, verify=True)
+
+        entry = integrity.load_manifest(self.temp_folder)['files']['B4.TIF']
+        self.assertEqual(entry['md5'], hashlib.md5(self.content).hexdigest())
+        self.assertTrue(entry['verified'])
+        self.assertTrue(os.path.exists(path))
+
+    def test_fetch_verify_multipart_segmented(self):
+        headers = {'/B4.TIF': {'ETag': self.multipart_etag(integrity.MB)}}
+
+        with FakeServer({'/B4.TIF': self.content}, headers=headers) as server:
+            common.fetch(server.url + 'B4.TIF', self.temp_folder, segment_size=integrity.MB, verify=True)
+
+        self.assertTrue(integrity.load_manifest(self.temp_folder)['files']['B4.TIF']['verified'])
+
+    def test_fetch_verify_mismatch(self):
+        """ Test a file that doesn't match its ETag is removed """
+
+        headers = {'/B4.TIF': {'ETag': '"%s"' % hashlib.md5(b'other').hexdigest()}}
+
+        with FakeServer({'/B4.TIF': self.content}, headers=headers) as server:
+            with self.assertRaises(ChecksumMismatch):
+                common.fetch(server.url + 'B4.TIF', self.temp_folder, verify=True)
+
+        self.assertFalse(os.path.exists(os.path.join(self.temp_folder, 'B4.TIF')))
+        self.assertFalse(integrity.load_manifest(self.temp_folder)['files']['B4.TIF']['verified'])
+
+    def test_revalidate(self):
+        """ Test re-validation detects a corrupted file with the right size """
+
+        files = {'/B4.TIF': self.content, '/B3.TIF': self.content[:1000], '/B2.TIF': b'2'}
+        with FakeServer(files) as server:
+            for name in ['B4.TIF', 'B3.TIF', 'B2.TIF']:
+                common.fetch(server.url + name, self.temp_folder, verify=True)
+
+        with open(os.path.join(self.temp_folder, 'B3.TIF'), 'r+b') as f:
+            f.write(b'x')
+        os.remove(os.path.join(self.temp_folder, 'B2.TIF'))
+
+        self.assertEqual(integrity.revalidate(self.temp_folder, workers=2),
+                         {'B4.TIF': True, 'B3.TIF': False, 'B2.TIF': None})
+
+    def landsat_files(self):
+        prefix = '/L8/001/009/LC80010092015051LGN00/LC80010092015051LGN00'
+        return {
+            prefix + '_B4.TIF': b'4' * 300,
+            prefix + '_BQA.TIF': b'Q' * 100,
+            prefix + '_MTL.txt': b'M' * 10,
+            '/L8/205/031/LC82050312014229LGN00.tar.bz': b'T' * 1000,
+        }
+
+    def test_complete_scene_skips_network(self):
+        """ Test a re-run returns the scenes completed by an earlier run without any request """
+
+        with FakeServer(self.landsat_files()) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, revalidate='never')
+                first = l.download(['LC80010092015051LGN00'], [4])
+                first.merge(l.download(['LC82050312014229LGN00']))
+
+                del server.requests[:]
+                second = l.download(['LC80010092015051LGN00'], [4])
+                second.merge(l.download(['LC82050312014229LGN00']))
+
+        self.assertEqual(server.requests, [])
+        self.assertEqual([s.files for s in first], [s.files for s in second])
+        self.assertTrue(second['LC82050312014229LGN00'].zipped)
+
+        manifest = integrity.load_manifest(os.path.join(self.temp_folder, 'LC80010092015051LGN00'))
+        self.assertEqual(manifest['scenes']['LC80010092015051LGN00']['source'], 's3')
+
+    def test_complete_scene_missing_file(self):
+        """ Test a scene with a file removed since the earlier run is fetched again """
+
+        with FakeServer(self.landsat_files()) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, revalidate='never')
+                scene = l.download(['LC80010092015051LGN00'], [4])[0]
+                os.remove(scene.files[0])
+
+                del server.requests[:]
+                l.download(['LC80010092015051LGN00'], [4])
+
+        self.assertTrue(os.path.exists(scene.files[0]))
+        self.assertIn('GET', [method for method, path, _ in server.requests])
+
+    def test_complete_scene_revalidate_etag(self):
+        """ Test revalidate='etag' only sends HEAD requests and fetches the files that changed """
+
+        files = self.landsat_files()
+        b4 = '/L8/001/009/LC80010092015051LGN00/LC80010092015051LGN00_B4.TIF'
+
+        with FakeServer(files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, revalidate='etag')
+                l.download(['LC80010092015051LGN00'], [4])
+
+                del server.requests[:]
+                l.download(['LC80010092015051LGN00'], [4])
+                self.assertEqual(set(method for method, path, _ in server.requests), set(['HEAD']))
+                self.assertEqual(len(server.requests), 3)
+
+                files[b4] = b'5' * 300
+                common.probe_cache.clear()
+                del server.requests[:]
+                scene = l.download(['LC80010092015051LGN00'], [4])[0]
+
+        self.assertIn(('GET', b4, None), server.requests)
+        with open(scene.files[0], 'rb') as f:
+            self.assertEqual(f.read(), b'5' * 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import os
+import time
 import errno
 import shutil
 import unittest
@@ -6,7 +7,8 @@ from tempfile import mkdtemp
 
 import mock
 
-from sdownloader.download import Scenes
+from sdownloader.download import Scene, Scenes
+from sdownloader.errors import DownloadError, RemoteFileDoesntExist
 from sdownloader.landsat8 import Landsat8
 
 
@@ -39,6 +41,66 @@ class Tests(unittest.TestCase):
         self.assertEqual(self.s3_scenes, results.scenes)
         self.assertEqual(len(results[self.s3_scenes[0]].files), 3)
 
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_s3_max_workers(self, fake_fetch, fake_exists):
+        """ Test downloading bands concurrently keeps the order of the input """
+
+        fake_exists.return_value = True
+        fake_fetch.side_effect = lambda url, path, **kwargs: os.path.join(path, url.split('/')[-1])
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=4)
+        results = l.s3(self.s3_scenes, [4, 3, 2])
+
+        self.assertEqual(self.s3_scenes, results.scenes)
+        self.assertEqual(fake_exists.call_count, 6)
+        for scene in self.s3_scenes:
+            self.assertEqual([os.path.basename(f) for f in results[scene].files],
+                             ['%s_B%s.TIF' % (scene, b) for b in [4, 3, 2]])
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_s3_failures_per_file(self, fake_fetch, fake_exists):
+        """ Test a failed band does not stop the rest of the batch """
+
+        def fetch(url, path, **kwargs):
+            if url.endswith('_B3.TIF'):
+                raise IOError('connection reset')
+            return url
+
+        fake_exists.return_value = True
+        fake_fetch.side_effect = fetch
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=4)
+        with self.assertRaises(DownloadError) as context:
+            l.s3(self.s3_scenes, [4, 3, 2])
+
+        self.assertEqual(fake_fetch.call_count, 6)
+        self.assertEqual(len(context.exception.failures), 2)
+        self.assertEqual(self.s3_scenes, context.exception.scenes.scenes)
+        self.assertEqual(len(context.exception.scenes[self.s3_scenes[0]].files), 2)
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_s3_missing_band_doesnt_stop_the_batch(self, fake_fetch, fake_exists):
+        """ Test a scene with a missing band is skipped and the other scenes are still downloaded """
+
+        def exists(url):
+            if self.s3_scenes[0] in url and url.endswith('_B3.TIF'):
+                raise RemoteFileDoesntExist(url)
+            return True
+
+        fake_exists.side_effect = exists
+        fake_fetch.side_effect = lambda url, path, **kwargs: url
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=4)
+        with self.assertRaises(RemoteFileDoesntExist) as context:
+            l.s3(self.s3_scenes, [4, 3, 2])
+
+        self.assertEqual(fake_fetch.call_count, 3)
+        self.assertEqual(len(context.exception.failures), 1)
+        self.assertEqual(context.exception.scenes.scenes, self.s3_scenes[1:])
+
     @mock.patch('sdownloader.download.fetch')
     def test_download_with_band_name(self, fake_fetch):
         """ Test downloading from S3 for a given sceneID with band names """
@@ -93,4 +155,74 @@ class Tests(unittest.TestCase):
         scenes = [self.all_scenes[-1]]
         l = Landsat8(download_dir=self.temp_folder)
         l.download(scenes, bands=[432])
-        fake_google.assert_called_with(scenes)
+        fake_google.assert_called_with(scenes, [432])
+
+    @mock.patch('sdownloader.landsat8.Landsat8.s3')
+    def test_iter_download_completion_order(self, fake_s3):
+        """ Test scenes are yielded as they complete and the input is consumed lazily """
+
+        delays = {self.all_scenes[0]: 0.3, self.all_scenes[1]: 0.0, self.all_scenes[2]: 0.1}
+        pulled = []
+
+        def s3(scenes, bands):
+            time.sleep(delays[scenes[0]])
+            return Scenes([Scene(scenes[0], ['%s_B4.TIF' % scenes[0]])])
+
+        def scene_ids():
+            for scene in self.all_scenes[:3]:
+                pulled.append(scene)
+                yield scene
+
+        fake_s3.side_effect = s3
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=3)
+        results = l.iter_download(scene_ids(), [4])
+        self.assertEqual(pulled, [])
+
+        names = [scene.name for scene in results]
+        self.assertEqual(names, [self.all_scenes[1], self.all_scenes[2], self.all_scenes[0]])
+
+    @mock.patch('sdownloader.landsat8.Landsat8.s3')
+    def test_iter_download_bounded(self, fake_s3):
+        """ Test no more than max_in_flight scenes are downloading at once """
+
+        running = []
+        peak = []
+
+        def s3(scenes, bands):
+            running.append(scenes[0])
+            peak.append(len(running))
+            time.sleep(0.02)
+            running.remove(scenes[0])
+            return Scenes([Scene(scenes[0])])
+
+        fake_s3.side_effect = s3
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=4)
+        scenes = ('LC8%03d0092015051LGN00' % i for i in range(20))
+        self.assertEqual(len(list(l.iter_download(scenes, [4], max_in_flight=2))), 20)
+        self.assertLessEqual(max(peak), 2)
+
+    @mock.patch('sdownloader.landsat8.Landsat8.s3')
+    def test_iter_download_failures(self, fake_s3):
+        """ Test a failed scene is raised after the other scenes are yielded """
+
+        def s3(scenes, bands):
+            if scenes[0] == self.s3_scenes[0]:
+                raise IOError('connection reset')
+            return Scenes([Scene(scenes[0])])
+
+        fake_s3.side_effect = s3
+
+        l = Landsat8(download_dir=self.temp_folder)
+        yielded = []
+        with self.assertRaises(DownloadError) as context:
+            for scene in l.iter_download(self.s3_scenes, [4]):
+                yielded.append(scene.name)
+
+        self.assertEqual(yielded, self.s3_scenes[1:])
+        self.assertEqual(list(context.exception.failures), self.s3_scenes[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import common
+from sdownloader.landsat8 import Landsat8
+from sdownloader.sentinel2 import Sentinel2
+from sdownloader.errors import RemoteFileDoesntExist
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        self.s3_scene = 'LC80010092015051LGN00'
+        self.google_scene = 'LC82050312014229LGN00'
+        self.missing_scene = 'LC82050312015136LGN00'
+
+        prefix = '/L8/001/009/%s/%s' % (self.s3_scene, self.s3_scene)
+        self.files = {
+            prefix + '_B4.TIF': b'4' * 300,
+            prefix + '_BQA.TIF': b'Q' * 100,
+            prefix + '_MTL.txt': b'M' * 10,
+            '/L8/205/031/%s.tar.bz' % self.google_scene: b'T' * 1000,
+        }
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_plan_and_execute(self):
+        """ Test the sources of all scenes are resolved before anything is downloaded """
+
+        scenes = [self.google_scene, self.s3_scene, self.missing_scene]
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, max_workers=4)
+                plan = l.plan(scenes, [4])
+
+                self.assertFalse([r for r in server.requests if r[0] == 'GET'])
+                self.assertEqual(plan.scenes, [self.google_scene, self.s3_scene])
+                self.assertEqual(plan[self.s3_scene].source, 's3')
+                self.assertEqual(plan[self.google_scene].source, 'google')
+                self.assertEqual(plan.total_bytes, 1410)
+                self.assertEqual(plan.by_source(), {'s3': {'scenes': 1, 'bytes': 410},
+                                                    'google': {'scenes': 1, 'bytes': 1000}})
+                self.assertEqual([size for item, url, size in plan.files()], [1000, 300, 100, 10])
+                self.assertTrue(isinstance(plan.unresolved[self.missing_scene], RemoteFileDoesntExist))
+
+                results = l.execute(plan)
+
+        self.assertEqual(results.scenes, [self.google_scene, self.s3_scene])
+        self.assertTrue(results[self.google_scene].zipped)
+        self.assertEqual([os.path.getsize(f) for f in results[self.s3_scene].files], [300, 100, 10])
+
+    def test_sentinel2_plan(self):
+        files = {'/tiles/34/R/CS/2016/3/25/0/B04.jp2': b'4' * 10}
+
+        with FakeServer(files) as server:
+            with mock.patch('sdownloader.common.S3_SENTINEL', server.url):
+                plan = Sentinel2(download_dir=self.temp_folder).plan(['tiles/34/R/CS/2016/3/25/0'], ['red'])
+
+        self.assertEqual(plan.to_dict()['total_bytes'], 10)
+        self.assertEqual(plan[0].folder, os.path.join(self.temp_folder, 'tiles_34_R_CS_2016_3_25_0'))
+
+    def test_sentinel2_plan_list(self):
+        """ Test probe='list' plans a tile with a single listing of its folder """
+
+        files = {
+            '/tiles/34/R/CS/2016/3/25/0/B04.jp2': b'4' * 10,
+            '/tiles/34/R/CS/2016/3/25/0/B08.jp2': b'8' * 20,
+            '/tiles/34/R/CS/2016/3/25/0/qi/MSK.gml': b'q',
+        }
+
+        with FakeServer(files) as server:
+            with mock.patch('sdownloader.common.S3_SENTINEL', server.url):
+                s2 = Sentinel2(download_dir=self.temp_folder, probe='list')
+                plan = s2.plan(['tiles/34/R/CS/2016/3/25/0', 'tiles/34/R/CS/2016/3/26/0'], ['red', 'nir'])
+
+        self.assertEqual(plan.total_bytes, 30)
+        self.assertEqual(list(plan.unresolved), ['tiles/34/R/CS/2016/3/26/0'])
+        self.assertEqual([method for method, path, r in server.requests], ['GET', 'GET'])
+
+
+if __name__ == '__main__':
+    unittest.main()
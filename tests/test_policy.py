@@ -0,0 +1,128 @@
+import os
+import time
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import common, policy
+from sdownloader.landsat8 import Landsat8
+from sdownloader.errors import TransientError, RemoteFileDoesntExist, DownloadError
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        policy.configure(backoff=0, retries=3)
+        self.scene = 'LC80010092015051LGN00'
+        self.prefix = '/L8/001/009/%s/%s' % (self.scene, self.scene)
+        self.files = dict(('%s_%s' % (self.prefix, f), f.encode() * 100) for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+
+    def tearDown(self):
+        policy.configure(backoff=0.5, retries=5)
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_token_bucket(self):
+        bucket = policy.TokenBucket(rate=50, burst=1)
+        start = time.time()
+        for i in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_aimd_limiter(self):
+        """ Test the concurrency is halved on failures and grows back one slot per window """
+
+        limiter = policy.AIMDLimiter(8)
+        limiter.failure()
+        limiter.failure()
+        self.assertEqual(limiter.limit, 2)
+
+        for i in range(2):
+            limiter.success()
+        self.assertEqual(limiter.limit, 3)
+
+        for i in range(100):
+            limiter.success()
+        self.assertEqual(limiter.limit, 8)
+
+    def test_check_status(self):
+        self.assertRaises(TransientError, policy.check_status, 'url', 503)
+        self.assertRaises(TransientError, policy.check_status, 'url', 429)
+        self.assertRaises(RemoteFileDoesntExist, policy.check_status, 'url', 404)
+
+    def test_retry_throttled_requests(self):
+        """ Test 503 and 429 responses are retried and lower the concurrency of the host """
+
+        failures = {'/a/B4.TIF': [503, 429]}
+        with FakeServer({'/a/B4.TIF': b'4' * 1000}, failures=failures) as server:
+            path = common.fetch(server.url + 'a/B4.TIF', self.temp_folder)
+            stats = policy.stats()['127.0.0.1']
+
+        self.assertEqual(os.path.getsize(path), 1000)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['throttled'], 1)
+        self.assertLess(stats['concurrency'], 32)
+
+    def test_persistent_failure_is_retried_once_per_attempt(self):
+        """ Test a host that keeps failing gets retries + 1 requests, not a retry loop around the retries """
+
+        with FakeServer({'/a/B4.TIF': b'4' * 1000}, failures={'/a/B4.TIF': [503] * 100}) as server:
+            self.assertRaises(TransientError, common.fetch, server.url + 'a/B4.TIF', self.temp_folder, probe=False)
+
+        self.assertEqual(len([m for m, p, r in server.requests if m == 'GET']), 4)
+
+    def test_interrupted_body_resumes(self):
+        """ Test a response that breaks off is continued from the bytes on disk """
+
+        mb = 1024 * 1024
+        content = bytes(bytearray(range(256))) * (3 * mb // 256)
+        with FakeServer({'/a/B4.TIF': content}, truncations={'/a/B4.TIF': [mb + 100, mb + 100]}) as server:
+            path = common.fetch(server.url + 'a/B4.TIF', self.temp_folder, probe=False)
+            stats = policy.stats()['127.0.0.1']
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual([r for m, p, r in server.requests], [None, 'bytes=%s-' % mb, 'bytes=%s-' % (2 * mb)])
+        self.assertEqual(stats['retries'], 2)
+
+    def test_transient_errors_dont_fall_back(self):
+        """ Test a host that keeps failing raises instead of falling back to Google Storage """
+
+        failures = {self.prefix + '_B4.TIF': [503] * 10}
+        with FakeServer(self.files, failures=failures) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder)
+                with self.assertRaises(DownloadError) as context:
+                    l.download([self.scene], [4])
+
+        failure = list(context.exception.failures.values())[0]
+        self.assertIsInstance(failure, TransientError)
+        self.assertFalse([p for m, p, r in server.requests if p.endswith('.tar.bz')])
+
+    def test_missing_file_is_not_retried(self):
+        with FakeServer() as server:
+            with self.assertRaises(RemoteFileDoesntExist):
+                common.remote_file_exists(server.url + 'missing.TIF')
+
+        self.assertEqual(len(server.requests), 1)
+
+    def test_host_overrides(self):
+        policy.configure('example.com', rate=1, max_concurrency=2)
+        host = policy.for_url('http://example.com:8080/a/B4.TIF')
+        self.assertEqual(host.bucket.rate, 1)
+        self.assertEqual(host.limiter.maximum, 2)
+        self.assertEqual(policy.for_url('http://storage.googleapis.com/x').bucket.rate, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
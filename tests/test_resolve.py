@@ -0,0 +1,56 @@
+import unittest
+
+from sdownloader import common, resolve
+from sdownloader.errors import IncorrectLandsat8SceneId, IncorrectSentine2SceneId
+
+
+class Tests(unittest.TestCase):
+
+    def test_landsat8_matches_per_scene_functions(self):
+        scenes = ['LC80030172015001LGN00', 'LC80010092015051LGN00']
+        bands = [4, 3, 'QA', 'MTL']
+
+        resolved, errors = resolve.landsat8(iter(scenes), bands)
+
+        self.assertEqual(errors, {})
+        self.assertEqual([r.scene for r in resolved], scenes)
+        for record in resolved:
+            sat = common.landsat_scene_interpreter(record.scene)
+            self.assertEqual(list(record.s3), [common.amazon_s3_url_landsat8(sat, band) for band in bands])
+            self.assertEqual(record.google, common.google_storage_url_landsat8(sat))
+            self.assertEqual(record.path, 'L8/%s/%s' % (sat['path'], sat['row']))
+
+    def test_landsat8_errors_per_scene(self):
+        resolved, errors = resolve.landsat8(['LC80030172015001LGN', 'LC80030172015001LGN00', None], [4])
+
+        self.assertEqual([r.scene for r in resolved], ['LC80030172015001LGN00'])
+        self.assertEqual(list(errors), ['LC80030172015001LGN', None])
+        self.assertIsInstance(errors[None], IncorrectLandsat8SceneId)
+
+    def test_sentinel2_matches_per_scene_functions(self):
+        scenes = ['S2A_OPER_MSI_L1C_TL_SGS__20160325T150955_A003951_T34RCS_N02.01', 'S2A_tile_20160526_1VCH_0',
+                  'tiles/34/R/CS/2016/3/25/0']
+
+        resolved, errors = resolve.sentinel2(scenes, [4, 11])
+
+        self.assertEqual(errors, {})
+        for record in resolved:
+            path = common.sentinel_scene_interpreter(record.scene)
+            self.assertEqual(record.path, path)
+            self.assertEqual(list(record.s3), [common.amazon_s3_url_sentinel2(path, band) for band in [4, 11]])
+            self.assertIsNone(record.google)
+
+    def test_sentinel2_errors_per_scene(self):
+        scenes = ['S2A_OPER_MSI_L1C_TL_SGS__20160325T150955_A003951_T34RCS_N02.what', 'S2A_tile_20161326_1VCH_0',
+                  'S2A_tile', 'S2A_tile_20160526_1VCH_0']
+
+        resolved, errors = resolve.sentinel2(scenes, [4])
+
+        self.assertEqual(len(resolved), 1)
+        self.assertEqual(list(errors), scenes[:3])
+        for e in errors.values():
+            self.assertIsInstance(e, IncorrectSentine2SceneId)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from sdownloader import common, session, errors
+from sdownloader.landsat8 import Landsat8
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        session.configure()
+        session.reset_stats()
+        common.probe_cache.clear()
+        self.scene = 'LC80010092015051LGN00'
+        prefix = '/L8/001/009/%s/%s' % (self.scene, self.scene)
+        self.files = dict(('%s_%s' % (prefix, f), f.encode() * 100) for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_connections_are_reused(self):
+        """ Test probes and the download share one keep-alive connection """
+
+        files = {'/a/B4.TIF': b'4' * 1000}
+
+        with FakeServer(files) as server:
+            url = server.url + 'a/B4.TIF'
+            self.assertTrue(common.remote_file_exists(url))
+            self.assertEqual(common.get_remote_file_size(url), 1000)
+            path = common.fetch(url, self.temp_folder)
+
+        self.assertEqual(os.path.getsize(path), 1000)
+        self.assertEqual(session.stats(), {'opened': 1, 'reused': 1, 'requests': 2})
+
+    def test_download_missing_file(self):
+        with FakeServer() as server:
+            with self.assertRaises(errors.RemoteFileDoesntExist):
+                common.download(server.url + 'missing.TIF', self.temp_folder)
+
+    def count(self, server):
+        methods = [method for method, path, r in server.requests]
+        del server.requests[:]
+        return methods.count('HEAD'), methods.count('GET')
+
+    def test_one_round_trip_per_file(self):
+        """ Test the existence check and the size check in fetch share one HEAD """
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder)
+                l.download([self.scene], [4])
+                self.assertEqual(self.count(server), (3, 3))
+
+                # files are on disk, only the probes are sent
+                l.download([self.scene], [4])
+                self.assertEqual(self.count(server), (3, 0))
+
+    def test_skip_probes(self):
+        """ Test probe=None only sends GET requests """
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, probe=None)
+                results = l.download([self.scene], [4])
+                self.assertEqual(self.count(server), (0, 3))
+
+                # the size of the existing files is taken from the GET headers
+                l.download([self.scene], [4])
+                self.assertEqual(self.count(server), (0, 3))
+
+        self.assertEqual(os.path.getsize(results[self.scene].files[0]), 600)
+
+    def test_skip_probes_falls_back_to_google(self):
+        """ Test a missing band still triggers the google fallback without probes """
+
+        self.files['/L8/001/009/%s.tar.bz' % self.scene] = b'tar'
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, probe=None)
+                results = l.download([self.scene], [5])
+
+        self.assertTrue(results[self.scene].zipped)
+
+    def test_list_probe(self):
+        """ Test probe='list' resolves all bands of a scene with one ListObjects request """
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                l = Landsat8(download_dir=self.temp_folder, probe='list')
+                l.download([self.scene], [4])
+                self.assertEqual(self.count(server), (0, 4))
+
+                # the sizes of the files on disk are checked against the listing
+                l.download([self.scene], [4])
+                self.assertEqual(self.count(server), (0, 1))
+
+    def test_list_probe_falls_back_to_google(self):
+        """ Test a band missing from the listing triggers the google fallback """
+
+        self.files['/L8/001/009/%s.tar.bz' % self.scene] = b'tar'
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, probe='list')
+                results = l.download([self.scene], [5])
+
+        self.assertTrue(results[self.scene].zipped)
+        self.assertFalse([path for method, path, r in server.requests if path.endswith('_B5.TIF')])
+
+    def test_list_prefix_pages(self):
+        """ Test truncated listings are followed with continuation tokens """
+
+        with FakeServer(self.files) as server:
+            server.page_size = 2
+            prefix = server.url + 'L8/001/009/%s/' % self.scene
+            found = common.list_prefix(prefix)
+
+        self.assertEqual(len(found), 3)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(found[prefix + self.scene + '_B4.TIF'].size, 600)
+        self.assertEqual(common.probe_cache.get(prefix + self.scene + '_MTL.txt').status, 200)
+
+    def test_configure(self):
+        first = session.get_session()
+        session.configure(pool_maxsize=64)
+        self.assertIsNot(first, session.get_session())
+
+        with self.assertRaises(ValueError):
+            session.configure(unknown=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
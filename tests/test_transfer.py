@@ -0,0 +1,215 @@
+import io
+import os
+import json
+import errno
+import tarfile
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from fake_server import FakeServer
+from sdownloader import common, transfer
+from sdownloader.landsat8 import Landsat8
+
+import mock
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.content = os.urandom(10000)
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_byte_ranges(self):
+        self.assertEqual(transfer.byte_ranges(10, 4), [(0, 3), (4, 7), (8, 9)])
+        self.assertEqual(transfer.byte_ranges(8, 4), [(0, 3), (4, 7)])
+
+    def test_segmented_fetch(self):
+        """ Test a large file is fetched in parallel byte ranges """
+
+        with FakeServer({'/scene.tar.bz': self.content}) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder, segment_size=3000, segments=3)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+        ranges = sorted(r for method, p, r in server.requests if method == 'GET')
+        self.assertEqual(ranges, ['bytes=0-2999', 'bytes=3000-5999', 'bytes=6000-8999', 'bytes=9000-9999'])
+
+    def test_segmented_fetch_without_range_support(self):
+        """ Test falling back to a single stream when the server ignores Range """
+
+        with FakeServer({'/scene.tar.bz': self.content}, ranges=False) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder, segment_size=3000)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def write_partial(self, ranges, etag=None):
+        part = os.path.join(self.temp_folder, 'scene.tar.bz.part')
+        with open(part, 'wb') as f:
+            f.truncate(len(self.content))
+            for start, end in ranges:
+                f.seek(start)
+                f.write(self.content[start:end + 1])
+        with open(part + '.json', 'w') as f:
+            json.dump({'size': len(self.content), 'etag': etag, 'ranges': ranges}, f)
+        return part
+
+    def test_resume_stream(self):
+        """ Test an interrupted download continues from the journal """
+
+        part = self.write_partial([[0, 3999]])
+
+        with FakeServer({'/scene.tar.bz': self.content}) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder, resume=True)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual([r for m, p, r in server.requests], ['bytes=4000-'])
+        self.assertFalse(os.path.exists(part))
+        self.assertFalse(os.path.exists(part + '.json'))
+
+    def test_resume_complete_stream(self):
+        """ Test a partial file that is already complete is moved into place without a request """
+
+        part = self.write_partial([[0, len(self.content) - 1]])
+
+        with FakeServer({'/scene.tar.bz': self.content}) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder, resume=True)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(server.requests, [])
+        self.assertFalse(os.path.exists(part + '.json'))
+
+    def test_resume_unsatisfiable_range(self):
+        """ Test a 416 for the resumed range restarts the download instead of reporting a missing file """
+
+        self.write_partial([[0, 3999]])
+
+        with FakeServer({'/scene.tar.bz': self.content}, failures={'/scene.tar.bz': [416]}) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder, resume=True)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual([r for m, p, r in server.requests], ['bytes=4000-', None])
+
+    def test_resume_changed_file(self):
+        """ Test the ETag of the journal is sent in If-Range and a changed file is downloaded again """
+
+        self.write_partial([[0, 3999]], etag='"stale"')
+
+        with FakeServer({'/scene.tar.bz': self.content}) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder, resume=True)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual([r for m, p, r in server.requests], ['bytes=4000-'])
+
+    def test_resume_segmented(self):
+        """ Test only the ranges missing from the journal are fetched """
+
+        self.write_partial([[0, 2999], [6000, 8999]])
+
+        with FakeServer({'/scene.tar.bz': self.content}) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder, segment_size=3000, resume=True)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        ranges = sorted(r for method, p, r in server.requests if method == 'GET')
+        self.assertEqual(ranges, ['bytes=3000-5999', 'bytes=9000-9999'])
+
+    def test_partial_ignored_without_resume(self):
+        self.write_partial([[0, 3999]])
+
+        with FakeServer({'/scene.tar.bz': self.content}) as server:
+            path = common.fetch(server.url + 'scene.tar.bz', self.temp_folder)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual([r for m, p, r in server.requests], [None])
+
+    def test_journal_missing(self):
+        journal = transfer.Journal('file.part', 100)
+        journal.ranges = [(0, 9), (20, 29)]
+        self.assertEqual(journal.missing(), [(10, 19), (30, 99)])
+        self.assertEqual(journal.offset, 10)
+
+    def test_google_segmented(self):
+        """ Test Landsat8 passes its segment options to the google fetch """
+
+        scene = 'LC80010092015051LGN00'
+        with FakeServer({'/L8/001/009/%s.tar.bz' % scene: self.content}) as server:
+            with mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, segment_size=4096, segments=2)
+                results = l.google([scene])
+
+        self.assertEqual(os.path.getsize(results[scene].zip_file), len(self.content))
+        self.assertEqual(len([r for method, p, r in server.requests if method == 'GET']), 3)
+
+
+    def tarball(self, scene, names, mode='w:bz2'):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode=mode) as tar:
+            for name in names:
+                data = name.encode() * 100
+                info = tarfile.TarInfo('%s_%s' % (scene, name))
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return buf.getvalue()
+
+    def test_google_stream_extract(self):
+        """ Test the images are extracted while the tarball downloads and the tarball isn't stored """
+
+        scene = 'LC80010092015051LGN00'
+        tarball = self.tarball(scene, ['B4.TIF', 'B3.TIF', 'MTL.txt'])
+
+        with FakeServer({'/L8/001/009/%s.tar.bz' % scene: tarball}) as server:
+            with mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, stream_extract=True)
+                results = l.google([scene])
+
+        folder = os.path.join(self.temp_folder, scene)
+        self.assertFalse(results[scene].zipped)
+        self.assertEqual(results[scene].band_files, [os.path.join(folder, '%s_B4.TIF' % scene),
+                                                     os.path.join(folder, '%s_B3.TIF' % scene)])
+        self.assertTrue(os.path.exists(os.path.join(folder, '%s_MTL.txt' % scene)))
+        self.assertEqual(sorted(os.listdir(self.temp_folder)), [scene])
+
+    def test_stream_extract_bands(self):
+        """ Test only the requested bands are extracted from a streamed tarball """
+
+        scene = 'LC80010092015051LGN00'
+        tarball = self.tarball(scene, ['B4.TIF', 'B3.TIF', 'BQA.TIF', 'MTL.txt'])
+
+        with FakeServer({'/L8/001/009/%s.tar.bz' % scene: tarball}) as server:
+            with mock.patch('sdownloader.common.GOOGLE', server.url):
+                l = Landsat8(download_dir=self.temp_folder, stream_extract=True)
+                results = l.google([scene], [4])
+
+        self.assertEqual([os.path.basename(f) for f in results[scene].band_files],
+                         ['%s_B4.TIF' % scene, '%s_BQA.TIF' % scene])
+        self.assertEqual(results[scene].bands, [4])
+
+    def test_stream_extract_keep_archive(self):
+        tarball = self.tarball('scene', ['B4.TIF'], mode='w:gz')
+        archive = os.path.join(self.temp_folder, 'scene.tar.gz')
+
+        with FakeServer({'/scene.tar.gz': tarball}) as server:
+            files = transfer.stream_extract(server.url + 'scene.tar.gz', self.temp_folder, archive)
+
+        self.assertEqual(files, [os.path.join(self.temp_folder, 'scene_B4.TIF')])
+        with open(archive, 'rb') as f:
+            self.assertEqual(f.read(), tarball)
+
+
+if __name__ == '__main__':
+    unittest.main()
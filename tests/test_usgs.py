@@ -0,0 +1,134 @@
+import os
+import errno
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_server import FakeServer
+from usgs_stub import USGSStub
+from sdownloader import common
+from sdownloader.landsat8 import Landsat8, match_download_urls
+from sdownloader.errors import RemoteFileDoesntExist
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        self.scenes = ['LC80010092015051LGN00', 'LC82050312015136LGN00', 'LC80030172015001LGN00']
+        self.files = dict(('/dl/%s.tar.gz' % scene, scene.encode() * 10) for scene in self.scenes)
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def usgs(self, server):
+        return USGSStub(dict((scene, '%sdl/%s.tar.gz' % (server.url, scene)) for scene in self.scenes))
+
+    def landsat(self, **options):
+        return Landsat8(download_dir=self.temp_folder, usgs_user='user', usgs_pass='pass', **options)
+
+    def test_batched_download_urls(self):
+        """ Test the urls of all scenes are requested in batches with a single login """
+
+        with FakeServer(self.files) as server:
+            stub = self.usgs(server)
+            with mock.patch('sdownloader.landsat8.api', stub):
+                l = self.landsat(usgs_batch_size=2, max_workers=3)
+                scenes = l.usgs(self.scenes)
+                l.usgs(self.scenes[:1], ['4'])
+
+        self.assertEqual(stub.keys, ['key-1'])
+        self.assertEqual(stub.calls, [self.scenes[:2], self.scenes[2:], self.scenes[:1]])
+        self.assertEqual(scenes.scenes, self.scenes)
+        for scene in self.scenes:
+            self.assertEqual(scenes[scene].zip_file, os.path.join(self.temp_folder, scene + '.tar.gz'))
+
+    def test_expired_key_is_renewed(self):
+        with FakeServer(self.files) as server:
+            stub = self.usgs(server)
+            with mock.patch('sdownloader.landsat8.api', stub):
+                l = self.landsat()
+                l.usgs(self.scenes[:1])
+                stub.expire()
+                l.usgs(self.scenes[1:])
+
+                # keys older than usgs_key_ttl are renewed before they are used
+                l._usgs_key_time -= l.usgs_key_ttl + 1
+                l.usgs(self.scenes[:1])
+
+        self.assertEqual(stub.keys, ['key-1', 'key-2', 'key-3'])
+        self.assertEqual(stub.calls, [self.scenes[:1], self.scenes[1:], self.scenes[:1]])
+
+    def test_download_falls_back_to_usgs_in_one_batch(self):
+        """ Test the scenes that are not on Google Storage are resolved on USGS together """
+
+        with FakeServer(self.files) as server:
+            stub = self.usgs(server)
+            with mock.patch('sdownloader.landsat8.api', stub), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                scenes = self.landsat().download(self.scenes)
+
+        self.assertEqual(stub.keys, ['key-1'])
+        self.assertEqual(stub.calls, [self.scenes])
+        self.assertEqual(scenes.scenes, self.scenes)
+
+    def test_download_skips_repeated_scenes(self):
+        with FakeServer(self.files) as server:
+            stub = self.usgs(server)
+            with mock.patch('sdownloader.landsat8.api', stub), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                scenes = self.landsat().download(self.scenes + self.scenes[:1])
+
+        self.assertEqual(stub.calls, [self.scenes])
+        self.assertEqual(scenes.scenes, self.scenes)
+
+    def test_iter_download_batches_usgs(self):
+        """ Test iter_download looks the scenes up on USGS in batches, not one request per scene """
+
+        with FakeServer(self.files) as server:
+            stub = self.usgs(server)
+            del stub.scenes[self.scenes[1]]
+            with mock.patch('sdownloader.landsat8.api', stub), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                failed = []
+                l = self.landsat(usgs_batch_size=2)
+                scenes = list(l.iter_download(self.scenes + self.scenes[:1], on_error=lambda s, e: failed.append(s)))
+
+        self.assertEqual(stub.calls, [self.scenes[:2], self.scenes[2:]])
+        self.assertEqual(sorted(s.name for s in scenes), sorted([self.scenes[0], self.scenes[2]]))
+        self.assertEqual(failed, [self.scenes[1]])
+
+    def test_missing_scene(self):
+        with FakeServer(self.files) as server:
+            stub = self.usgs(server)
+            del stub.scenes[self.scenes[1]]
+            with mock.patch('sdownloader.landsat8.api', stub):
+                with self.assertRaises(RemoteFileDoesntExist):
+                    self.landsat().usgs(self.scenes)
+
+            with mock.patch('sdownloader.landsat8.api', stub), \
+                    mock.patch('sdownloader.common.GOOGLE', server.url):
+                plan = self.landsat().plan(self.scenes)
+
+        self.assertEqual([item.scene for item in plan], [self.scenes[0], self.scenes[2]])
+        self.assertEqual(list(plan.unresolved), [self.scenes[1]])
+
+    def test_match_download_urls(self):
+        scenes = ['LC80010092015051LGN00', 'LC82050312015136LGN00']
+        self.assertEqual(match_download_urls(scenes, ['http://a/LC82050312015136LGN00.tar.gz']),
+                         {'LC82050312015136LGN00': 'http://a/LC82050312015136LGN00.tar.gz'})
+        self.assertEqual(match_download_urls(scenes, ['http://a/1', 'http://a/2']),
+                         {'LC80010092015051LGN00': 'http://a/1', 'LC82050312015136LGN00': 'http://a/2'})
+        self.assertEqual(match_download_urls(scenes, [{'entityId': 'LC80010092015051LGN00', 'url': 'http://a/1'}]),
+                         {'LC80010092015051LGN00': 'http://a/1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
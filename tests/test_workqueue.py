@@ -0,0 +1,167 @@
+import os
+import time
+import errno
+import shutil
+import threading
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from fake_redis import FakeRedis
+from fake_server import FakeServer
+from sdownloader import common, workqueue
+from sdownloader.landsat8 import Landsat8
+from sdownloader.plan import DownloadPlan, PlanItem
+from sdownloader.integrity import load_manifest
+
+
+class QueueTests(object):
+    """ Tests run against every queue backend """
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        common.probe_cache.clear()
+        self.scene = 'LC80010092015051LGN00'
+        self.prefix = '/L8/001/009/%s/%s' % (self.scene, self.scene)
+        self.files = dict(('%s_%s' % (self.prefix, f), f.encode() * 100) for f in ['B4.TIF', 'BQA.TIF', 'MTL.txt'])
+        self.queue = self.make_queue()
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def plan(self, url):
+        folder = os.path.join(self.temp_folder, self.scene)
+        urls = [url.rstrip('/') + path for path in sorted(self.files)]
+        return DownloadPlan([PlanItem(self.scene, 's3', folder, urls, [100, 700, 600])])
+
+    def test_put_skips_queued_tasks(self):
+        plan = self.plan('http://localhost/')
+        self.assertEqual(workqueue.enqueue(self.queue, plan), 3)
+        self.assertEqual(workqueue.enqueue(self.queue, plan), 0)
+        self.assertEqual(self.queue.counts(), {'pending': 3, 'leased': 0, 'done': 0, 'failed': 0})
+
+        task = self.queue.claim('a')
+        self.assertEqual(task.id, '%s/%s_B4.TIF' % (self.scene, self.scene))
+        self.assertEqual((task.attempts, task.worker, task.size), (1, 'a', 100))
+
+    def test_expired_lease_is_requeued(self):
+        workqueue.enqueue(self.queue, self.plan('http://localhost/'))
+        task = self.queue.claim('a', lease=0.05)
+        self.assertTrue(self.queue.heartbeat(task, 'a', lease=0.05))
+        time.sleep(0.1)
+
+        claimed = self.queue.claim('b', lease=60)
+        self.assertEqual((claimed.id, claimed.attempts), (task.id, 2))
+        self.assertFalse(self.queue.heartbeat(task, 'a'))
+
+        # the late worker still completes the task, the new owner's copy is not counted twice
+        self.assertTrue(self.queue.complete(task, 'a', ['B4.TIF']))
+        self.assertFalse(self.queue.complete(claimed, 'b', ['B4.TIF']))
+        self.assertEqual(self.queue.counts()['done'], 1)
+        self.assertEqual(self.queue.counts()['leased'], 0)
+        self.assertEqual(self.queue.remaining(self.scene), 2)
+        self.assertEqual(self.queue.files(self.scene), ['B4.TIF'])
+
+    def test_fail_and_max_attempts(self):
+        workqueue.enqueue(self.queue, self.plan('http://localhost/'))
+        for i in range(3):
+            task = self.queue.claim('a')
+            self.assertEqual(task.attempts, i + 1)
+            self.queue.fail(task, 'a', ValueError('broken'))
+
+        self.assertEqual(self.queue.counts(), {'pending': 2, 'leased': 0, 'done': 0, 'failed': 1})
+        self.assertEqual(self.queue.errors(), {task.id: 'broken'})
+
+        task = self.queue.claim('a')
+        self.queue.fail(task, 'a', ValueError('missing'), retry=False)
+        self.assertEqual(self.queue.counts()['failed'], 2)
+
+    def test_nodes_share_the_queue(self):
+        """ Test two nodes download every file of a plan once and the scene is recorded in the manifest """
+
+        with FakeServer(self.files) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                nodes = [Landsat8(download_dir=self.temp_folder, max_workers=2) for i in range(2)]
+                nodes[0].enqueue(self.queue, self.plan(server.url))
+                nodes[1].enqueue(self.queue, self.plan(server.url))
+
+                results = []
+                threads = [threading.Thread(target=lambda n=n: results.append(n.work(self.queue))) for n in nodes]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+        self.assertEqual(sorted(p for m, p, r in server.requests if m == 'GET'), sorted(self.files))
+        self.assertEqual(sum(r['done'] for r in results), 3)
+        self.assertEqual(self.queue.counts()['done'], 3)
+
+        manifest = load_manifest(os.path.join(self.temp_folder, self.scene))
+        self.assertEqual(manifest['scenes'][self.scene]['source'], 's3')
+        self.assertEqual(len(manifest['scenes'][self.scene]['files']), 3)
+
+    def test_heartbeat_keeps_lease(self):
+        """ Test a transfer longer than the lease isn't claimed by another node """
+
+        with FakeServer(self.files, delays={self.prefix + '_B4.TIF': [0.4]}) as server:
+            with mock.patch('sdownloader.common.S3_LANDSAT', server.url):
+                workqueue.enqueue(self.queue, self.plan(server.url))
+                worker = workqueue.Worker(Landsat8(download_dir=self.temp_folder), self.queue, name='a',
+                                          lease=0.2, heartbeat=0.05)
+                task = self.queue.claim('a', lease=0.2)
+                thread = threading.Thread(target=worker.process, args=(task,))
+                thread.start()
+                time.sleep(0.3)
+                other = self.queue.claim('b')
+                thread.join()
+
+        self.assertNotEqual(other.id, task.id)
+        self.assertEqual(self.queue.counts()['done'], 1)
+
+
+class SQLiteQueueTests(QueueTests, unittest.TestCase):
+
+    def make_queue(self):
+        return workqueue.SQLiteQueue(os.path.join(self.temp_folder, 'queue.sqlite'))
+
+
+class RedisQueueTests(QueueTests, unittest.TestCase):
+
+    def make_queue(self):
+        return workqueue.RedisQueue(FakeRedis())
+
+    def test_claim_survives_a_crash(self):
+        """ Test a task popped by a node that died before writing its lease is requeued, not lost """
+
+        queue = workqueue.RedisQueue(FakeRedis(), claim_timeout=0.05)
+        workqueue.enqueue(queue, self.plan('http://localhost/'))
+        with mock.patch.object(queue.client, 'zadd', side_effect=RuntimeError('node died')):
+            self.assertRaises(RuntimeError, queue.claim, 'a')
+        self.assertEqual(queue.counts(), {'pending': 2, 'leased': 0, 'done': 0, 'failed': 0})
+
+        self.assertEqual(queue.requeue_expired(), 0)
+        time.sleep(0.1)
+        claimed = [queue.claim('b') for i in range(3)]
+
+        expected = [task.id for task in workqueue.tasks_of(self.plan('http://localhost/'))]
+        self.assertEqual(sorted(task.id for task in claimed), sorted(expected))
+        self.assertIsNone(queue.claim('b'))
+
+
+class WorkQueueTests(unittest.TestCase):
+
+    def test_backend_must_implement_the_interface(self):
+        class PutOnly(workqueue.WorkQueue):
+            def put(self, tasks):
+                return 0
+
+        self.assertRaises(TypeError, PutOnly)
+
+
+if __name__ == '__main__':
+    unittest.main()
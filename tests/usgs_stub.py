@@ -0,0 +1,29 @@
+""" A local stand-in for the USGS EarthExplorer API module used by sdownloader.landsat8 """
+from usgs import USGSError
+
+
+class USGSStub(object):
+    """ Issues numbered API keys and returns the download urls of the scenes in ``scenes`` (a dict of
+    scene id to url). ``expire`` invalidates the current key.
+    """
+
+    NAMESPACES = {}
+
+    def __init__(self, scenes=None):
+        self.scenes = scenes or {}
+        self.keys = []
+        self.expired = set()
+        self.calls = []
+
+    def login(self, username, password):
+        self.keys.append('key-%s' % (len(self.keys) + 1))
+        return self.keys[-1]
+
+    def expire(self):
+        self.expired.add(self.keys[-1])
+
+    def download(self, dataset, node, entityids, product='STANDARD', api_key=None):
+        if api_key not in self.keys or api_key in self.expired:
+            raise USGSError('AUTH_EXPIRED: API key has expired')
+        self.calls.append(list(entityids))
+        return [self.scenes[scene] for scene in entityids if scene in self.scenes]